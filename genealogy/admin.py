@@ -7,6 +7,7 @@ from .models import (
     FamilyEvent,
     Image,
     ImagePerson,
+    ImportJob,
     Person,
     Source, 
     Tree
@@ -17,6 +18,12 @@ class TreeAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'upload_date', 'name', 'gedcom_file']
     raw_id_fields = ['user']
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'tree', 'status', 'stage', 'persons', 'events', 'families', 'children', 'created', 'finished']
+    raw_id_fields = ['tree']
+    list_filter = ['status']
+
 @admin.register(Person)
 class PersonAdmin(admin.ModelAdmin):
     list_display = [
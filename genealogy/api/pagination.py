@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination, PageNumberPagination
+
+
+class PersonCursorPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    # Used unless the request asks for another order with ?ordering=
+    ordering = ('last_name', 'first_name', 'id')
+
+
+class DataQualityPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class PersonSearchPagination(LimitOffsetPagination):
+    default_limit = 50
+    max_limit = 500
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from genealogy.models import Person, Tree
+from genealogy.models import ImportJob, Person, Tree
+from genealogy.views.common import get_default_image, get_profile_photo
 
 class TreeSerializer(serializers.ModelSerializer):
     people = serializers.SerializerMethodField()
@@ -20,20 +21,45 @@ class TreeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Tree name cannot exceed 100 characters.")
         return value.strip()
     
-class PersonSearchSerializer(serializers.ModelSerializer):
-    birth_year = serializers.SerializerMethodField()
-    death_year = serializers.SerializerMethodField()
+class ImportJobSerializer(serializers.ModelSerializer):
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    stage_display = serializers.CharField(source='get_stage_display', read_only=True)
 
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'tree', 'status', 'status_display', 'stage', 'stage_display',
+            'persons', 'events', 'families', 'family_events', 'children',
+            'error', 'created', 'started', 'finished'
+        ]
+        read_only_fields = fields
+
+class PersonSearchSerializer(serializers.ModelSerializer):
     class Meta:
         model = Person
         fields = ['id', 'first_name', 'last_name', 'birth_year', 'death_year', 'tree']
 
-    def get_birth_year(self, obj):
-        return obj.get_birth_year()
-    
-    def get_death_year(self, obj):
-        return obj.get_death_year()
+class PublicPersonSearchSerializer(PersonSearchSerializer):
+    tree_name = serializers.CharField(source='tree.name', read_only=True)
+
+    class Meta(PersonSearchSerializer.Meta):
+        fields = PersonSearchSerializer.Meta.fields + ['tree_name']
     
+class PersonListSerializer(serializers.ModelSerializer):
+    """Compact person for lists, without the relatives and events in details"""
+    sex_display = serializers.CharField(source='get_sex_display', read_only=True)
+    profile_image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Person
+        fields = ['id', 'first_name', 'last_name', 'tree', 'sex', 'sex_display', 'birth_year', 'death_year', 'profile_image']
+        read_only_fields = fields
+
+    def get_profile_image(self, obj):
+        if obj.profile_image:
+            return get_profile_photo(obj)
+        return get_default_image(obj.sex)
+
 class PersonSerializer(serializers.ModelSerializer):
     sex_display = serializers.CharField(source='get_sex_display', read_only=True)
     details = serializers.SerializerMethodField()
@@ -46,8 +72,6 @@ class PersonSerializer(serializers.ModelSerializer):
     
     def get_profile_image(self, obj):
         """Return profile image URL or default avatar"""
-        from genealogy.views.common import get_default_image, get_profile_photo
-        
         if obj.profile_image:
             return get_profile_photo(obj)
         return get_default_image(obj.sex)
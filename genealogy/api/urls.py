@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested.routers import NestedDefaultRouter
-from .views import PersonSearchView, PersonViewSet, TreeViewSet
+from .views import PersonSearchView, PersonViewSet, PublicPersonSearchView, TreeViewSet
 
 app_name = 'api'
 
@@ -15,4 +15,5 @@ urlpatterns = [
     path('', include(router.urls)),
     path('', include(persons_router.urls)),
     path('search/', view=PersonSearchView.as_view(), name='person-search'),
+    path('search/public/', view=PublicPersonSearchView.as_view(), name='public-person-search'),
 ]
\ No newline at end of file
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.db import transaction
 from django.db.models import Q, OuterRef, Subquery, PositiveSmallIntegerField
 from django.shortcuts import get_object_or_404
+from django.utils.http import urlencode
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -8,25 +10,71 @@ from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.reverse import reverse
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 
-from genealogy.constants import NAMES_REPLACE, SURNAMES_REPLACE
 from genealogy.date_functions import extract_year
-from genealogy.models import Person, Tree, Family, Child, Event, FamilyEvent, Image, ImagePerson
-from genealogy import gedcom
+from genealogy.descendants import Descendants
+from genealogy.graph import get_tree_graph
+from genealogy.models import Person, Tree, Family, Child, DataQualityWarning, Event, FamilyEvent, Image, ImagePerson
+from genealogy.name_functions import get_name_key, get_phonetic_keys, has_variants
+from genealogy.pedigree import Pedigree, get_generations
+from genealogy.relationship import get_relationship
+from genealogy.search import PersonTextSearch, get_name_rank
+from genealogy.tasks import start_import
+from genealogy.typeahead import DEFAULT_LIMIT, MAX_LIMIT, get_typeahead_index
 from genealogy.views.common import get_default_image, get_profile_photo
-from .serializers import PersonSearchSerializer, PersonSerializer, TreeSerializer
+from .pagination import DataQualityPagination, PersonCursorPagination, PersonSearchPagination
+from .serializers import (
+    ImportJobSerializer, PersonListSerializer, PersonSearchSerializer, PersonSerializer, PublicPersonSearchSerializer,
+    TreeSerializer,
+)
 
-from functools import reduce
 
 class PersonViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = PersonSerializer
-    
+    pagination_class = PersonCursorPagination
+    filter_backends = [OrderingFilter]
+    # Cursor pagination needs fields without empty values to order by
+    ordering_fields = ['last_name', 'first_name', 'id']
+
     def get_queryset(self):
-        return Person.objects.filter(
+        queryset = Person.objects.filter(
             tree__id=self.kwargs["tree_pk"],
             tree__user=self.request.user,
-        )
+        ).select_related('profile_image')
+        if self.include_details():
+            queryset = queryset.with_vital_events()
+        if self.action == 'list':
+            queryset = self.filter_ancestry(queryset)
+        return queryset
+
+    def filter_ancestry(self, queryset):
+        """Only the ancestors or descendants of a person with ?ancestors_of= or ?descendants_of=."""
+        for param in ('ancestors_of', 'descendants_of'):
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            if not settings.ANCESTOR_CLOSURE:
+                raise ValidationError({param: 'Ancestry filters need the ANCESTOR_CLOSURE setting.'})
+            if not value.isdigit():
+                raise ValidationError({param: 'A person id is needed.'})
+            queryset = getattr(queryset, param)(int(value))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list' and not self.include_details():
+            return PersonListSerializer
+        return PersonSerializer
+
+    def include_details(self):
+        """Lists leave out details unless asked for with ?fields=details"""
+        if self.action != 'list':
+            return True
+        fields = self.request.query_params.get('fields', '')
+        return 'details' in fields.split(',')
     
     @action(detail=True, methods=['get'])
     def images(self, request, tree_pk=None, pk=None):
@@ -711,9 +759,17 @@ class PersonViewSet(ModelViewSet):
 
 class PersonSearchView(APIView):
     permission_classes = [IsAuthenticated]
+    serializer_class = PersonSearchSerializer
+
+    def get_persons(self, request):
+        """The persons to search in, and their tree if they are all in one."""
+        tree = request.query_params.get('tree', '')
+        if not tree.isdigit():
+            raise ValidationError({'tree': 'A tree id is needed.'})
+        return Person.objects.filter(tree=tree), int(tree)
 
     def get(self, request):
-        tree = request.query_params.get('tree')
+        persons, tree = self.get_persons(request)
 
         first_name = request.query_params.get('first_name')
         last_name = request.query_params.get('last_name')
@@ -725,79 +781,84 @@ class PersonSearchView(APIView):
         birth_year_to = request.query_params.get('birth_year_to')
         death_year_from = request.query_params.get('death_year_from')
         death_year_to = request.query_params.get('death_year_to')
+        for param in ('birth_year_from', 'birth_year_to', 'death_year_from', 'death_year_to'):
+            try:
+                int(request.query_params.get(param) or 0)
+            except ValueError:
+                raise ValidationError({param: 'A year is needed.'})
+        # Find names that sound like the given ones, instead of names that contain them
+        phonetic = request.query_params.get('phonetic') == '1'
 
-        name_conditions = []
+        text_search = PersonTextSearch(tree)
         birth_conditions = []
         death_conditions = []
 
-        if first_name:
-            name_strings = first_name.split()
-            name_or_conditions = []
-            for name in name_strings:
-                found_first = False
-                for n in NAMES_REPLACE:
-                    if name in n:
-                        found_first = True
-                        for variation in n:
-                            name_or_conditions.append(Q(first_name__icontains=variation))
-                if not found_first:    
-                    name_or_conditions.append(Q(first_name__icontains=name))
-            name_or_conditions = reduce(lambda x, y: x | y, name_or_conditions)
-            if name_conditions:
-                name_conditions = name_conditions & name_or_conditions
-            else:
-                name_conditions = name_or_conditions
-
-        if last_name:
-            name_strings = last_name.split()
-            name_or_conditions = []
-            for name in name_strings:
-                found_last = False
-                for n in SURNAMES_REPLACE:
-                    if name in n:
-                        found_last = True
-                        for variation in n:
-                            name_or_conditions.append(Q(last_name__icontains=variation))
-                if not found_last:
-                    name_or_conditions.append(Q(last_name__icontains=name))
-            name_or_conditions = reduce(lambda x, y: x | y, name_or_conditions)
-            if name_conditions:
-                name_conditions = name_conditions & name_or_conditions
+        for field, kind, names in (('first_name', 'first', first_name), ('last_name', 'last', last_name)):
+            if not names:
+                continue
+            phonetic_keys = [(kind, key) for key in get_phonetic_keys(names, kind) if key] if phonetic else []
+            if phonetic_keys:
+                text_search.add([], phonetic_keys, phonetic=True)
             else:
-                name_conditions = name_or_conditions
-        
+                # Names that can be spelled in different ways are found through their name keys
+                text_search.add(
+                    [(field, name) for name in names.split() if not has_variants(name, kind)],
+                    [(kind, get_name_key(name, kind)) for name in names.split() if has_variants(name, kind)],
+                )
+
         if birth_place:
-            birth_conditions.append(Q(event__place__icontains=birth_place))
+            text_search.add([('birth_place', birth_place)])
         if birth_year:
-            birth_conditions.append(Q(event__date__icontains=birth_year))
+            birth_conditions.append(Q(birth_date__icontains=birth_year))
         if birth_year_from:
-            birth_conditions.append(Q(event__year__gte=birth_year_from))
+            birth_conditions.append(Q(birth_year__gte=birth_year_from))
         if birth_year_to:
-            birth_conditions.append(Q(event__year__lte=birth_year_to))
+            birth_conditions.append(Q(birth_year__lte=birth_year_to))
         if death_place:
-            death_conditions.append(Q(event__place__icontains=death_place))
+            text_search.add([('death_place', death_place)])
         if death_year:
-            death_conditions.append(Q(event__date__icontains=death_year))
+            death_conditions.append(Q(death_date__icontains=death_year))
         if death_year_from:
-            death_conditions.append(Q(event__year__gte=death_year_from))
+            death_conditions.append(Q(death_year__gte=death_year_from))
         if death_year_to:
-            death_conditions.append(Q(event__year__lte=death_year_to))
+            death_conditions.append(Q(death_year__lte=death_year_to))
+
+        final_query = Q()
+        if text_search:
+            final_query = final_query & text_search.get_q()
+        for condition in birth_conditions + death_conditions:
+            final_query = final_query & condition
+
+        # Best matches first, see get_name_rank
+        names = [
+            (kind, name)
+            for kind, names in (('first', first_name), ('last', last_name)) if names
+            for name in names.split()
+        ]
+        queryset = persons.filter(final_query).annotate(rank=get_name_rank(names)).order_by(
+            'rank', 'last_name', 'first_name', 'id'
+        )
 
-        final_query = Q(tree=tree)
-        if name_conditions:
-            final_query = final_query & name_conditions
+        paginator = PersonSearchPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.serializer_class(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-        queryset = Person.objects.filter(final_query)
+class PublicPersonSearchView(PersonSearchView):
+    """
+    Search the persons in the public trees of all users, with the same
+    parameters as PersonSearchView except tree. Living persons are left out.
+    """
+    serializer_class = PublicPersonSearchSerializer
 
-        if birth_conditions:
-            birth_query = Q(event__event_type='birth') & reduce(lambda x, y: x & y, birth_conditions)
-            queryset = queryset.filter(birth_query)
-        if death_conditions:
-            death_query = Q(event__event_type='death') & reduce(lambda x, y: x & y, death_conditions)
-            queryset = queryset.filter(death_query)
+    def get_persons(self, request):
+        return Person.objects.filter(tree__private=False).not_living().select_related('tree'), None
 
-        serializer = PersonSearchSerializer(queryset, many=True)
-        return Response(serializer.data)
+    def get(self, request):
+        # Searching every public tree needs a name to narrow it down
+        if not (request.query_params.get('first_name') or request.query_params.get('last_name')):
+            raise ValidationError({'error': 'Give a first_name or last_name to search public trees.'})
+        return super().get(request)
     
 class TreeViewSet(ModelViewSet):
     serializer_class = TreeSerializer
@@ -822,21 +883,20 @@ class TreeViewSet(ModelViewSet):
 
         # Handle GEDCOM file if provided
         gedcom_file = request.FILES.get('gedcom_file')
+        headers = self.get_success_headers(serializer.data)
         if gedcom_file:
             tree.gedcom_file = gedcom_file
             tree.save(update_fields=['gedcom_file'])  # Save file
 
-            try:
-                gedcom.handle_uploaded_file(tree)
-            except Exception as e:
-                # Optional: delete tree on parse failure?
-                tree.delete()
-                return Response(
-                    {"error": "GEDCOM processing failed", "details": str(e)},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            # The file is imported in the background, progress is reported by import-status
+            job = start_import(tree)
+            # Without a broker the import has already run
+            job.refresh_from_db()
+
+            data = dict(serializer.data)
+            data['import_job'] = ImportJobSerializer(job).data
+            return Response(data, status=status.HTTP_202_ACCEPTED, headers=headers)
 
-        headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def perform_destroy(self, instance):
@@ -847,30 +907,61 @@ class TreeViewSet(ModelViewSet):
             instance.gedcom_file.delete(save=False)
         instance.delete()
 
+    @action(detail=True, methods=['get'], url_path='import-status')
+    def import_status(self, request, pk=None):
+        tree = self.get_object()
+
+        job = tree.import_jobs.first()
+        if not job:
+            return Response(
+                {"error": "No GEDCOM import found for this tree"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response(ImportJobSerializer(job).data)
+
     @action(detail=True, methods=['get'], url_path='data_quality')
     def data_quality(self, request, pk=None):
+        """
+        The stored data quality warnings of the tree, grouped by person and
+        paginated. ?code= only includes the warnings with that code.
+        """
         tree = self.get_object()
 
-        items = []
-        for person in Person.objects.filter(tree=tree).order_by('last_name', 'first_name', 'id'):
-            warnings = person.get_data_quality_warnings()
-            if not warnings:
-                continue
+        warnings = DataQualityWarning.objects.filter(tree=tree)
+        code = request.query_params.get('code')
+        if code:
+            warnings = warnings.filter(code=code)
 
+        persons = Person.objects.filter(
+            id__in=warnings.values('person_id')
+        ).order_by('last_name', 'first_name', 'id')
+
+        paginator = DataQualityPagination()
+        page = paginator.paginate_queryset(persons, request, view=self)
+
+        person_warnings = {}
+        for warning in warnings.filter(person__in=page).values('person_id', 'code', 'message'):
+            person_warnings.setdefault(warning.pop('person_id'), []).append(warning)
+
+        items = []
+        for person in page:
             items.append({
                 'person': {
                     'id': person.id,
                     'name': person.get_name_years() or f'Person #{person.id}',
                 },
-                'warning_count': len(warnings),
-                'warnings': warnings,
+                'warning_count': len(person_warnings[person.id]),
+                'warnings': person_warnings[person.id],
             })
 
         return Response({
             'tree_id': tree.id,
             'tree_name': tree.name,
-            'people_with_warnings': len(items),
-            'total_warnings': sum(item['warning_count'] for item in items),
+            'people_with_warnings': paginator.page.paginator.count,
+            'total_warnings': warnings.count(),
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
             'items': items,
         })
     
@@ -916,9 +1007,10 @@ class TreeViewSet(ModelViewSet):
             )
         
         # Build tree data
-        generations = 3
+        generations = get_generations(request.query_params.get('generations'))
+        pedigree = Pedigree(get_tree_graph(tree, first_person.id), first_person, generations)
         people_data = self._get_person_tree_data(first_person, tree.id)
-        people_data['parents'] = self._tree_get_parents(first_person, 1, generations, tree.id)
+        people_data['parents'] = self._tree_get_parents(first_person, 1, generations, tree.id, pedigree)
         
         # Get partner and children
         family = Family.objects.filter(Q(husband=first_person) | Q(wife=first_person)).first()
@@ -947,9 +1039,130 @@ class TreeViewSet(ModelViewSet):
             'tree_id': tree.id,
             'tree_name': tree.name,
             'person_count': person_count,
+            'generations': generations,
             'tree_data': people_data
         })
     
+    @action(detail=True, methods=['get'], url_path='descendants/(?P<person_pk>[^/.]+)')
+    def descendants(self, request, pk=None, person_pk=None):
+        """
+        Get the descendants of a person with their partners, for a descendant chart
+        Returns: The person with families, each with a partner and children, for
+        ?generations= generations. Persons where the chart stops although they have
+        children are marked as truncated, with a cursor URL that loads their branch.
+        Persons that are already in the chart are marked as repeated, without their families.
+        """
+        tree = self.get_object()
+
+        try:
+            person = Person.objects.select_related('profile_image').get(pk=person_pk, tree=tree)
+        except (Person.DoesNotExist, ValueError):
+            return Response(
+                {"error": "Person not found in this tree"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        generations = get_generations(request.query_params.get('generations'))
+        descendants = Descendants(get_tree_graph(tree, person.id), person, generations)
+
+        return Response({
+            'tree_id': tree.id,
+            'tree_name': tree.name,
+            'generations': generations,
+            'truncated': bool(descendants.truncated),
+            'tree_data': self._tree_get_descendants(request, person, 1, tree.id, descendants),
+        })
+
+    def _tree_get_descendants(self, request, person, generation, tree_id, descendants, rendered=None):
+        """
+        Helper method to recursively get the families of a person from the loaded Descendants.
+        A person reached again, like the children of two cousins that married, is only
+        marked as repeated the second time, so the size of the chart follows the number of persons.
+        """
+        data = self._get_person_tree_data(person, tree_id)
+        data['families'] = []
+
+        if rendered is None:
+            rendered = set()
+        if person.id in rendered:
+            data['repeated'] = True
+            return data
+        rendered.add(person.id)
+
+        if person.id in descendants.truncated:
+            data['truncated'] = True
+            url = reverse('api:tree-descendants', kwargs={'pk': tree_id, 'person_pk': person.id}, request=request)
+            data['cursor'] = f"{url}?{urlencode({'generations': descendants.generations})}"
+
+        if generation < descendants.generations:
+            for family_id, partner, children in descendants.get_families(person):
+                data['families'].append({
+                    'family_id': family_id,
+                    'partner': self._get_person_tree_data(partner, tree_id) if partner else None,
+                    'children': [
+                        self._tree_get_descendants(request, child, generation + 1, tree_id, descendants, rendered)
+                        for child in children
+                    ],
+                })
+
+        return data
+
+    @action(detail=True, methods=['get'], url_path='relationship/(?P<person_pk>[^/.]+)/(?P<other_pk>[^/.]+)')
+    def relationship(self, request, pk=None, person_pk=None, other_pk=None):
+        """
+        Get how a person is related to another person in the tree
+        Returns: A label like "second cousin once removed", the generations from
+        each person up to their closest common ancestors, the ancestors and the
+        path between the persons. The label is null if no relationship was found.
+        """
+        tree = self.get_object()
+
+        try:
+            person_id, other_id = int(person_pk), int(other_pk)
+        except ValueError:
+            person_id = other_id = None
+        if Person.objects.filter(tree=tree, pk__in=[person_id, other_id]).count() != len({person_id, other_id}):
+            return Response(
+                {"error": "Person not found in this tree"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response({
+            'tree_id': tree.id,
+            'person_id': person_id,
+            'other_id': other_id,
+            **get_relationship(tree, person_id, other_id),
+        })
+
+    @action(detail=True, methods=['get'])
+    def typeahead(self, request, pk=None):
+        """
+        Find persons for a person picker while the user types
+        Returns: At most ?limit= persons with names starting with every word in ?q=,
+        and the birth and death years in it. An empty ?q= returns no persons but
+        loads the tree's index, so a picker can ask for it when it opens.
+        """
+        tree = self.get_object()
+        try:
+            limit = min(max(int(request.query_params.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            limit = DEFAULT_LIMIT
+
+        person_ids = get_typeahead_index(tree).search(request.query_params.get('q', ''), limit)
+        persons = Person.objects.in_bulk(person_ids)
+        return Response({
+            'tree_id': tree.id,
+            'results': [
+                {
+                    'id': person_id,
+                    'full_name': persons[person_id].get_name_years(),
+                    'birth_year': persons[person_id].birth_year,
+                    'death_year': persons[person_id].death_year,
+                }
+                for person_id in person_ids if person_id in persons
+            ],
+        })
+
     def _get_person_tree_data(self, person, tree_id):
         """Helper method to get person data for tree visualization"""
         return {
@@ -962,14 +1175,14 @@ class TreeViewSet(ModelViewSet):
             'tree_url': f'/tree/{tree_id}/person/{person.id}',
         }
     
-    def _tree_get_parents(self, current_person, generation, max_generation, tree_id):
-        """Helper method to recursively get parents"""
+    def _tree_get_parents(self, current_person, generation, max_generation, tree_id, pedigree):
+        """Helper method to recursively get parents from the loaded Pedigree"""
         if generation == max_generation:
             return []
         
         parents = []
-        father = current_person.get_father()
-        mother = current_person.get_mother()
+        father = pedigree.get_father(current_person)
+        mother = pedigree.get_mother(current_person)
         
         if father:
             parents.append({
@@ -981,7 +1194,7 @@ class TreeViewSet(ModelViewSet):
                 'person_url': f'/tree/{tree_id}/person/{father.id}',
                 'tree_url': f'/tree/{tree_id}/person/{father.id}',
                 'parent_type': 'father',
-                'parents': self._tree_get_parents(father, generation + 1, max_generation, tree_id)
+                'parents': self._tree_get_parents(father, generation + 1, max_generation, tree_id, pedigree)
             })
         else:
             parents.append({
@@ -1002,7 +1215,7 @@ class TreeViewSet(ModelViewSet):
                 'person_url': f'/tree/{tree_id}/person/{mother.id}',
                 'tree_url': f'/tree/{tree_id}/person/{mother.id}',
                 'parent_type': 'mother',
-                'parents': self._tree_get_parents(mother, generation + 1, max_generation, tree_id)
+                'parents': self._tree_get_parents(mother, generation + 1, max_generation, tree_id, pedigree)
             })
         else:
             parents.append({
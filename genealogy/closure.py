@@ -0,0 +1,107 @@
+from django.db import transaction
+
+from .models import AncestorLink, Child, Person
+
+# Rows written at a time, and ids in each IN list
+BATCH_SIZE = 1000
+
+
+def batches(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), BATCH_SIZE):
+        yield ids[i:i + BATCH_SIZE]
+
+def get_ancestors(person_ids, parents, known):
+    """
+    The ancestors of the persons in person_ids as person id -> {ancestor id:
+    depth}. parents holds the parent ids of the persons, and known the
+    ancestors of parents that aren't in person_ids. Every person's parents are
+    walked one generation at a time, so each ancestor gets its shortest depth,
+    also in trees where someone is wrongly linked as their own ancestor.
+    """
+    ancestors = {}
+    for person_id in person_ids:
+        person_ancestors = {}
+        generation = [person_id]
+        depth = 0
+        while generation:
+            depth += 1
+            next_generation = []
+            for child_id in generation:
+                for parent_id in parents.get(child_id, ()):
+                    if parent_id == person_id or person_ancestors.get(parent_id, depth + 1) <= depth:
+                        continue
+                    person_ancestors[parent_id] = depth
+                    if parent_id in person_ids:
+                        next_generation.append(parent_id)
+                        continue
+                    # The ancestors of persons outside person_ids are already known
+                    for ancestor_id, ancestor_depth in known.get(parent_id, {}).items():
+                        if ancestor_id != person_id and depth + ancestor_depth < person_ancestors.get(ancestor_id, depth + ancestor_depth + 1):
+                            person_ancestors[ancestor_id] = depth + ancestor_depth
+            generation = next_generation
+        ancestors[person_id] = person_ancestors
+    return ancestors
+
+def get_parents(child_rows):
+    parents = {}
+    for person_id, husband_id, wife_id in child_rows:
+        parents.setdefault(person_id, set()).update(p for p in (husband_id, wife_id) if p is not None and p != person_id)
+    return parents
+
+def save_links(ancestors, tree_ids):
+    AncestorLink.objects.bulk_create(
+        (
+            AncestorLink(tree_id=tree_ids[person_id], ancestor_id=ancestor_id, descendant_id=person_id, depth=depth)
+            for person_id, person_ancestors in ancestors.items()
+            for ancestor_id, depth in person_ancestors.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+def rebuild_tree_links(tree):
+    """Replace the AncestorLink rows of the tree. Returns the number of rows."""
+    person_ids = set(Person.objects.filter(tree=tree).values_list('id', flat=True))
+    parents = get_parents(
+        Child.objects.filter(family__tree=tree).values_list('person_id', 'family__husband_id', 'family__wife_id').iterator(chunk_size=5000)
+    )
+    ancestors = get_ancestors(person_ids, parents, {})
+    with transaction.atomic():
+        AncestorLink.objects.filter(tree=tree).delete()
+        save_links(ancestors, {person_id: tree.pk for person_id in person_ids})
+    return sum(len(person_ancestors) for person_ancestors in ancestors.values())
+
+def update_links(person_ids):
+    """
+    Replace the AncestorLink rows of the persons whose parents changed, and of
+    their descendants. The ancestors of everyone else stay the same, so the
+    ones of parents outside that group are read from the table.
+    """
+    tree_ids = {}
+    for batch in batches(person_ids):
+        tree_ids.update(Person.objects.filter(id__in=batch).values_list('id', 'tree_id'))
+        tree_ids.update(
+            AncestorLink.objects.filter(ancestor_id__in=batch).values_list('descendant_id', 'tree_id')
+        )
+    if not tree_ids:
+        return
+
+    parents = {}
+    for batch in batches(tree_ids):
+        parents.update(get_parents(
+            Child.objects.filter(person_id__in=batch).values_list('person_id', 'family__husband_id', 'family__wife_id')
+        ))
+
+    known = {}
+    outside_ids = {parent_id for person_parents in parents.values() for parent_id in person_parents} - tree_ids.keys()
+    for batch in batches(outside_ids):
+        for ancestor_id, descendant_id, depth in AncestorLink.objects.filter(descendant_id__in=batch).values_list(
+            'ancestor_id', 'descendant_id', 'depth'
+        ):
+            known.setdefault(descendant_id, {})[ancestor_id] = depth
+
+    ancestors = get_ancestors(tree_ids.keys(), parents, known)
+    with transaction.atomic():
+        for batch in batches(tree_ids):
+            AncestorLink.objects.filter(descendant_id__in=batch).delete()
+        save_links(ancestors, tree_ids)
@@ -24,4 +24,8 @@ SURNAMES_REPLACE = [
     ["Eriksdotter", "Ersdotter"],
     ["Olofsson", "Olsson"],
     ["Olofsdotter", "Olsdotter"],
-]
\ No newline at end of file
+]
+
+# Persons born less than this many years ago without a known death may still
+# be alive, and are left out of searches in other users' trees
+LIVING_YEARS = 100
@@ -0,0 +1,85 @@
+from .models import Person
+from .neighbourhood import by_year
+
+# The most persons in one descendant chart. Deeper generations are left out
+# and can be loaded from the persons where the chart stops.
+MAX_PERSONS = 500
+
+
+class Descendants:
+    """
+    The descendants of a person and their partners, for a chart of the given
+    number of generations with the person as the first. The families are
+    found in the tree's TreeGraph and the persons are loaded in one query.
+
+    A generation that would take the chart above max_persons is left out, as
+    are the generations after the last one. The persons of the last generation
+    in the chart that have children are in truncated.
+    """
+    def __init__(self, graph, person, generations, max_persons=MAX_PERSONS):
+        self.person = person
+        self.generations = generations
+        # person id -> [(family id, partner id, [child ids])]
+        self.families = {}
+        self.truncated = set()
+
+        seen = {person.id}
+        level = [person.id]
+        for generation in range(generations):
+            families = self.load_families(graph, level)
+
+            new_ids = set()
+            for person_families in families.values():
+                for _, partner_id, child_ids in person_families:
+                    new_ids.update(child_ids)
+                    new_ids.add(partner_id)
+            new_ids.discard(None)
+            new_ids -= seen
+
+            last = generation == generations - 1
+            # The children of the person are always shown
+            too_many = generation > 0 and len(seen) + len(new_ids) > max_persons
+            if last or too_many:
+                self.truncated = {
+                    person_id for person_id, person_families in families.items()
+                    if any(child_ids for _, _, child_ids in person_families)
+                }
+                break
+
+            self.families.update(families)
+            # A person can be found again through cousin marriages or wrong links,
+            # their descendants are only added the first time
+            level = [
+                child_id
+                for person_families in families.values()
+                for _, _, child_ids in person_families
+                for child_id in child_ids
+                if child_id in new_ids
+            ]
+            seen |= new_ids
+            if not level:
+                break
+
+        self.persons = Person.objects.select_related('profile_image').in_bulk(seen - {person.id})
+        self.persons[person.id] = person
+
+    @staticmethod
+    def load_families(graph, person_ids):
+        """The families of the persons with their partners and children, the children ordered by birth year."""
+        families = {}
+        for person_id in person_ids:
+            person_families = [
+                # The graph has the children in the order they were added, which sorting keeps for equal years
+                (family_id, partner_id, sorted(child_ids, key=lambda child_id: by_year(graph.get_birth_year(child_id))))
+                for family_id, partner_id, child_ids in graph.get_families(person_id)
+            ]
+            if person_families:
+                families[person_id] = person_families
+        return families
+
+    def get_families(self, person):
+        """The families of the person in the chart as (family id, partner, children) tuples."""
+        return [
+            (family_id, self.persons.get(partner_id), [self.persons[child_id] for child_id in child_ids])
+            for family_id, partner_id, child_ids in self.families.get(person.id, [])
+        ]
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+
+from .gedcom import export_tree
+from .models import Tree
+
+
+def export_response(request, tree):
+    """
+    Respond with the tree as a GEDCOM file, gzipped if the request has gzip=1.
+    The file is saved in GEDCOM_EXPORT_CACHE_DIR while it is streamed, and sent
+    from there until the tree changes. Clients that already have the current
+    version get a 304 through the ETag.
+    """
+    compress = request.GET.get('gzip') == '1'
+    name = cache_name(tree, compress)
+    etag = f'"{name}"'
+
+    if etag in request.headers.get('If-None-Match', ''):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    filename = f"{tree.name}.ged.gz" if compress else f"{tree.name}.ged"
+    content_type = "application/gzip" if compress else "text/plain"
+    path = os.path.join(settings.GEDCOM_EXPORT_CACHE_DIR, name)
+
+    try:
+        # Mark the file as recently used, so it's the last to be evicted
+        os.utime(path)
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename, content_type=content_type)
+    except FileNotFoundError:
+        chunks = (chunk.encode('utf-8') for chunk in export_tree(tree))
+        if compress:
+            chunks = gzip_chunks(chunks)
+        response = StreamingHttpResponse(save_chunks(chunks, tree, path), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    response["ETag"] = etag
+    return response
+
+def cache_name(tree, compress):
+    # The tree name is written to the file, so renaming a tree also needs a new file
+    name_hash = hashlib.sha1(tree.name.encode('utf-8')).hexdigest()[:8]
+    return f"{tree.pk}-{tree.version}-{name_hash}.ged" + (".gz" if compress else "")
+
+def gzip_chunks(chunks):
+    # wbits 31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def save_chunks(chunks, tree, path):
+    """Yield the chunks and write them to path, which is only created once the whole file has been written."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        # Don't keep the file if the tree was changed while it was written
+        if Tree.objects.filter(pk=tree.pk, version=tree.version).exists():
+            os.replace(temp_path, path)
+            evict(tree)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def evict(tree):
+    """Remove older versions of the tree's files, then the least recently used files until the cache fits its size limit."""
+    directory = settings.GEDCOM_EXPORT_CACHE_DIR
+    current = {cache_name(tree, False), cache_name(tree, True)}
+
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.tmp'):
+            continue
+        if entry.name.startswith(f"{tree.pk}-") and entry.name not in current:
+            remove(entry.path)
+            continue
+        stat = entry.stat()
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(file_size for _, file_size, _ in files)
+    for _, file_size, file_path in sorted(files):
+        if size <= settings.GEDCOM_EXPORT_CACHE_SIZE:
+            break
+        remove(file_path)
+        size -= file_size
+
+def remove(path):
+    # Another request may have removed the file already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
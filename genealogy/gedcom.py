@@ -1,39 +1,40 @@
 import argparse
+import datetime
 import io
+import logging
+import multiprocessing
 import os
 import re
+import sys
 
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+from django.conf import settings
+from django.db import transaction
+
+from genealogy.closure import rebuild_tree_links
 from genealogy.models import Child, Event, Family, FamilyEvent, Person, Tree
+from genealogy.quality import save_tree_warnings
+from genealogy.search import index_tree
 import genealogy.date_functions as df
 
 CURRENT_DIR = os.path.abspath(os.path.dirname(__file__))
 GEDFILE = os.path.join(CURRENT_DIR, 'Danielsson-1.ged')
 
-# HEAD
-HEAD_REGEX = re.compile('^([0-9]) HEAD')
-TREE_REGEX = re.compile('^([0-9]) _TREE (.*)')
-
-# INDI
-INDI_REGEX = re.compile('^([0-9]) (@I[0-9]+@) INDI')
-NAME_REGEX = re.compile('^([0-9]) NAME')
-GIVN_REGEX = re.compile('^([0-9]) GIVN (.*)')
-SURN_REGEX = re.compile('^([0-9]) SURN (.*)')
-FAMS_REGEX = re.compile('^([0-9]) FAMS (@F[0-9]+@)')
-FAMC_REGEX = re.compile('^([0-9]) FAMC (@F[0-9]+@)')
-SEX_REGEX = re.compile('([0-9]) SEX ([F|M])')
-BIRT_REGEX = re.compile('([0-9]) BIRT')
-DEAT_REGEX = re.compile('([0-9]) DEAT')
-DATE_REGEX = re.compile('([0-9]) DATE (.*)')
-PLAC_REGEX = re.compile('([0-9]) PLAC (.*)')
-DCAUSE_REGEX = re.compile('[0-9] _DCAUSE')
-NOTE_REGEX = re.compile('([0-9]) NOTE (.*)')
-EVENT_REGEX = re.compile('1 ([A-Z]+)')
-
-# FAM
-FAM_REGEX = re.compile('^([0-9]) (@F[0-9]+@) FAM')
-WIFE_REGEX = re.compile('([0-9]) WIFE (@I[0-9]+@)')
-HUSB_REGEX = re.compile('([0-9]) HUSB (@I[0-9]+@)')
-CHIL_REGEX = re.compile('([0-9]) CHIL (@I[0-9]+@)')
+logger = logging.getLogger(__name__)
+
+# Number of rows sent to the database in each bulk insert when importing
+BATCH_SIZE = 1000
+
+# Number of level 0 records in each chunk handed to a worker process when parsing in parallel
+CHUNK_RECORDS = 2000
+
+# A GEDCOM line: level, optional cross-reference id, tag and optional value
+LINE_REGEX = re.compile(r'^\s*([0-9]+)\s+(?:(@[^@]+@)\s+)?(\S+)(?: (.*))?$')
+LEVEL_0_REGEX = re.compile(r'^\s*0\s')
 
 EVENT_MAPPING = {
     'RESI': 'residence',
@@ -60,7 +61,100 @@ ONE_TIME_EVENTS = [
     'DEAT',
 ]
 
+# Event type -> GEDCOM tag, for exporting
+EVENT_TAGS = {event_type: tag for tag, event_type in EVENT_MAPPING.items()}
+FAMILY_EVENT_TAGS = {event_type: tag for tag, event_type in FAMILY_EVENT_MAPPING.items()}
+
+# Every event type gets a small code so that the type of each parsed event
+# fits in a single byte
+EVENT_TYPES = list(EVENT_MAPPING.values()) + list(FAMILY_EVENT_MAPPING.values())
+EVENT_TYPE_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+
+GedcomLine = namedtuple('GedcomLine', ['level', 'xref', 'tag', 'value'])
+GedcomEvent = namedtuple('GedcomEvent', ['type', 'date', 'place', 'description'])
+
+
+def tokenize(lines):
+    """Turn an iterable of raw GEDCOM lines into GedcomLine tuples, skipping blank and malformed lines."""
+    for line in lines:
+        matches = LINE_REGEX.match(line.rstrip('\r\n'))
+        if not matches:
+            continue
+        level, xref, tag, value = matches.groups()
+        yield GedcomLine(int(level), xref, tag, (value or '').strip())
+
+
+def group_records(tokens):
+    """Group GedcomLine tuples into level 0 records, yielding each record once the next one starts."""
+    record = []
+    for token in tokens:
+        if token.level == 0 and record:
+            yield record
+            record = []
+        if token.level == 0 or record:
+            record.append(token)
+    if record:
+        yield record
+
+
+def read_chunks(file, records=CHUNK_RECORDS):
+    """Read the file and yield its raw lines in chunks of whole level 0 records."""
+    chunk = []
+    count = 0
+    with io.open(file, mode='r', encoding='utf-8-sig') as f:
+        for line in f:
+            if LEVEL_0_REGEX.match(line):
+                if count == records:
+                    yield chunk
+                    chunk = []
+                    count = 0
+                count += 1
+            chunk.append(line)
+    if chunk:
+        yield chunk
+
+
+def parse_chunk(lines):
+    """Parse a chunk of lines from read_chunks. Runs in a worker process when parsing in parallel."""
+    gedcom_tree = Gedcom(file=None)
+    records = list(gedcom_tree.parse_lines(lines))
+    return gedcom_tree.name, records
+
+
+class EventList:
+    """
+    The events of a person or family, kept in parallel arrays instead of one
+    object per event. Places and dates are interned since the same few values
+    are repeated throughout a file. Iterating gives GedcomEvent tuples.
+    """
+    __slots__ = ('types', 'dates', 'places', 'descriptions')
+
+    def __init__(self):
+        self.types = array('B')
+        self.dates = []
+        self.places = []
+        self.descriptions = []
+
+    def append(self, event_type, date='', place='', description=''):
+        self.types.append(EVENT_TYPE_CODES[event_type])
+        self.dates.append(sys.intern(date))
+        self.places.append(sys.intern(place))
+        self.descriptions.append(description)
+
+    def has_type(self, event_type):
+        return EVENT_TYPE_CODES[event_type] in self.types
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        for code, date, place, description in zip(self.types, self.dates, self.places, self.descriptions):
+            yield GedcomEvent(EVENT_TYPES[code], date, place, description)
+
+
 class Ind:
+    __slots__ = ('id', 'sex', 'given_name', 'surname', 'fams', 'famc', 'death_cause', 'events')
+
     def __init__(self, indi_id):
         self.id = indi_id
         self.sex = ''
@@ -68,8 +162,8 @@ class Ind:
         self.surname = ''
         self.fams = ''
         self.famc = ''
-        self.death = {'cause': ''}
-        self.events = []
+        self.death_cause = ''
+        self.events = EventList()
 
     def get_name(self):
         return f"{self.get_given_name()} {self.get_surname()}"
@@ -89,7 +183,7 @@ class Ind:
         return mapping[self.sex]
 
     def get_death_cause(self):
-        return self.death['cause']
+        return self.death_cause
 
     def __str__(self):
         return 'Namn: {} {}\nKön: {}'.format(
@@ -97,12 +191,14 @@ class Ind:
 
 
 class FamilyGC:
+    __slots__ = ('id', 'husband', 'wife', 'children', 'family_events')
+
     def __init__(self, fam_id):
         self.id = fam_id
         self.husband = ''
         self.wife = ''
         self.children = []
-        self.family_events = []
+        self.family_events = EventList()
 
 
 class Gedcom:
@@ -111,176 +207,164 @@ class Gedcom:
         self.individuals = {}
         self.families = {}
 
-        self.setup(file)
+        if file:
+            self.setup(file)
 
     def setup(self, file):
-        with io.open(file, mode='r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        for index, line in enumerate(lines):
-            current_index = index
-            # Match HEAD
-            if HEAD_REGEX.match(line.strip()):
-                self.parse_head(lines, current_index)
-
-            # Match INDI
-            if INDI_REGEX.match(line.strip()):
-                self.parse_indi(lines, current_index)
-
-            # Match FAM
-            if FAM_REGEX.match(line.strip()):
-                self.parse_fam(lines, current_index)
-
-    def parse_indi(self, lines, start_index):
-        matches = INDI_REGEX.match(lines[start_index])
-        level = matches.group(1)
-        indi_id = matches.group(2)
-        indi = Ind(indi_id)
-        current_index = start_index
-
-        for index, line in enumerate(lines[start_index + 1:]):
-            if line.startswith(level):
-                break
-            current_index += 1
-            current_line = line.strip()
-
-            # FAMS
-            matches = FAMS_REGEX.match(current_line)
-            if matches:
-                indi.fams = matches.group(2)
-
-            # FAMC
-            matches = FAMC_REGEX.match(current_line)
-            if matches:
-                indi.famc = matches.group(2)
-
-            # SEX
-            matches = SEX_REGEX.match(current_line)
-            if matches:
-                if matches.group(2) in ('M', 'F'):
-                    indi.sex = matches.group(2)
-                else:
-                    indi.sex = 'U'
-
-            # NAME
-            if NAME_REGEX.match(current_line):
-                givn, surn = self.parse_name(lines, current_index)
-                indi.given_name = givn
-                indi.surname = surn
-
-            # DCAUSE
-            if DCAUSE_REGEX.match(current_line):
-                matches = NOTE_REGEX.match(lines[index + 1].strip())
-                if matches:
-                    indi.death['cause'] = matches.group(2)
-
-            # Find events
-            matches = EVENT_REGEX.match(current_line)
-            if matches:
-                event_type = matches.group(1)
-                if event_type in EVENT_MAPPING.keys():
-                    if event_type in ONE_TIME_EVENTS and any(e['type'] == EVENT_MAPPING[event_type] for e in indi.events):
-                        print(f"Event {event_type} already exists for {indi.get_name()}")
+        self.add_records(self.iter_records(file))
+
+    def add_records(self, records):
+        for record in records:
+            if isinstance(record, Ind):
+                self.individuals[record.id] = record
+            else:
+                self.families[record.id] = record
+
+    def iter_records(self, file, workers=0):
+        """
+        Read the file in a single pass and yield every INDI (as Ind) and
+        FAM (as FamilyGC) as soon as its level 0 record is complete.
+        Only the lines of the current record are kept in memory.
+
+        With more than one worker the records are parsed in a process pool,
+        see iter_records_parallel.
+        """
+        if workers > 1:
+            if not multiprocessing.current_process().daemon:
+                yield from self.iter_records_parallel(file, workers)
+                return
+            # Like the processes of Celery's default prefork pool
+            logger.warning("Parsing %s in one process, daemonic processes can't start a process pool", file)
+
+        with io.open(file, mode='r', encoding='utf-8-sig') as f:
+            yield from self.parse_lines(f)
+
+    def iter_records_parallel(self, file, workers):
+        """
+        Split the file at level 0 records and parse the chunks in a pool of
+        worker processes. The records are yielded in file order, so the
+        outcome is the same as with one process. At most 2 * workers chunks
+        are read ahead of the import.
+        """
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for chunk in read_chunks(file, CHUNK_RECORDS):
+                pending.append(executor.submit(parse_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield from self.chunk_records(pending.popleft())
+            while pending:
+                yield from self.chunk_records(pending.popleft())
+
+    def chunk_records(self, future):
+        name, records = future.result()
+        if name:
+            self.name = name
+        return records
+
+    def parse_lines(self, lines):
+        for record in group_records(tokenize(lines)):
+            tag = record[0].tag
+            if tag == 'HEAD':
+                self.parse_head(record)
+            elif tag == 'INDI' and record[0].xref:
+                yield self.parse_indi(record)
+            elif tag == 'FAM' and record[0].xref:
+                yield self.parse_fam(record)
+
+    def parse_indi(self, record):
+        indi = Ind(record[0].xref)
+        # Level 1 structure that the current line belongs to
+        context = None
+        event = None
+        dcause_level = None
+
+        for line in record[1:]:
+            if dcause_level is not None:
+                if line.level == dcause_level + 1 and line.tag == 'NOTE' and line.value:
+                    indi.death_cause = line.value
+                if line.level <= dcause_level:
+                    dcause_level = None
+
+            if line.tag == '_DCAUSE':
+                dcause_level = line.level
+                if line.value:
+                    indi.death_cause = line.value
+
+            if line.level == 1:
+                self.add_event(indi.events, event)
+                context = line.tag
+                event = None
+
+                if line.tag == 'FAMS' and line.value:
+                    indi.fams = line.value
+                elif line.tag == 'FAMC' and line.value:
+                    indi.famc = line.value
+                elif line.tag == 'SEX':
+                    indi.sex = line.value if line.value in ('M', 'F') else 'U'
+                elif line.tag in EVENT_MAPPING:
+                    event_type = EVENT_MAPPING[line.tag]
+                    if line.tag in ONE_TIME_EVENTS and indi.events.has_type(event_type):
+                        logger.warning("Event %s already exists for %s", line.tag, indi.get_name())
                     else:
-                        event = self.parse_event(lines, current_index)
-                        if event:
-                            event['type'] = EVENT_MAPPING[event_type]
-                            indi.events.append(event)
-
-        self.individuals[indi_id] = indi
+                        event = {'event_type': event_type}
+            elif line.level == 2:
+                if context == 'NAME':
+                    if line.tag == 'GIVN':
+                        indi.given_name = sys.intern(line.value)
+                    elif line.tag == 'SURN':
+                        indi.surname = sys.intern(line.value)
+                elif event is not None:
+                    self.parse_event_line(event, line)
+
+        self.add_event(indi.events, event)
+
+        return indi
+
+    def parse_head(self, record):
+        for line in record[1:]:
+            if line.tag == '_TREE':
+                self.name = line.value
+
+    def parse_fam(self, record):
+        family = FamilyGC(record[0].xref)
+        event = None
+
+        for line in record[1:]:
+            if line.level == 1:
+                self.add_event(family.family_events, event)
+                event = None
+
+                if line.tag == 'HUSB' and line.value:
+                    family.husband = line.value
+                elif line.tag == 'WIFE' and line.value:
+                    family.wife = line.value
+                elif line.tag == 'CHIL' and line.value:
+                    family.children.append(line.value)
+                elif line.tag in FAMILY_EVENT_MAPPING:
+                    event = {'event_type': FAMILY_EVENT_MAPPING[line.tag]}
+            elif line.level == 2 and event is not None:
+                self.parse_event_line(event, line)
+
+        self.add_event(family.family_events, event)
+
+        return family
 
     @staticmethod
-    def parse_name(lines, start_index):
-        matches = NAME_REGEX.match(lines[start_index])
-        level = matches.group(1)
-
-        givn = ''
-        surn = ''
-
-        for index, line in enumerate(lines[start_index + 1:]):
-            current_line = line.strip()
-            if line.startswith(str(level)) or current_line == '':
-                return givn, surn
-
-            # GIVN
-            matches = GIVN_REGEX.match(current_line)
-            if matches:
-                givn = matches.group(2)
-
-            matches = SURN_REGEX.match(current_line)
-            if matches:
-                surn = matches.group(2)
-
-    def parse_head(self, lines, start_index):
-        level = 0
-        for index, line in enumerate(lines[start_index + 1:]):
-            current_line = line.strip()
-            if line.startswith(str(level)):
-                break
-            matches = TREE_REGEX.match(current_line)
-            if matches:
-                self.name = matches.group(2)
-
-    def parse_fam(self, lines, start_index):
-        matches = FAM_REGEX.match(lines[start_index])
-        level = matches.group(1)
-        fam_id = matches.group(2)
-        family = FamilyGC(fam_id)
-        current_index = start_index
-
-        for index, line in enumerate(lines[start_index + 1:]):
-            if line.startswith(level):
-                break
-            current_index += 1
-            current_line = line.strip()
-
-            # HUSB
-            matches = HUSB_REGEX.match(current_line)
-            if matches:
-                family.husband = matches.group(2)
-
-            # WIFE
-            matches = WIFE_REGEX.match(current_line)
-            if matches:
-                family.wife = matches.group(2)
-
-            # CHIL
-            matches = CHIL_REGEX.match(current_line)
-            if matches:
-                family.children.append(matches.group(2))
-
-            # Find events
-            matches = EVENT_REGEX.match(current_line)
-            if matches:
-                event_type = matches.group(1)
-                if event_type in FAMILY_EVENT_MAPPING.keys():
-                    event = self.parse_event(lines, current_index)
-                    if event:
-                        event['type'] = FAMILY_EVENT_MAPPING[event_type]
-                        family.family_events.append(event)
-
-        self.families[fam_id] = family
-    
+    def add_event(events, event):
+        # Events without any details are not kept
+        if event and len(event) > 1:
+            events.append(**event)
+
     @staticmethod
-    def parse_event(lines, start_index, level="2"):
-        event = {}
-
-        for index, line in enumerate(lines[start_index + 1:]):
-            current_line = line.strip()
-
-            if not line.startswith(level) or current_line == '':
-                return event
-            matches = PLAC_REGEX.match(current_line)
-            if matches:
-                event['place'] = matches.group(2)
-            matches = DATE_REGEX.match(current_line)
-            if matches:
-                event['date'] = matches.group(2)
-            matches = NOTE_REGEX.match(current_line)
-            if matches:
-                event['description'] = matches.group(2)
-
-        return event
+    def parse_event_line(event, line):
+        if not line.value:
+            return
+        if line.tag == 'PLAC':
+            event['place'] = line.value
+        elif line.tag == 'DATE':
+            event['date'] = line.value
+        elif line.tag == 'NOTE':
+            event['description'] = line.value
 
     def get_tree_name(self):
         return self.name
@@ -360,70 +444,335 @@ def main():
 def clear_db():
     Person.objects.all().delete()
 
-def handle_uploaded_file(tree):
-    gedcom_tree = Gedcom(tree.gedcom_file.path)
+def handle_uploaded_file(tree, job=None):
+    """
+    Add the persons, events, families and children of the tree's GEDCOM file
+    to the database. If an ImportJob is given, its stage and row counts are
+    updated as the import goes along.
+
+    The records are added while the file is read, so apart from the batch
+    being written only the GEDCOM id -> database id maps are kept in memory.
+    """
+    report_stage(job, 'parse')
     tree.save()
 
-    # List of Person entries to bulk add to DB
-    persons = []
-    families = []
-    children = []
-    events = []
-    family_events = []
+    tree_import = TreeImport(tree, job)
+    records = Gedcom(file=None).iter_records(tree.gedcom_file.path, workers=settings.GEDCOM_PARSE_WORKERS)
+    for record in records:
+        tree_import.add(record)
+    tree_import.finish()
+
+    # Bulk inserts don't send the signals that normally update the version and the warnings
+    index_tree(tree)
+    report_stage(job, 'warnings')
+    save_tree_warnings(tree)
+    if settings.ANCESTOR_CLOSURE:
+        report_stage(job, 'ancestors')
+        rebuild_tree_links(tree)
+    Tree.bump_versions([tree.pk])
+
+
+class TreeImport:
+    """
+    Adds parsed Ind and FamilyGC records to a tree in batches of BATCH_SIZE.
+    Families and children are linked through the GEDCOM id -> database id maps
+    person_ids and family_ids instead of looking up every person in the
+    database. A family that refers to a person further down in the file is
+    held back until the whole file has been read.
+    """
+    def __init__(self, tree, job=None):
+        self.tree = tree
+        self.job = job
+        self.person_ids = {}
+        self.family_ids = {}
+        self.persons = []
+        self.events = []
+        self.families = []
+        self.family_events = []
+        self.children = []
+        self.waiting_families = []
 
-    for id, props in gedcom_tree.individuals.items():
+    def add(self, record):
+        if isinstance(record, Ind):
+            self.add_person(record)
+        else:
+            # The families refer to persons, so the persons read so far are added first
+            self.create_persons()
+            if self.is_linkable(record):
+                self.add_family(record)
+            else:
+                self.waiting_families.append(record)
+
+    def finish(self):
+        self.create_persons()
+        for record in self.waiting_families:
+            self.add_family(record)
+        self.waiting_families = []
+        self.create_families()
+
+    def is_linkable(self, record):
+        return all(
+            not xref or xref in self.person_ids
+            for xref in (record.husband, record.wife, *record.children)
+        )
+
+    def add_person(self, props):
         person = Person()
-        person.indi_id = id
-        person.tree = tree
+        person.indi_id = props.id
+        person.tree = self.tree
         person.first_name = props.given_name
         person.last_name = props.surname
         person.sex = props.sex
-        person.death_cause = props.death['cause']
-
+        person.death_cause = props.death_cause
         for e in props.events:
+            # The parser keeps at most one birth and one death event per person
+            if e.type in ('birth', 'death'):
+                setattr(person, f'{e.type}_date', e.date)
+                setattr(person, f'{e.type}_year', df.extract_year(e.date) if e.date else None)
+                setattr(person, f'{e.type}_place', e.place)
+
             event = Event()
             event.person = person
-            event.event_type = e['type']
-            event.date = e.get('date', '')
-            event.year = df.extract_year(event.date) if event.date else None
-            event.place = e.get('place', '')
-            event.description = e.get('description', '')
-            events.append(event)
-
-        persons.append(person)
-
-    # Bulk add objects to improve performance
-    Person.objects.bulk_create(persons)
-    Event.objects.bulk_create(events)
-
-    for id, props in gedcom_tree.families.items():
+            event.event_type = e.type
+            event.date = e.date
+            event.year = df.extract_year(e.date) if e.date else None
+            event.place = e.place
+            event.description = e.description
+            self.events.append(event)
+        self.persons.append(person)
+
+        if len(self.persons) >= BATCH_SIZE:
+            self.create_persons()
+
+    def add_family(self, props):
         fam = Family()
-        fam.tree = tree
-        fam.family_id = id
-        if props.husband:
-            husband = Person.objects.get(tree=tree, indi_id=props.husband)
-            fam.husband = husband
-        if props.wife:
-            wife = Person.objects.get(tree=tree, indi_id=props.wife)
-            fam.wife = wife
+        fam.tree = self.tree
+        fam.family_id = props.id
+        fam.husband_id = self.person_ids.get(props.husband)
+        fam.wife_id = self.person_ids.get(props.wife)
         for e in props.family_events:
             event = FamilyEvent()
             event.family = fam
-            event.event_type = e['type']
-            event.date = e.get('date', '')
-            event.year = df.extract_year(event.date) if event.date else None
-            event.place = e.get('place', '')
-            event.description = e.get('description', '')
-            family_events.append(event)
-        for c in props.children:
+            event.event_type = e.type
+            event.date = e.date
+            event.year = df.extract_year(e.date) if e.date else None
+            event.place = e.place
+            event.description = e.description
+            self.family_events.append(event)
+        # A child listed twice in the same family is only added once
+        for c in dict.fromkeys(props.children):
+            if c not in self.person_ids:
+                logger.warning("Child %s in family %s does not exist", c, props.id)
+                continue
             child = Child()
             child.family = fam
-            child_person = Person.objects.get(tree=tree, indi_id=c)
-            child.person = child_person
-            children.append(child)
+            child.person_id = self.person_ids[c]
+            self.children.append(child)
+        self.families.append(fam)
+
+        if len(self.families) >= BATCH_SIZE:
+            self.create_families()
 
-        families.append(fam)
+    def create_persons(self):
+        if not self.persons:
+            return
+
+        report_stage(self.job, 'persons')
+        create_rows(Person, self.persons, self.job, 'persons')
+
+        # Not every database returns the primary keys from a bulk insert
+        if self.persons[0].pk is None:
+            created = dict(
+                Person.objects.filter(
+                    tree=self.tree, indi_id__in=[p.indi_id for p in self.persons]
+                ).values_list('indi_id', 'id')
+            )
+            for person in self.persons:
+                person.pk = created[person.indi_id]
+
+        for person in self.persons:
+            self.person_ids[person.indi_id] = person.pk
+
+        report_stage(self.job, 'events')
+        create_rows(Event, self.events, self.job, 'events')
+        self.persons = []
+        self.events = []
+
+    def create_families(self):
+        if not self.families:
+            return
+
+        report_stage(self.job, 'families')
+        create_rows(Family, self.families, self.job, 'families')
+
+        if self.families[0].pk is None:
+            created = dict(
+                Family.objects.filter(
+                    tree=self.tree, family_id__in=[f.family_id for f in self.families]
+                ).values_list('family_id', 'id')
+            )
+            for family in self.families:
+                family.pk = created[family.family_id]
+
+        for family in self.families:
+            self.family_ids[family.family_id] = family.pk
+
+        create_rows(FamilyEvent, self.family_events, self.job, 'family_events')
+        report_stage(self.job, 'children')
+        create_rows(Child, self.children, self.job, 'children')
+        self.families = []
+        self.family_events = []
+        self.children = []
 
-    Family.objects.bulk_create(families)
-    Child.objects.bulk_create(children)
-    FamilyEvent.objects.bulk_create(family_events)
\ No newline at end of file
+def report_stage(job, stage):
+    if job and job.stage != stage:
+        job.set_stage(stage)
+
+def create_rows(model, rows, job=None, counter=None):
+    if not rows:
+        return
+
+    # Each batch is committed on its own so the progress can be followed while importing
+    with transaction.atomic():
+        model.objects.bulk_create(rows)
+    if job:
+        job.add_rows(**{counter: len(rows)})
+
+
+class SortedRows:
+    """
+    Rows from a query ordered by their first column, read alongside another
+    query ordered the same way. Only the rows for the current key are held in memory.
+    """
+    def __init__(self, rows):
+        self.groups = groupby(rows, key=itemgetter(0))
+        self.current = next(self.groups, None)
+
+    def pop(self, key):
+        """Return the rows for key, skipping any rows with a smaller key."""
+        while self.current is not None and self.current[0] < key:
+            self.current = next(self.groups, None)
+        if self.current is None or self.current[0] != key:
+            return []
+        rows = list(self.current[1])
+        self.current = next(self.groups, None)
+        return rows
+
+def export_tree(tree):
+    """
+    Yield the tree as a GEDCOM file, a chunk of lines at a time, for a
+    StreamingHttpResponse. Persons and families are read together with their
+    events, children and families in a handful of queries that are iterated in
+    parallel, so memory use doesn't depend on the size of the tree.
+
+    The GEDCOM ids are made from the primary keys, so exporting only reads
+    from the database.
+    """
+    chunk = []
+    for line in export_lines(tree):
+        chunk.append(line)
+        if len(chunk) >= BATCH_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+def person_xref(pk):
+    return f"@I{pk}@"
+
+def family_xref(pk):
+    return f"@F{pk}@"
+
+def export_lines(tree):
+    now = datetime.datetime.now()
+    yield "0 HEAD\n"
+    yield "1 SUBM @SUBM1@\n"
+    yield "1 SOUR Project Heirloom\n"
+    yield f"2 _TREE {tree.name}\n"
+    yield f"1 DATE {now.strftime('%d %b %Y')}\n"
+    yield f"2 TIME {now.strftime('%X')}\n"
+    yield "1 GEDC\n"
+    yield "2 VERS 5.5.1\n"
+    yield "2 FORM LINEAGE-LINKED\n"
+    yield "1 CHAR UTF-8\n"
+    yield "0 @SUBM1@ SUBM\n"
+    yield "1 NAME Project Heirloom Member Trees Submitter\n"
+
+    persons = Person.objects.filter(tree=tree).order_by('id').values_list(
+        'id', 'first_name', 'last_name', 'sex'
+    )
+    events = SortedRows(
+        Event.objects.filter(person__tree=tree).order_by('person_id', 'id').values_list(
+            'person_id', 'event_type', 'date', 'place', 'description'
+        ).iterator(chunk_size=BATCH_SIZE)
+    )
+    parent_families = SortedRows(
+        Child.objects.filter(person__tree=tree).order_by('person_id', 'id').values_list(
+            'person_id', 'family_id'
+        ).iterator(chunk_size=BATCH_SIZE)
+    )
+    # Families where the person is husband or wife
+    spouse_families = SortedRows(
+        Family.objects.filter(tree=tree, husband__isnull=False).values_list('husband_id', 'id').union(
+            Family.objects.filter(tree=tree, wife__isnull=False).values_list('wife_id', 'id'),
+            all=True,
+        ).order_by('husband_id', 'id').iterator(chunk_size=BATCH_SIZE)
+    )
+
+    for id, first_name, last_name, sex in persons.iterator(chunk_size=BATCH_SIZE):
+        yield f"0 {person_xref(id)} INDI\n"
+        name = ""
+        if first_name:
+            name += f"{first_name} "
+        if last_name:
+            name += f"/{last_name}/"
+        if name:
+            yield f"1 NAME {name}\n"
+            if first_name:
+                yield f"2 GIVN {first_name}\n"
+            if last_name:
+                yield f"2 SURN {last_name}\n"
+
+        yield f"1 SEX {sex}\n"
+        for _, family_id in parent_families.pop(id):
+            yield f"1 FAMC {family_xref(family_id)}\n"
+        for _, family_id in spouse_families.pop(id):
+            yield f"1 FAMS {family_xref(family_id)}\n"
+        for _, event_type, date, place, description in events.pop(id):
+            yield from export_event(EVENT_TAGS[event_type], date, place, description)
+
+    families = Family.objects.filter(tree=tree).order_by('id').values_list(
+        'id', 'husband_id', 'wife_id'
+    )
+    children = SortedRows(
+        Child.objects.filter(family__tree=tree).order_by('family_id', 'id').values_list(
+            'family_id', 'person_id'
+        ).iterator(chunk_size=BATCH_SIZE)
+    )
+    family_events = SortedRows(
+        FamilyEvent.objects.filter(family__tree=tree).order_by('family_id', 'id').values_list(
+            'family_id', 'event_type', 'date', 'place', 'description'
+        ).iterator(chunk_size=BATCH_SIZE)
+    )
+
+    for id, husband, wife in families.iterator(chunk_size=BATCH_SIZE):
+        yield f"0 {family_xref(id)} FAM\n"
+        if husband:
+            yield f"1 HUSB {person_xref(husband)}\n"
+        if wife:
+            yield f"1 WIFE {person_xref(wife)}\n"
+        for _, child in children.pop(id):
+            yield f"1 CHIL {person_xref(child)}\n"
+        for _, event_type, date, place, description in family_events.pop(id):
+            yield from export_event(FAMILY_EVENT_TAGS[event_type], date, place, description)
+
+    yield "0 TRLR\n"
+
+def export_event(tag, date, place, description):
+    yield f"1 {tag}\n"
+    if date:
+        yield f"2 DATE {date}\n"
+    if place:
+        yield f"2 PLAC {place}\n"
+    if description:
+        yield f"2 NOTE {description}\n"
@@ -0,0 +1,219 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Child, Family, Person
+
+# Marks a missing person or family in the position arrays
+NONE = -1
+
+
+def get_tree_graph(tree, *person_ids):
+    """
+    The TreeGraph of the tree, from the cache if it was already built for the
+    tree's current version. The version changes with every person, family,
+    child or event of the tree, so a cached graph is never out of date.
+
+    The version is only raised once the change has been committed, so a
+    person that was just added can be missing from the cached graph. If one
+    of person_ids isn't in it, the graph is built again.
+    """
+    key = f"tree-graph:{tree.pk}:{tree.version}"
+    graph = cache.get(key)
+    if graph is None or not all(person_id in graph for person_id in person_ids):
+        graph = TreeGraph.build(tree)
+        cache.set(key, graph, settings.TREE_GRAPH_CACHE_TIMEOUT)
+    return graph
+
+def csr(lists):
+    """Flatten lists into an offset array and a value array, the values of list i being values[offsets[i]:offsets[i + 1]]."""
+    offsets = array('l', [0])
+    values = array('l')
+    for items in lists:
+        values.extend(items)
+        offsets.append(len(values))
+    return offsets, values
+
+
+class TreeGraph:
+    """
+    The persons and families of a tree as integer arrays, so parents,
+    partners and children can be followed without any queries. Persons and
+    families are stored by their position in the id-ordered person_ids and
+    family_ids arrays. The methods taking a person id are the public
+    interface; the ones ending in _at work with positions, for traversals
+    that visit many persons.
+    """
+    __slots__ = (
+        'tree_id', 'version', 'person_ids', 'family_ids', 'sex', 'birth_years', 'death_years',
+        'husbands', 'wives', 'parent_families', 'family_child_offsets', 'family_children',
+        'person_family_offsets', 'person_families',
+    )
+
+    @classmethod
+    def build(cls, tree):
+        """Load the graph of the tree in three queries."""
+        graph = cls()
+        graph.tree_id = tree.pk
+        graph.version = tree.version
+
+        graph.person_ids = array('q')
+        sex = []
+        # 0 stands for an unknown year
+        graph.birth_years = array('H')
+        graph.death_years = array('H')
+        persons = Person.objects.filter(tree=tree).order_by('id').values_list('id', 'sex', 'birth_year', 'death_year')
+        for person_id, person_sex, birth_year, death_year in persons.iterator(chunk_size=5000):
+            graph.person_ids.append(person_id)
+            sex.append(person_sex[:1] or 'U')
+            graph.birth_years.append(birth_year or 0)
+            graph.death_years.append(death_year or 0)
+        graph.sex = ''.join(sex)
+
+        graph.family_ids = array('q')
+        graph.husbands = array('l')
+        graph.wives = array('l')
+        person_families = [[] for _ in graph.person_ids]
+        families = Family.objects.filter(tree=tree).order_by('id').values_list('id', 'husband_id', 'wife_id')
+        for family_id, husband_id, wife_id in families.iterator(chunk_size=5000):
+            family = len(graph.family_ids)
+            graph.family_ids.append(family_id)
+            husband = graph.index(husband_id)
+            wife = graph.index(wife_id)
+            graph.husbands.append(husband)
+            graph.wives.append(wife)
+            for parent in dict.fromkeys((husband, wife)):
+                if parent != NONE:
+                    person_families[parent].append(family)
+
+        graph.parent_families = array('l', [NONE]) * len(graph.person_ids)
+        family_children = [[] for _ in graph.family_ids]
+        children = Child.objects.filter(family__tree=tree).order_by('id').values_list('family_id', 'person_id')
+        for family_id, person_id in children.iterator(chunk_size=5000):
+            family = graph.family_index(family_id)
+            person = graph.index(person_id)
+            if person == NONE:
+                continue
+            family_children[family].append(person)
+            # Like Person.get_father, the parents are taken from the child's first family
+            if graph.parent_families[person] == NONE or family < graph.parent_families[person]:
+                graph.parent_families[person] = family
+
+        graph.family_child_offsets, graph.family_children = csr(family_children)
+        graph.person_family_offsets, graph.person_families = csr(person_families)
+        return graph
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return len(self.person_ids)
+
+    def __contains__(self, person_id):
+        return self.index(person_id) != NONE
+
+    def index(self, person_id):
+        """The position of the person, or NONE if the person isn't in the tree."""
+        return self._find(self.person_ids, person_id)
+
+    def position(self, person_id):
+        """The position of the person, raising KeyError if the person isn't in the tree."""
+        person = self.index(person_id)
+        if person == NONE:
+            raise KeyError(person_id)
+        return person
+
+    def family_index(self, family_id):
+        return self._find(self.family_ids, family_id)
+
+    @staticmethod
+    def _find(ids, pk):
+        if pk is None:
+            return NONE
+        position = bisect_left(ids, pk)
+        return position if position < len(ids) and ids[position] == pk else NONE
+
+    def _id(self, person):
+        return None if person == NONE else self.person_ids[person]
+
+    # Positions
+
+    def father_at(self, person):
+        family = self.parent_families[person]
+        if family == NONE or self.husbands[family] == person:
+            return NONE
+        return self.husbands[family]
+
+    def mother_at(self, person):
+        family = self.parent_families[person]
+        if family == NONE or self.wives[family] == person:
+            return NONE
+        return self.wives[family]
+
+    def parents_at(self, person):
+        """The father and mother of the person that are known."""
+        return [parent for parent in (self.father_at(person), self.mother_at(person)) if parent != NONE]
+
+    def families_at(self, person):
+        """The positions of the families the person is a parent in, by family id."""
+        return self.person_families[self.person_family_offsets[person]:self.person_family_offsets[person + 1]]
+
+    def family_children_at(self, family):
+        return self.family_children[self.family_child_offsets[family]:self.family_child_offsets[family + 1]]
+
+    def partner_at(self, family, person):
+        """The other parent of the family, or NONE."""
+        return self.wives[family] if self.husbands[family] == person else self.husbands[family]
+
+    def partners_at(self, person):
+        partners = (self.partner_at(family, person) for family in self.families_at(person))
+        return [partner for partner in dict.fromkeys(partners) if partner != NONE and partner != person]
+
+    def children_at(self, person):
+        """The children of all the person's families, by family."""
+        children = (child for family in self.families_at(person) for child in self.family_children_at(family))
+        return [child for child in dict.fromkeys(children) if child != person]
+
+    # Person ids
+
+    def get_father(self, person_id):
+        return self._id(self.father_at(self.position(person_id)))
+
+    def get_mother(self, person_id):
+        return self._id(self.mother_at(self.position(person_id)))
+
+    def get_parents(self, person_id):
+        return [self.person_ids[p] for p in self.parents_at(self.position(person_id))]
+
+    def get_partners(self, person_id):
+        return [self.person_ids[p] for p in self.partners_at(self.position(person_id))]
+
+    def get_children(self, person_id):
+        return [self.person_ids[p] for p in self.children_at(self.position(person_id))]
+
+    def get_families(self, person_id):
+        """The person's families as (family id, partner id, child ids) tuples."""
+        person = self.position(person_id)
+        return [
+            (
+                self.family_ids[family],
+                self._id(self.partner_at(family, person)),
+                [self.person_ids[child] for child in self.family_children_at(family)],
+            )
+            for family in self.families_at(person)
+        ]
+
+    def get_sex(self, person_id):
+        return self.sex[self.position(person_id)]
+
+    def get_birth_year(self, person_id):
+        return self.birth_years[self.position(person_id)] or None
+
+    def get_death_year(self, person_id):
+        return self.death_years[self.position(person_id)] or None
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from genealogy.models import Event, Person
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Copy the birth and death events of every person to the birth and death fields on the person'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tree', type=int, help='Only update the persons in the tree with this id')
+
+    def handle(self, *args, **options):
+        persons = Person.objects.order_by('id').only('id')
+        if options['tree']:
+            persons = persons.filter(tree_id=options['tree'])
+
+        updated_count = 0
+        batch = []
+        for person in persons.iterator(chunk_size=BATCH_SIZE):
+            batch.append(person)
+            if len(batch) >= BATCH_SIZE:
+                updated_count += self.update_batch(batch)
+                batch = []
+        if batch:
+            updated_count += self.update_batch(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated_count} persons'))
+
+    def update_batch(self, persons):
+        events = {}
+        rows = Event.objects.filter(
+            person_id__in=[p.id for p in persons],
+            event_type__in=['birth', 'death'],
+        ).values_list('person_id', 'event_type', 'date', 'year', 'place')
+        for person_id, *event in rows:
+            events.setdefault(person_id, []).append(event)
+
+        for person in persons:
+            for field, value in Person.vital_values(events.get(person.id, [])).items():
+                setattr(person, field, value)
+
+        Person.objects.bulk_update(persons, Person.VITAL_FIELDS)
+        return len(persons)
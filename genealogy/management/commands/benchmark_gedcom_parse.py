@@ -0,0 +1,28 @@
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from genealogy.gedcom import Gedcom
+
+
+class Command(BaseCommand):
+    help = 'Time the parsing of a GEDCOM file with different numbers of worker processes, see GEDCOM_PARSE_WORKERS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='The GEDCOM file to parse')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='The numbers of workers to try')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of times each parse is run')
+
+    def handle(self, *args, **options):
+        # Only the time is of interest, not the warnings about the file
+        logging.getLogger('genealogy.gedcom').setLevel(logging.ERROR)
+
+        self.stdout.write(f'{os.cpu_count()} CPUs')
+        for workers in options['workers']:
+            times = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                count = sum(1 for _ in Gedcom(file=None).iter_records(options['file'], workers=workers))
+                times.append(time.perf_counter() - start)
+            self.stdout.write(f'{workers} workers: {count} records in {min(times):.2f} s (best of {options["repeat"]})')
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from genealogy.closure import rebuild_tree_links
+from genealogy.models import Tree
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the table with the ancestors of every person, used when ANCESTOR_CLOSURE is on'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tree', type=int, help='Only rebuild the links of the tree with this id')
+
+    def handle(self, *args, **options):
+        if not settings.ANCESTOR_CLOSURE:
+            raise CommandError('ANCESTOR_CLOSURE is off, so the links would not be kept up to date')
+
+        trees = Tree.objects.order_by('id')
+        if options['tree']:
+            trees = trees.filter(pk=options['tree'])
+
+        link_count = 0
+        for tree in trees:
+            link_count += rebuild_tree_links(tree)
+
+        self.stdout.write(self.style.SUCCESS(f'Stored {link_count} ancestor links'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from genealogy.models import Tree
+from genealogy.quality import save_tree_warnings
+
+
+class Command(BaseCommand):
+    help = 'Check the data quality of every person again and replace the stored warnings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tree', type=int, help='Only check the persons in the tree with this id')
+
+    def handle(self, *args, **options):
+        trees = Tree.objects.order_by('id')
+        if options['tree']:
+            trees = trees.filter(pk=options['tree'])
+
+        warning_count = 0
+        for tree in trees:
+            warning_count += save_tree_warnings(tree)
+
+        self.stdout.write(self.style.SUCCESS(f'Stored {warning_count} warnings'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from genealogy.models import Person, Tree
+from genealogy.search import index_tree
+
+
+class Command(BaseCommand):
+    help = 'Add every person to the full-text search index again and replace the stored name keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tree', type=int, help='Only index the persons in the tree with this id')
+
+    def handle(self, *args, **options):
+        trees = Tree.objects.order_by('id')
+        if options['tree']:
+            trees = trees.filter(pk=options['tree'])
+
+        for tree in trees:
+            index_tree(tree)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Person.objects.filter(tree__in=trees).count()} persons'))
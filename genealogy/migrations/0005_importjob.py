@@ -0,0 +1,35 @@
+# Generated by Django 4.2.17 on 2026-10-16 22:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0004_alter_event_person_alter_familyevent_family'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('stage', models.CharField(blank=True, choices=[('parse', 'Reading file'), ('persons', 'Adding persons'), ('events', 'Adding events'), ('families', 'Adding families'), ('children', 'Adding children')], max_length=10)),
+                ('persons', models.PositiveIntegerField(default=0)),
+                ('events', models.PositiveIntegerField(default=0)),
+                ('families', models.PositiveIntegerField(default=0)),
+                ('family_events', models.PositiveIntegerField(default=0)),
+                ('children', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='genealogy.tree')),
+            ],
+            options={
+                'ordering': ['-created', '-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0005_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
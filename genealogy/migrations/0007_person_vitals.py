@@ -0,0 +1,43 @@
+# Generated by Django 4.2.17 on 2026-10-16 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0006_tree_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='birth_date',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='birth_place',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='birth_year',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='death_date',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='death_place',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='death_year',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.17 on 2026-10-16 22:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0007_person_vitals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='stage',
+            field=models.CharField(blank=True, choices=[('parse', 'Reading file'), ('persons', 'Adding persons'), ('events', 'Adding events'), ('families', 'Adding families'), ('children', 'Adding children'), ('warnings', 'Checking data quality')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='DataQualityWarning',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50)),
+                ('message', models.TextField()),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quality_warnings', to='genealogy.person')),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quality_warnings', to='genealogy.tree')),
+            ],
+            options={
+                'ordering': ['person_id', 'position'],
+                'indexes': [models.Index(fields=['tree', 'code'], name='genealogy_d_tree_id_57fd49_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dataqualitywarning',
+            constraint=models.UniqueConstraint(fields=('person', 'position'), name='Person and warning position combination'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.17 on 2026-10-16 23:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0008_dataqualitywarning'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='stage',
+            field=models.CharField(blank=True, choices=[('parse', 'Reading file'), ('persons', 'Adding persons'), ('events', 'Adding events'), ('families', 'Adding families'), ('children', 'Adding children'), ('warnings', 'Checking data quality'), ('ancestors', 'Linking ancestors')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='AncestorLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='genealogy.person')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='genealogy.person')),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='genealogy.tree')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='genealogy_a_descend_97b60a_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ancestorlink',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='Ancestor and descendant combination'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+import warnings
+
+from django.db import OperationalError, migrations
+
+
+def create_index(apps, schema_editor):
+    # Only SQLite has FTS5. Other databases, and SQLite builds without the
+    # trigram tokenizer, keep searching with icontains.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE genealogy_person_fts USING fts5("
+                "first_name, last_name, birth_place, death_place, tree_id UNINDEXED, tokenize='trigram')"
+            )
+        except OperationalError as e:
+            # "no such module: fts5" or "no such tokenizer: trigram"
+            warnings.warn(f"Full-text search index not created: {e}")
+            return
+        cursor.execute(
+            "INSERT INTO genealogy_person_fts (rowid, first_name, last_name, birth_place, death_place, tree_id) "
+            "SELECT id, first_name, last_name, birth_place, death_place, tree_id FROM genealogy_person"
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS genealogy_person_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0009_ancestorlink'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
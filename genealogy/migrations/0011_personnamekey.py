@@ -0,0 +1,27 @@
+# Generated by Django 4.2.17 on 2026-10-16 23:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0010_person_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonNameKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('first', 'First name'), ('last', 'Last name')], max_length=5)),
+                ('key', models.CharField(max_length=100)),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_keys', to='genealogy.person')),
+                ('tree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_keys', to='genealogy.tree')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tree', 'key'], name='genealogy_p_tree_id_809772_idx')],
+            },
+        ),
+    ]
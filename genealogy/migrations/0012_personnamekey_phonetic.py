@@ -0,0 +1,31 @@
+# Generated by Django 4.2.17 on 2026-10-16 23:39
+
+from django.db import migrations, models
+
+from genealogy.migrations._name_keys import get_phonetic_key
+
+
+def fill_phonetic(apps, schema_editor):
+    PersonNameKey = apps.get_model('genealogy', 'PersonNameKey')
+    for key in list(PersonNameKey.objects.values_list('key', flat=True).distinct()):
+        PersonNameKey.objects.filter(key=key).update(phonetic=get_phonetic_key(key))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0011_personnamekey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personnamekey',
+            name='phonetic',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='personnamekey',
+            index=models.Index(fields=['tree', 'phonetic'], name='genealogy_p_tree_id_2c30ee_idx'),
+        ),
+        migrations.RunPython(fill_phonetic, migrations.RunPython.noop),
+    ]
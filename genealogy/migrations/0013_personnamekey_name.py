@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+from genealogy.migrations._name_keys import get_name_key, get_name_words, get_phonetic_key
+
+BATCH_SIZE = 1000
+
+
+def fill_names(apps, schema_editor):
+    # The spellings can't be found from the keys, so the rows are made again
+    Person = apps.get_model('genealogy', 'Person')
+    PersonNameKey = apps.get_model('genealogy', 'PersonNameKey')
+    PersonNameKey.objects.all().delete()
+
+    name_keys = []
+    persons = Person.objects.order_by('id').values_list('id', 'tree_id', 'first_name', 'last_name')
+    for person_id, tree_id, first_name, last_name in persons.iterator(chunk_size=BATCH_SIZE):
+        for kind, name in (('first', first_name), ('last', last_name)):
+            for word in get_name_words(name):
+                key = get_name_key(word, kind)
+                name_keys.append(PersonNameKey(
+                    tree_id=tree_id, person_id=person_id, kind=kind, name=word, key=key, phonetic=get_phonetic_key(key)
+                ))
+        if len(name_keys) >= BATCH_SIZE:
+            PersonNameKey.objects.bulk_create(name_keys)
+            name_keys = []
+    PersonNameKey.objects.bulk_create(name_keys)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0012_personnamekey_phonetic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personnamekey',
+            name='name',
+            field=models.CharField(default='', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.17 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0013_personnamekey_name'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='personnamekey',
+            name='genealogy_p_tree_id_809772_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='personnamekey',
+            name='genealogy_p_tree_id_2c30ee_idx',
+        ),
+        migrations.AddIndex(
+            model_name='personnamekey',
+            index=models.Index(fields=['key', 'tree'], name='genealogy_p_key_dc57d3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personnamekey',
+            index=models.Index(fields=['phonetic', 'tree'], name='genealogy_p_phoneti_79a213_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def fill_vitals(apps, schema_editor):
+    # Like the backfill_person_vitals command, for databases that had persons
+    # before the fields were added. A person with more than one birth or death
+    # event gets no details for it.
+    Person = apps.get_model('genealogy', 'Person')
+    Event = apps.get_model('genealogy', 'Event')
+    fields = ['birth_date', 'birth_year', 'birth_place', 'death_date', 'death_year', 'death_place']
+
+    person_ids = list(
+        Event.objects.filter(event_type__in=['birth', 'death']).order_by('person_id').values_list('person_id', flat=True).distinct()
+    )
+    for i in range(0, len(person_ids), BATCH_SIZE):
+        batch = person_ids[i:i + BATCH_SIZE]
+        events = {}
+        rows = Event.objects.filter(person_id__in=batch, event_type__in=['birth', 'death']).values_list(
+            'person_id', 'event_type', 'date', 'year', 'place'
+        )
+        for person_id, event_type, date, year, place in rows:
+            events.setdefault((person_id, event_type), []).append((date, year, place))
+
+        persons = list(Person.objects.filter(pk__in=batch).only('id'))
+        for person in persons:
+            for event_type in ('birth', 'death'):
+                values = events.get((person.id, event_type), [])
+                date, year, place = values[0] if len(values) == 1 else ('', None, '')
+                setattr(person, f'{event_type}_date', date)
+                setattr(person, f'{event_type}_year', year)
+                setattr(person, f'{event_type}_place', place)
+        Person.objects.bulk_update(persons, fields)
+
+    # The places are in the full-text index from migration 0010
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            if 'genealogy_person_fts' in schema_editor.connection.introspection.table_names(cursor):
+                cursor.execute("DELETE FROM genealogy_person_fts")
+                cursor.execute(
+                    "INSERT INTO genealogy_person_fts (rowid, first_name, last_name, birth_place, death_place, tree_id) "
+                    "SELECT id, first_name, last_name, birth_place, death_place, tree_id FROM genealogy_person"
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0014_personnamekey_key_first'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_vitals, migrations.RunPython.noop),
+    ]
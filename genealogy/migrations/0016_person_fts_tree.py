@@ -0,0 +1,52 @@
+from django.db import migrations
+
+COLUMNS = 'first_name, last_name, birth_place, death_place'
+
+
+def has_index(schema_editor):
+    # Migration 0010 leaves the index out where SQLite has no FTS5 or trigram tokenizer
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        return 'genealogy_person_fts' in connection.introspection.table_names(cursor)
+
+
+def index_tree(apps, schema_editor):
+    # The tree id was an UNINDEXED column, which SQLite can only compare after
+    # the MATCH has found the rows of every tree. As "@<id>@" in an indexed
+    # column it can be part of the MATCH.
+    if not has_index(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE genealogy_person_fts")
+        cursor.execute(f"CREATE VIRTUAL TABLE genealogy_person_fts USING fts5({COLUMNS}, tree, tokenize='trigram')")
+        cursor.execute(
+            f"INSERT INTO genealogy_person_fts (rowid, {COLUMNS}, tree) "
+            f"SELECT id, {COLUMNS}, '@' || tree_id || '@' FROM genealogy_person"
+        )
+
+
+def unindex_tree(apps, schema_editor):
+    if not has_index(schema_editor):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE genealogy_person_fts")
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE genealogy_person_fts USING fts5({COLUMNS}, tree_id UNINDEXED, tokenize='trigram')"
+        )
+        cursor.execute(
+            f"INSERT INTO genealogy_person_fts (rowid, {COLUMNS}, tree_id) "
+            f"SELECT id, {COLUMNS}, tree_id FROM genealogy_person"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('genealogy', '0015_fill_person_vitals'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_tree, unindex_tree),
+    ]
@@ -1,17 +1,55 @@
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import OuterRef, PositiveSmallIntegerField, Q, Subquery
-from django.db.models.signals import post_delete, pre_delete
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from datetime import date
+import threading
+import weakref
 from easy_thumbnails.files import get_thumbnailer
-from itertools import chain
 
+from .constants import LIVING_YEARS
 from .date_functions import extract_year
 
+# The events that are copied to the birth and death fields of Person
+VITAL_EVENTS = ('birth', 'death')
+
+def vital_events_prefetch(lookup='events'):
+    """
+    Prefetch the birth and death events of the persons at lookup, so that
+    get_birth_event and get_death_event don't need a query for each person.
+    """
+    return models.Prefetch(
+        lookup,
+        queryset=Event.objects.filter(event_type__in=VITAL_EVENTS).order_by('id'),
+        to_attr='vital_events'
+    )
+
+class PersonQuerySet(models.QuerySet):
+    def with_vital_events(self):
+        return self.prefetch_related(vital_events_prefetch())
+
+    # These need the AncestorLink table, which is only kept with settings.ANCESTOR_CLOSURE
+    def ancestors_of(self, person_id):
+        return self.filter(descendant_links__descendant_id=person_id)
+
+    def descendants_of(self, person_id):
+        return self.filter(ancestor_links__ancestor_id=person_id)
+
+    def not_living(self):
+        """
+        Persons that can be shown to other users. Imported persons are never
+        marked as alive, so only persons with a known death, or born more than
+        LIVING_YEARS years ago, count as not living.
+        """
+        born_after = date.today().year - LIVING_YEARS
+        return self.filter(alive=False).filter(
+            Q(death_year__isnull=False) | ~Q(death_date='') | ~Q(death_place='') | Q(birth_year__lte=born_after)
+        )
+
 def users_file_location(instance, filename):
     date_string = date.today().strftime("%Y/%m/%d")
     return f"users/{instance.user.username}/{date_string}/{filename}"
@@ -35,6 +73,12 @@ class Tree(models.Model):
         blank=True
     )
     private = models.BooleanField(default=False)
+    # Increased whenever a person, family or event in the tree changes
+    version = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def bump_versions(tree_ids):
+        Tree.objects.filter(pk__in=tree_ids).update(version=F('version') + 1)
 
     def clean(self):
         if Tree.objects.filter(user=self.user, name=self.name).exclude(id=self.id).exists():
@@ -50,6 +94,52 @@ class Tree(models.Model):
             models.UniqueConstraint(fields=['user', 'name'], name='User and name combination')
         ]
 
+class ImportJob(models.Model):
+    STATUSES = (
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("finished", "Finished"),
+        ("failed", "Failed"),
+    )
+
+    STAGES = (
+        ("parse", "Reading file"),
+        ("persons", "Adding persons"),
+        ("events", "Adding events"),
+        ("families", "Adding families"),
+        ("children", "Adding children"),
+        ("warnings", "Checking data quality"),
+        ("ancestors", "Linking ancestors"),
+    )
+
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE, related_name="import_jobs")
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    stage = models.CharField(max_length=10, choices=STAGES, blank=True)
+    persons = models.PositiveIntegerField(default=0)
+    events = models.PositiveIntegerField(default=0)
+    families = models.PositiveIntegerField(default=0)
+    family_events = models.PositiveIntegerField(default=0)
+    children = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created', '-id']
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self.save(update_fields=['stage'])
+
+    def add_rows(self, **counts):
+        for field, count in counts.items():
+            setattr(self, field, getattr(self, field) + count)
+        self.save(update_fields=list(counts))
+
+    def __str__(self):
+        return f"Import of {self.tree} ({self.get_status_display()})"
+
 class Person(models.Model):
     SEX_CHOICES = (
         ("M", "Male"),
@@ -64,13 +154,56 @@ class Person(models.Model):
     sex = models.CharField(max_length=10, choices=SEX_CHOICES, default="U")
     death_cause = models.CharField(max_length=100, blank=True)
     alive = models.BooleanField(default=False)
+    # Copied from the birth and death events, see update_vitals
+    birth_date = models.CharField(max_length=100, blank=True)
+    birth_year = models.PositiveSmallIntegerField(null=True, blank=True, db_index=True)
+    birth_place = models.CharField(max_length=255, blank=True)
+    death_date = models.CharField(max_length=100, blank=True)
+    death_year = models.PositiveSmallIntegerField(null=True, blank=True, db_index=True)
+    death_place = models.CharField(max_length=255, blank=True)
     added = models.DateField(auto_now_add=True)
     last_updated = models.DateField(auto_now=True)
     profile_image = models.ForeignKey('Image', on_delete=models.SET_NULL, null=True, blank=True, related_name="profile_of")
 
+    VITAL_FIELDS = ['birth_date', 'birth_year', 'birth_place', 'death_date', 'death_year', 'death_place']
+
+    objects = PersonQuerySet.as_manager()
+
     class Meta:
         ordering = ['last_name']
 
+    @staticmethod
+    def vital_values(events):
+        """
+        The birth and death fields for a person with the given events, as
+        (event_type, date, year, place) rows. Like get_birth_event, a person
+        with more than one birth event gets no birth details.
+        """
+        values = {}
+        for event_type in VITAL_EVENTS:
+            rows = [e for e in events if e[0] == event_type]
+            date, year, place = rows[0][1:] if len(rows) == 1 else ('', None, '')
+            values[f'{event_type}_date'] = date
+            values[f'{event_type}_year'] = year
+            values[f'{event_type}_place'] = place
+        return values
+
+    @staticmethod
+    def update_vitals(person_id, person=None):
+        """Copy the birth and death events of a person to its birth and death fields, also on person if given."""
+        events = Event.objects.filter(person_id=person_id, event_type__in=VITAL_EVENTS).values_list(
+            'event_type', 'date', 'year', 'place'
+        )
+        values = Person.vital_values(list(events))
+        Person.objects.filter(pk=person_id).update(**values)
+        # The places are in the search index, and update sends no signals
+        collect_on_commit(search_index_changed, person_id)
+        if person is not None:
+            for field, value in values.items():
+                setattr(person, field, value)
+            # Prefetched events are out of date now
+            person.__dict__.pop('vital_events', None)
+
     def get_father(self):
         try:
             family = Family.objects.filter(children__person=self).first()
@@ -120,27 +253,25 @@ class Person(models.Model):
     
     # Birth
     def get_birth_date(self):
-        birth_event = self.get_birth_event()
-        if birth_event:
-            return birth_event.date
-        else:
-            return None
+        return self.birth_date
         
     def get_birth_year(self):
-        birth_event = self.get_birth_event()
-        if birth_event:
-            return birth_event.year
-        else:
-            return None
+        return self.birth_year
 
     def get_birth_place(self):
-        birth_event = self.get_birth_event()
-        if birth_event:
-            return birth_event.place
-        else:
-            return None
+        return self.birth_place
        
+    def get_vital_event(self, event_type):
+        """The birth or death event from with_vital_events."""
+        events = [e for e in self.vital_events if e.event_type == event_type]
+        if len(events) > 1:
+            print(f"Multiple {event_type} events found for {self}. Returning None.")
+            return None
+        return events[0] if events else None
+
     def get_birth_event(self):
+        if hasattr(self, 'vital_events'):
+            return self.get_vital_event('birth')
         try:
             return Event.objects.get(person=self, event_type='birth')
         except Event.DoesNotExist:
@@ -154,27 +285,17 @@ class Person(models.Model):
     
     # Death  
     def get_death_year(self):
-        death_event = self.get_death_event()
-        if death_event:
-            return death_event.year
-        else:
-            return None
+        return self.death_year
          
     def get_death_place(self):
-        death_event = self.get_death_event()
-        if death_event:
-            return death_event.place
-        else:
-            return None
+        return self.death_place
 
     def get_death_date(self):
-        death_event = self.get_death_event()
-        if death_event:
-            return death_event.date
-        else:
-            return None
+        return self.death_date
         
     def get_death_event(self):
+        if hasattr(self, 'vital_events'):
+            return self.get_vital_event('death')
         try:
             return Event.objects.get(person=self, event_type='death')
         except Event.DoesNotExist:
@@ -187,404 +308,13 @@ class Person(models.Model):
         return Event.objects.filter(person=self, event_type='death').exists()
 
     def get_data_quality_warnings(self):
-        warnings = []
-
-        birth_events = Event.objects.filter(person=self, event_type='birth').order_by('id')
-        death_events = Event.objects.filter(person=self, event_type='death').order_by('id')
-
-        if birth_events.count() > 1:
-            warnings.append({
-                'code': 'multiple_birth_events',
-                'message': 'This person has multiple birth events. Only one should exist.',
-            })
-
-        if death_events.count() > 1:
-            warnings.append({
-                'code': 'multiple_death_events',
-                'message': 'This person has multiple death events. Only one should exist.',
-            })
-
-        birth_event = birth_events.first()
-        death_event = death_events.first()
-        birth_year = birth_event.year if birth_event else None
-        death_year = death_event.year if death_event else None
-
-        if birth_year and death_year and birth_year > death_year:
-            warnings.append({
-                'code': 'birth_after_death',
-                'message': f'Birth year ({birth_year}) is after death year ({death_year}).',
-            })
-
-        own_events = Event.objects.filter(person=self).exclude(event_type__in=['birth', 'death'])
-        for event in own_events:
-            if not event.year:
-                continue
-            if birth_year and event.year < birth_year:
-                warnings.append({
-                    'code': 'event_before_birth',
-                    'message': f'{event.get_event_type_display()} ({event.year}) is before birth year ({birth_year}).',
-                })
-            if death_year and event.year > death_year:
-                warnings.append({
-                    'code': 'event_after_death',
-                    'message': f'{event.get_event_type_display()} ({event.year}) is after death year ({death_year}).',
-                })
-
-        parent_family = Family.objects.filter(children__person=self).first()
-        if parent_family and (parent_family.husband_id == self.id or parent_family.wife_id == self.id):
-            warnings.append({
-                'code': 'self_as_parent',
-                'message': 'This person is linked as their own parent.',
-            })
-
-        if parent_family and birth_year:
-            parent_checks = [
-                ('father', parent_family.husband),
-                ('mother', parent_family.wife),
-            ]
-            for parent_label, parent in parent_checks:
-                if not parent:
-                    continue
-
-                parent_birth = parent.get_birth_event()
-                parent_death = parent.get_death_event()
-
-                if parent_birth and parent_birth.year and parent_birth.year > birth_year:
-                    warnings.append({
-                        'code': f'{parent_label}_born_after_child',
-                        'message': f'The {parent_label} appears to be born after this person.',
-                    })
-
-                if parent_death and parent_death.year and parent_death.year < birth_year:
-                    warnings.append({
-                        'code': f'{parent_label}_died_before_child_birth',
-                        'message': f'The {parent_label} appears to have died before this person was born.',
-                    })
-
-        if birth_year or death_year:
-            families = Family.objects.filter(Q(husband=self) | Q(wife=self))
-            children = Child.objects.filter(family__in=families).select_related('person')
-            seen_children = set()
-            for child in children:
-                if child.person_id in seen_children:
-                    continue
-                seen_children.add(child.person_id)
-
-                child_birth = child.person.get_birth_event()
-                if not child_birth or not child_birth.year:
-                    continue
-
-                if birth_year and child_birth.year < birth_year:
-                    warnings.append({
-                        'code': 'child_born_before_parent',
-                        'message': f'Child {child.person.get_name()} appears born before this person.',
-                    })
-
-                if death_year and child_birth.year > death_year:
-                    warnings.append({
-                        'code': 'child_born_after_parent_death',
-                        'message': f'Child {child.person.get_name()} appears born after this person\'s death.',
-                    })
-
-        return warnings
+        from .neighbourhood import Neighbourhood
+        return Neighbourhood(self).get_quality_warnings()
 
     # Serializer data method
     def get_details_data(self):
-        data = {
-            'father': None,
-            'mother': None,
-            'siblings': [],
-            'half_siblings': [],
-            'families': [],
-        }
-
-
-        timeline_events = []
-        timeline_events_no_year = []
-
-        birth_event = self.get_birth_event()
-        birth_year = birth_event.year if birth_event else None
-        if birth_event:
-            data['birth'] = {
-                'date': birth_event.date,
-                'year': birth_event.year,
-                'place': birth_event.place,
-            }
-
-        death_event = self.get_death_event()
-        death_year = death_event.year if death_event else None
-        if death_event:
-            data['death'] = {
-                'date': death_event.date,
-                'year': death_event.year,
-                'place': death_event.place,
-            }
-
-        if birth_year and death_year:
-            data['years'] = f"({birth_year} - {death_year})"
-        elif birth_year:
-            data['years'] = f"({birth_year} - )"
-        elif death_year:
-            data['years'] = f"( - {death_year})"
-        else:
-            data['years'] = ""
-
-        mother = self.get_mother()
-        father = self.get_father()
-
-        if father:
-            data['father'] = {
-                'id': father.id,
-                'full_name': father.get_name_years(),
-            }
-            f_death = father.get_death_event()
-            if not (f_death and death_year and f_death.year and f_death.year > death_year) and f_death and f_death.year:
-                timeline_events.append(
-                    {
-                        'year': f_death.year, 
-                        'description': f_death.description, 
-                        'date': f_death.date,
-                        'event_type': 'death', 
-                        'event_type_full': "Death of father",
-                        'place': f_death.place,
-                        'person_id': father.id,
-                        'person_name': father.get_name(),
-                        'model_type': 'relative',
-                    }
-                )
-        if mother:
-            data['mother'] = {
-                'id': mother.id,
-                'full_name': mother.get_name_years(),
-            }
-            m_death = mother.get_death_event()
-            if not (m_death and death_year and m_death.year and m_death.year > death_year) and m_death and m_death.year:
-                timeline_events.append(
-                    {
-                        'year': m_death.year,
-                        'description': "", 
-                        'date': m_death.date,
-                        'event_type': 'death', 
-                        'event_type_full': "Death of mother",
-                        'place': m_death.place,
-                        'person_id': mother.id,
-                        'person_name': mother.get_name(),
-                        'model_type': 'relative',
-                    }
-                )
-
-        birth_year_subquery = Event.objects.filter(person=OuterRef('person'), event_type='birth').values('year')[:1]
-
-        siblings = None
-        half_siblings = None
-        families = []
-        children_objects = Child.objects.filter(person=self)
-        if children_objects:
-            siblings = Child.objects.filter(family=children_objects[0].family).exclude(id=children_objects[0].id).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year')
-
-            half_sibling_queries = Q()
-            if father is not None:
-                half_sibling_queries |= Q(husband=father) & ~Q(wife=mother)
-            if mother is not None:
-                half_sibling_queries |= Q(wife=mother) & ~Q(husband=father)
-
-            half_sibling_families = Family.objects.filter(half_sibling_queries)
-            half_siblings = Child.objects.filter(family__in=half_sibling_families).exclude(person=self).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year')
-
-        if siblings:
-            for s in siblings:
-                data['siblings'].append({
-                    'id': s.person.id,
-                    'full_name': s.person.get_name_years(),
-            })
-        if half_siblings:
-            for h in half_siblings:
-                data['half_siblings'].append({
-                    'id': h.person.id,
-                    'full_name': h.person.get_name_years(),
-                })
-
-        family_objects = Family.objects.filter(Q(husband=self) | Q(wife=self))
-        if family_objects:
-            for f in family_objects:
-                family = {
-                    'id': f.id,
-                    'partner': {},
-                    'children': []
-                }
-
-                partner = None
-                if f.husband == self and f.wife:
-                    partner = f.wife
-                if f.wife == self and f.husband:
-                    partner = f.husband
-
-                if partner:
-                    family['partner']['id'] = partner.id
-                    family['partner']['full_name'] = partner.get_name_years()
-                
-                    p_death = partner.get_death_event()
-                    if p_death and death_year and p_death.year and p_death.year < death_year:
-                        timeline_events.append(
-                            {
-                                'year': p_death.year, 
-                                'description': p_death.description, 
-                                'date': p_death.date,
-                                'event_type': 'death', 
-                                'event_type_full': f"Death of {'husband' if partner.sex == 'M' else 'wife' if partner.sex == 'F' else 'partner'}",
-                                'place': p_death.place,
-                                'person_id': partner.id,
-                                'person_name': partner.get_name(),
-                                'model_type': 'relative',
-                            }
-                        )
-
-                children = Child.objects.filter(family=f).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year')
-                for child in children:
-                    family['children'].append({
-                        'id': child.person.id,
-                        'full_name': child.person.get_name_years(),
-                    })
-                    c_birth = child.person.get_birth_event()
-                    c_death = child.person.get_death_event()
-                    if c_birth and c_birth.year:
-                        timeline_events.append(
-                            {
-                                'year': c_birth.year, 
-                                'description': c_birth.description, 
-                                'date': c_birth.date,
-                                'event_type': 'birth', 
-                                'event_type_full': f"Birth of {'son' if child.person.sex == 'M' else 'daughter' if child.person.sex == 'F' else 'child'}",
-                                'place': c_birth.place, 
-                                'person_id': child.person.id,
-                                'person_name': child.person.get_name(),
-                                'model_type': 'relative',
-                            }
-                        )
-                    if c_death and death_year and c_death.year and c_death.year < death_year:
-                        timeline_events.append(
-                            {
-                                'year': c_death.year, 
-                                'description': c_death.description, 
-                                'date': c_death.date,
-                                'event_type': 'birth', 
-                                'event_type_full': f"Death of {'son' if child.person.sex == 'M' else 'daughter' if child.person.sex == 'F' else 'child'}",
-                                'place': c_death.place, 
-                                'person_id': child.person.id,
-                                'person_name': child.person.get_name(),
-                                'model_type': 'relative',
-                            }
-                        )
-
-                families.append(family)
-
-            data['families'] = families
-
-            family_events = FamilyEvent.objects.filter(family__in=family_objects).order_by('year')
-
-            for e in family_events:
-                new_event = {
-                    'year': e.year, 
-                    'description': e.description, 
-                    'date': e.date,
-                    'event_type': e.event_type, 
-                    'event_type_full': e.get_event_type_display(),
-                    'person_id': e.family.husband.id if e.family.wife == self else e.family.wife.id,
-                    'person_name': e.family.husband.get_name() if e.family.wife == self else e.family.wife.get_name(),
-                    'place': e.place, 
-                    'id': e.id, 
-                    'model_type': 'family'
-                }
-                if new_event['year']:
-                    timeline_events.append(new_event)
-                else:
-                    timeline_events_no_year.append(new_event)
-
-        for s in chain(siblings or [], half_siblings or []):
-            s_birth = s.person.get_birth_event()
-            s_death = s.person.get_death_event()
-            if s_birth and birth_year and s_birth.year and s_birth.year > birth_year and not (death_year and s_birth.year > death_year):
-                timeline_events.append(
-                    {
-                        'year': s_birth.year, 
-                        'description': "", 
-                        'date': s_birth.date,
-                        'event_type': 'birth', 
-                        'event_type_full': f"Birth of {'brother' if s.person.sex == 'M' else 'sister' if s.person.sex == 'F' else 'sibling'}",
-                        'place': s_birth.place, 
-                        'person_id': s.person.id,
-                        'person_name': s.person.get_name(),
-                        'model_type': 'relative',
-                    }
-                )
-            if s_death and death_year and s_death.year and s_death.year < death_year and not (birth_year and s_death.year < birth_year):
-                timeline_events.append(
-                    {
-                        'year': s_death.year, 
-                        'description': "", 
-                        'date': s_death.date,
-                        'event_type': 'death', 
-                        'event_type_full': f"Death of {'brother' if s.person.sex == 'M' else 'sister' if s.person.sex == 'F' else 'sibling'}",
-                        'place': s_death.place,
-                        'person_id': s.person.id,
-                        'person_name': s.person.get_name(),
-                        'model_type': 'relative',
-                    }
-                )
-
-        events = Event.objects.filter(person=self).order_by('year')
-        for e in events:
-            if e.event_type not in ['birth', 'death']:
-                new_event = {
-                        'year': e.year, 
-                        'description': e.description,
-                        'date': e.date,
-                        'event_type': e.event_type, 
-                        'event_type_full': e.get_event_type_display(),
-                        'place': e.place, 
-                        'id': e.id, 
-                        'model_type': 'basic'
-                    }
-                if new_event['year']:
-                    timeline_events.append(new_event)
-                else:
-                    timeline_events_no_year.append(new_event)
-
-        timeline_events.sort(key=lambda x: x['year'])
-
-        if birth_event:
-            timeline_events.insert(0, 
-                               {'year': birth_year, 
-                                'date': birth_event.date,
-                                'description': birth_event.description, 
-                                'event_type': 'birth',
-                                'event_type_full': 'Birth', 
-                                'place': birth_event.place, 
-                                'id': birth_event.id, 
-                                'model_type': 'basic'
-                                }
-                            )
-            
-        if death_event:
-            timeline_events.append(
-                {
-                    'year': death_year, 
-                    'date': death_event.date,
-                    'description': death_event.description, 
-                    'event_type': 'death', 
-                    'event_type_full': 'Death',
-                    'place': death_event.place, 
-                    'id': death_event.id, 
-                    'model_type': 'basic'
-                }
-            )
-
-        timeline_events.extend(timeline_events_no_year)
-
-        data['events'] = timeline_events
-        data['quality_warnings'] = self.get_data_quality_warnings()
-
-        return data
+        from .neighbourhood import Neighbourhood
+        return Neighbourhood(self).get_details_data()
 
     def __str__(self):
         return " ".join(filter(None, [self.first_name, self.last_name]))
@@ -702,6 +432,16 @@ class Event(models.Model):
         except:
             return Event(person=person, event_type=event_type)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The type in the database, so save() knows when an event stops being a birth or death
+        instance._saved_type = dict(zip(field_names, values)).get('event_type')
+        return instance
+
+    def changes_vitals(self):
+        return self.event_type in VITAL_EVENTS or getattr(self, '_saved_type', None) in VITAL_EVENTS
+
     def save(self, *args, **kwargs):
         if self.date:
             self.year = extract_year(self.date)
@@ -710,6 +450,10 @@ class Event(models.Model):
 
         super().save(*args, **kwargs)
 
+        if self.changes_vitals():
+            Person.update_vitals(self.person_id, self.person if Event.person.is_cached(self) else None)
+        self._saved_type = self.event_type
+
     def __str__(self):
         return f"{self.get_event_type_display()} for {self.person}"
     
@@ -741,6 +485,77 @@ class FamilyEvent(models.Model):
         return f"{self.get_event_type_display()} for {self.family}"
 
 
+class DataQualityWarning(models.Model):
+    # Kept up to date by genealogy.quality when a person, event, family or child changes
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE, related_name="quality_warnings")
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name="quality_warnings")
+    code = models.CharField(max_length=50)
+    message = models.TextField()
+    # The order of the warning among the person's warnings
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['person_id', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['person', 'position'], name='Person and warning position combination')
+        ]
+        indexes = [
+            models.Index(fields=['tree', 'code']),
+        ]
+
+    def __str__(self):
+        return f"{self.code} for {self.person}"
+
+
+class AncestorLink(models.Model):
+    # One row for every ancestor of every person, only kept when settings.ANCESTOR_CLOSURE is on,
+    # see genealogy.closure
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE, related_name="ancestor_links")
+    ancestor = models.ForeignKey(Person, on_delete=models.CASCADE, related_name="descendant_links")
+    descendant = models.ForeignKey(Person, on_delete=models.CASCADE, related_name="ancestor_links")
+    # Generations between the two, the shortest way if there are several
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='Ancestor and descendant combination')
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth']),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor} is an ancestor of {self.descendant}"
+
+
+class PersonNameKey(models.Model):
+    # One row for every first and last name of a person, with the key that all
+    # spellings of the name share, see genealogy.name_functions and genealogy.search
+    KIND_CHOICES = [
+        ('first', 'First name'),
+        ('last', 'Last name'),
+    ]
+
+    tree = models.ForeignKey(Tree, on_delete=models.CASCADE, related_name="name_keys")
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name="name_keys")
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    # The name as it is spelled, in lower case
+    name = models.CharField(max_length=100)
+    key = models.CharField(max_length=100)
+    # How the name sounds, see get_phonetic_key
+    phonetic = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        # With the key first, the indexes also find names in all public trees
+        indexes = [
+            models.Index(fields=['key', 'tree']),
+            models.Index(fields=['phonetic', 'tree']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} for {self.person}"
+
+
 class Archive(models.Model):
     title = models.CharField(max_length=100)
     archive_id = models.CharField(max_length=20, blank=True)
@@ -851,4 +666,156 @@ def image_post_delete_handler(sender, **kwargs):
         storage.delete(path)
 
         thumbnailer = get_thumbnailer(image.image)
-        thumbnailer.delete_thumbnails()
\ No newline at end of file
+        thumbnailer.delete_thumbnails()
+
+# The values collected for each callback until the current transaction
+# commits, per thread like the database connections
+_pending = threading.local()
+
+def collect_on_commit(callback, value):
+    """
+    Add value to a set that is passed to callback when the current transaction
+    commits, so callback runs once per transaction however many rows were saved
+    or deleted. Outside of a transaction callback runs right away.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        callback({value})
+        return
+
+    pending = _pending.__dict__.setdefault('callbacks', {})
+    # Only Django's list of on_commit callbacks refers to run, and a rollback
+    # empties that list, so a dead reference means the values were rolled back
+    if callback not in pending or pending[callback][0]() is None:
+        values = set()
+
+        def run():
+            # Values added from now on need a new callback
+            if pending.get(callback, (None, None))[1] is values:
+                del pending[callback]
+            callback(values)
+
+        pending[callback] = (weakref.ref(run), values)
+        transaction.on_commit(run)
+    pending[callback][1].add(value)
+
+def get_tree_id(instance, field, model):
+    """The tree of the Person or Family that instance points to with field."""
+    if getattr(type(instance), field).is_cached(instance):
+        return getattr(instance, field).tree_id
+    return model.objects.filter(pk=getattr(instance, f"{field}_id")).values_list('tree_id', flat=True).first()
+
+def tree_changed(tree_id):
+    if tree_id is not None:
+        collect_on_commit(Tree.bump_versions, tree_id)
+
+# Keep Tree.version up to date, so cached exports of the tree can be reused until it changes
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(post_save, sender=Family)
+@receiver(post_delete, sender=Family)
+def person_or_family_changed(sender, instance, **kwargs):
+    tree_changed(instance.tree_id)
+
+@receiver(post_delete, sender=Event)
+def event_deleted(sender, instance, **kwargs):
+    if instance.changes_vitals():
+        Person.update_vitals(instance.person_id, instance.person if Event.person.is_cached(instance) else None)
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed(sender, instance, **kwargs):
+    tree_changed(get_tree_id(instance, 'person', Person))
+
+@receiver(post_save, sender=Child)
+@receiver(post_delete, sender=Child)
+@receiver(post_save, sender=FamilyEvent)
+@receiver(post_delete, sender=FamilyEvent)
+def family_member_changed(sender, instance, **kwargs):
+    tree_changed(get_tree_id(instance, 'family', Family))
+
+def quality_changed(person_ids):
+    from .quality import update_warnings
+    update_warnings(person_ids)
+
+def persons_changed(*person_ids):
+    for person_id in person_ids:
+        if person_id is not None:
+            collect_on_commit(quality_changed, person_id)
+
+def get_family_parents(instance):
+    """The (husband_id, wife_id) of the family that instance points to."""
+    if Child.family.is_cached(instance):
+        return instance.family.husband_id, instance.family.wife_id
+    return Family.objects.filter(pk=instance.family_id).values_list('husband_id', 'wife_id').first() or ()
+
+# Keep the stored data quality warnings up to date. The changed persons are
+# collected during the transaction, and when it commits they are checked again
+# together with their parents, partners and children
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance, **kwargs):
+    persons_changed(instance.pk)
+
+@receiver(pre_delete, sender=Person)
+def person_deleting(sender, instance, **kwargs):
+    # The families are changed when the person is removed, so the relatives are looked up first
+    from .quality import get_relatives
+    persons_changed(*get_relatives([instance.pk]))
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_quality_changed(sender, instance, **kwargs):
+    persons_changed(instance.person_id)
+
+@receiver(pre_save, sender=Family)
+def family_saving(sender, instance, **kwargs):
+    # Also check the partners that are replaced by this save
+    if instance.pk:
+        persons_changed(*Family.objects.filter(pk=instance.pk).values_list('husband_id', 'wife_id').first() or ())
+
+@receiver(post_save, sender=Family)
+@receiver(post_delete, sender=Family)
+def family_quality_changed(sender, instance, **kwargs):
+    persons_changed(instance.husband_id, instance.wife_id)
+
+@receiver(post_save, sender=Child)
+@receiver(post_delete, sender=Child)
+def child_quality_changed(sender, instance, **kwargs):
+    persons_changed(instance.person_id, *get_family_parents(instance))
+
+def ancestors_changed(person_ids):
+    from .closure import update_links
+    update_links(person_ids)
+
+# Keep the AncestorLink table up to date when it is used. The persons whose
+# parents changed are collected, and their links and the links of their
+# descendants are replaced when the transaction commits
+@receiver(post_save, sender=Child)
+@receiver(post_delete, sender=Child)
+def child_ancestors_changed(sender, instance, **kwargs):
+    if settings.ANCESTOR_CLOSURE:
+        collect_on_commit(ancestors_changed, instance.person_id)
+
+@receiver(post_save, sender=Family)
+def family_ancestors_changed(sender, instance, created, **kwargs):
+    # A new husband or wife is a new parent of the children
+    if settings.ANCESTOR_CLOSURE and not created:
+        for person_id in Child.objects.filter(family=instance).values_list('person_id', flat=True):
+            collect_on_commit(ancestors_changed, person_id)
+
+@receiver(pre_delete, sender=Person)
+def person_ancestors_deleting(sender, instance, **kwargs):
+    # The families only lose the person as husband or wife, which sends no signals for the children
+    if settings.ANCESTOR_CLOSURE:
+        children = Child.objects.filter(Q(family__husband=instance) | Q(family__wife=instance))
+        for person_id in children.values_list('person_id', flat=True):
+            collect_on_commit(ancestors_changed, person_id)
+
+def search_index_changed(person_ids):
+    from .search import update_index
+    update_index(person_ids)
+
+# Keep the full-text search index and the name keys up to date, see genealogy.search
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def person_search_changed(sender, instance, **kwargs):
+    collect_on_commit(search_index_changed, instance.pk)
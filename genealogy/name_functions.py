@@ -1,3 +1,74 @@
-# This file will be used later for functions related to names
-# where names can be spelled in different ways but are really
-# the same name
\ No newline at end of file
+import re
+
+from .constants import NAMES_REPLACE, SURNAMES_REPLACE
+
+# Names can be spelled in different ways but are really the same name. Every
+# spelling gets the first one of its list in constants as its key, so Per, Pär
+# and Pehr are all "per" and Olofsson and Olsson are both "olofsson". The keys
+# are stored in PersonNameKey, run rebuild_search_index after changing the lists.
+VARIANT_KEYS = {
+    'first': {variation.lower(): variations[0].lower() for variations in NAMES_REPLACE for variation in variations},
+    'last': {variation.lower(): variations[0].lower() for variations in SURNAMES_REPLACE for variation in variations},
+}
+
+WORD_SPLIT = re.compile(r"[\s\-/,.()]+")
+
+# Spellings that sound the same, replaced in this order before the vowels are
+# left out. Old Swedish records write the same name with C or K, ph or f, dt
+# or t, and double or single consonants. The keys are stored in PersonNameKey
+# and records.BirthRecord.
+PHONETIC_FOLD = str.maketrans({
+    'w': 'v', 'f': 'v', 'z': 's', 'q': 'k', 'x': 'ks',
+    'é': 'e', 'è': 'e', 'æ': 'ä', 'ø': 'ö', 'ü': 'y',
+})
+PHONETIC_REPLACE = [
+    (re.compile(r"[^a-zåäö]"), ""),
+    (re.compile(r"^(h|d|g|l)j"), "j"),  # Hjalmar, Jalmar
+    (re.compile(r"^g(?=[eiyäö])"), "j"),  # Göran, Jöran
+    (re.compile(r"^k(?=[eiyäö])|kj"), "tj"),  # Kerstin, Kjerstin
+    (re.compile(r"sch|skj|stj"), "sj"),
+    (re.compile(r"ph"), "v"),  # Sophia, Sofia
+    (re.compile(r"th"), "t"),
+    (re.compile(r"dt"), "t"),
+    (re.compile(r"ck|ch"), "k"),  # Christina, Kristina
+    (re.compile(r"c(?=[eiyäö])"), "s"),  # Cecilia
+    (re.compile(r"c"), "k"),  # Carl, Karl
+    (re.compile(r"(?<=r)d$"), "r"),  # Halvard, Halvar
+    (re.compile(r"(.)\1+"), r"\1"),  # Brita, Britta
+]
+VOWELS = re.compile(r"[aeiouyåäöh]")
+
+
+def get_name_key(name, kind):
+    """The key of a single first ('first') or last ('last') name, the same for all spellings of it."""
+    name = name.lower()
+    return VARIANT_KEYS[kind].get(name, name)
+
+def has_variants(name, kind):
+    return name.lower() in VARIANT_KEYS[kind]
+
+def get_name_words(name):
+    """Every name in a first_name or last_name, like "Anna-Maja" or "Per Olof", in lower case."""
+    return list(dict.fromkeys(word for word in WORD_SPLIT.split(name.lower()) if word))
+
+def get_name_keys(name, kind):
+    """The keys of every name in a first_name or last_name."""
+    return list(dict.fromkeys(get_name_key(word, kind) for word in get_name_words(name)))
+
+def get_phonetic_key(name):
+    """
+    A key for how a single name sounds, so that Carl and Karl, Sophia and
+    Sofia, or Andersson and Anderson get the same key. The first letter is
+    kept and only the consonants after it, so the key is rough on purpose.
+    """
+    name = name.lower().translate(PHONETIC_FOLD)
+    for pattern, replacement in PHONETIC_REPLACE:
+        name = pattern.sub(replacement, name)
+    if not name:
+        return ''
+    first = {'å': 'o', 'ä': 'e'}.get(name[0], name[0])
+    return first + VOWELS.sub('', name[1:])
+
+def get_phonetic_keys(name, kind):
+    """The phonetic keys of every name in a first_name or last_name, from their name keys."""
+    return list(dict.fromkeys(get_phonetic_key(key) for key in get_name_keys(name, kind)))
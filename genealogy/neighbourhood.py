@@ -0,0 +1,397 @@
+from django.db.models import Q
+from itertools import chain
+
+from .models import Child, Event, Family, FamilyEvent, Person
+from .quality import get_person_warnings
+
+
+class Neighbourhood:
+    """
+    A person with their parents, siblings, half siblings, partners and
+    children, and the events of all of them that the person page needs.
+    Everything is loaded in a fixed number of queries, however large the
+    family is.
+    """
+    def __init__(self, person):
+        self.person = person
+
+        # The families the person is a child in. The first by id gives the parents,
+        # the first by child id gives the siblings.
+        own_children = list(Child.objects.filter(person=person).select_related('family').order_by('id'))
+        self.parent_family = min((c.family for c in own_children), key=lambda f: f.id, default=None)
+        self.sibling_family_id = own_children[0].family_id if own_children else None
+        self.own_child_id = own_children[0].id if own_children else None
+
+        self.father_id = None
+        self.mother_id = None
+        if self.parent_family:
+            if self.parent_family.husband_id != person.id:
+                self.father_id = self.parent_family.husband_id
+            if self.parent_family.wife_id != person.id:
+                self.mother_id = self.parent_family.wife_id
+
+        self.families = list(Family.objects.filter(Q(husband=person) | Q(wife=person)).order_by('id'))
+
+        half_sibling_families = []
+        if own_children and (self.father_id or self.mother_id):
+            half_sibling_queries = Q()
+            if self.father_id is not None:
+                half_sibling_queries |= Q(husband_id=self.father_id) & ~Q(wife_id=self.mother_id)
+            if self.mother_id is not None:
+                half_sibling_queries |= Q(wife_id=self.mother_id) & ~Q(husband_id=self.father_id)
+            half_sibling_families = list(Family.objects.filter(half_sibling_queries).values_list('id', flat=True))
+        self.half_sibling_family_ids = set(half_sibling_families)
+
+        family_ids = {f.id for f in self.families} | self.half_sibling_family_ids
+        if self.sibling_family_id:
+            family_ids.add(self.sibling_family_id)
+        self.children = list(
+            Child.objects.filter(family_id__in=family_ids).order_by('id').values_list('id', 'family_id', 'person_id')
+        )
+
+        person_ids = {person_id for _, _, person_id in self.children}
+        for family in chain([self.parent_family] if self.parent_family else [], self.families):
+            person_ids.update([family.husband_id, family.wife_id])
+        person_ids.discard(None)
+        person_ids.discard(person.id)
+        self.persons = Person.objects.in_bulk(person_ids)
+        self.persons[person.id] = person
+
+        # Birth and death events of everyone, and all of the person's own events
+        vital_events = {person_id: [] for person_id in self.persons}
+        self.own_events = []
+        events = Event.objects.filter(
+            Q(person_id__in=self.persons, event_type__in=['birth', 'death']) | Q(person=person)
+        ).order_by('id')
+        for event in events:
+            if event.event_type in ('birth', 'death'):
+                vital_events[event.person_id].append(event)
+            if event.person_id == person.id:
+                self.own_events.append(event)
+        for person_id, events in vital_events.items():
+            self.persons[person_id].vital_events = events
+
+        self.family_events = list(FamilyEvent.objects.filter(family__in=self.families))
+
+    def get_person(self, person_id):
+        return self.persons.get(person_id)
+
+    def get_sort_birth_year(self, person_id):
+        # The year of the first birth event, even when there are more than one
+        birth_events = [e for e in self.persons[person_id].vital_events if e.event_type == 'birth']
+        return birth_events[0].year if birth_events else None
+
+    def get_children(self, family_ids, exclude=lambda child_id, person_id: False):
+        """The persons in the families as children, sorted by birth year with unknown years first."""
+        children = [
+            (child_id, person_id) for child_id, family_id, person_id in self.children
+            if family_id in family_ids and not exclude(child_id, person_id)
+        ]
+        children.sort(key=lambda c: (by_year(self.get_sort_birth_year(c[1])), c[0]))
+        return [self.persons[person_id] for _, person_id in children]
+
+    def get_details_data(self):
+        person = self.person
+        data = {
+            'father': None,
+            'mother': None,
+            'siblings': [],
+            'half_siblings': [],
+            'families': [],
+        }
+
+
+        timeline_events = []
+        timeline_events_no_year = []
+
+        birth_event = person.get_birth_event()
+        birth_year = birth_event.year if birth_event else None
+        if birth_event:
+            data['birth'] = {
+                'date': birth_event.date,
+                'year': birth_event.year,
+                'place': birth_event.place,
+            }
+
+        death_event = person.get_death_event()
+        death_year = death_event.year if death_event else None
+        if death_event:
+            data['death'] = {
+                'date': death_event.date,
+                'year': death_event.year,
+                'place': death_event.place,
+            }
+
+        if birth_year and death_year:
+            data['years'] = f"({birth_year} - {death_year})"
+        elif birth_year:
+            data['years'] = f"({birth_year} - )"
+        elif death_year:
+            data['years'] = f"( - {death_year})"
+        else:
+            data['years'] = ""
+
+        mother = self.get_person(self.mother_id)
+        father = self.get_person(self.father_id)
+
+        if father:
+            data['father'] = {
+                'id': father.id,
+                'full_name': father.get_name_years(),
+            }
+            f_death = father.get_death_event()
+            if not (f_death and death_year and f_death.year and f_death.year > death_year) and f_death and f_death.year:
+                timeline_events.append(
+                    {
+                        'year': f_death.year,
+                        'description': f_death.description,
+                        'date': f_death.date,
+                        'event_type': 'death',
+                        'event_type_full': "Death of father",
+                        'place': f_death.place,
+                        'person_id': father.id,
+                        'person_name': father.get_name(),
+                        'model_type': 'relative',
+                    }
+                )
+        if mother:
+            data['mother'] = {
+                'id': mother.id,
+                'full_name': mother.get_name_years(),
+            }
+            m_death = mother.get_death_event()
+            if not (m_death and death_year and m_death.year and m_death.year > death_year) and m_death and m_death.year:
+                timeline_events.append(
+                    {
+                        'year': m_death.year,
+                        'description': "",
+                        'date': m_death.date,
+                        'event_type': 'death',
+                        'event_type_full': "Death of mother",
+                        'place': m_death.place,
+                        'person_id': mother.id,
+                        'person_name': mother.get_name(),
+                        'model_type': 'relative',
+                    }
+                )
+
+        siblings = []
+        half_siblings = []
+        if self.sibling_family_id:
+            siblings = self.get_children(
+                {self.sibling_family_id},
+                exclude=lambda child_id, person_id: child_id == self.own_child_id
+            )
+            half_siblings = self.get_children(
+                self.half_sibling_family_ids,
+                exclude=lambda child_id, person_id: person_id == person.id
+            )
+
+        for s in siblings:
+            data['siblings'].append({
+                'id': s.id,
+                'full_name': s.get_name_years(),
+        })
+        for h in half_siblings:
+            data['half_siblings'].append({
+                'id': h.id,
+                'full_name': h.get_name_years(),
+            })
+
+        if self.families:
+            families = []
+            for f in self.families:
+                family = {
+                    'id': f.id,
+                    'partner': {},
+                    'children': []
+                }
+
+                partner = None
+                if f.husband_id == person.id and f.wife_id:
+                    partner = self.get_person(f.wife_id)
+                if f.wife_id == person.id and f.husband_id:
+                    partner = self.get_person(f.husband_id)
+
+                if partner:
+                    family['partner']['id'] = partner.id
+                    family['partner']['full_name'] = partner.get_name_years()
+
+                    p_death = partner.get_death_event()
+                    if p_death and death_year and p_death.year and p_death.year < death_year:
+                        timeline_events.append(
+                            {
+                                'year': p_death.year,
+                                'description': p_death.description,
+                                'date': p_death.date,
+                                'event_type': 'death',
+                                'event_type_full': f"Death of {'husband' if partner.sex == 'M' else 'wife' if partner.sex == 'F' else 'partner'}",
+                                'place': p_death.place,
+                                'person_id': partner.id,
+                                'person_name': partner.get_name(),
+                                'model_type': 'relative',
+                            }
+                        )
+
+                for child in self.get_children({f.id}):
+                    family['children'].append({
+                        'id': child.id,
+                        'full_name': child.get_name_years(),
+                    })
+                    c_birth = child.get_birth_event()
+                    c_death = child.get_death_event()
+                    if c_birth and c_birth.year:
+                        timeline_events.append(
+                            {
+                                'year': c_birth.year,
+                                'description': c_birth.description,
+                                'date': c_birth.date,
+                                'event_type': 'birth',
+                                'event_type_full': f"Birth of {'son' if child.sex == 'M' else 'daughter' if child.sex == 'F' else 'child'}",
+                                'place': c_birth.place,
+                                'person_id': child.id,
+                                'person_name': child.get_name(),
+                                'model_type': 'relative',
+                            }
+                        )
+                    if c_death and death_year and c_death.year and c_death.year < death_year:
+                        timeline_events.append(
+                            {
+                                'year': c_death.year,
+                                'description': c_death.description,
+                                'date': c_death.date,
+                                'event_type': 'birth',
+                                'event_type_full': f"Death of {'son' if child.sex == 'M' else 'daughter' if child.sex == 'F' else 'child'}",
+                                'place': c_death.place,
+                                'person_id': child.id,
+                                'person_name': child.get_name(),
+                                'model_type': 'relative',
+                            }
+                        )
+
+                families.append(family)
+
+            data['families'] = families
+
+            families_by_id = {f.id: f for f in self.families}
+            for e in sorted(self.family_events, key=lambda e: (by_year(e.year), e.id)):
+                family = families_by_id[e.family_id]
+                # The partner in the family, which is missing for a single parent
+                partner = self.get_person(family.husband_id if family.wife_id == person.id else family.wife_id)
+                new_event = {
+                    'year': e.year,
+                    'description': e.description,
+                    'date': e.date,
+                    'event_type': e.event_type,
+                    'event_type_full': e.get_event_type_display(),
+                    'person_id': partner.id if partner else None,
+                    'person_name': partner.get_name() if partner else "",
+                    'place': e.place,
+                    'id': e.id,
+                    'model_type': 'family'
+                }
+                if new_event['year']:
+                    timeline_events.append(new_event)
+                else:
+                    timeline_events_no_year.append(new_event)
+
+        for s in chain(siblings, half_siblings):
+            s_birth = s.get_birth_event()
+            s_death = s.get_death_event()
+            if s_birth and birth_year and s_birth.year and s_birth.year > birth_year and not (death_year and s_birth.year > death_year):
+                timeline_events.append(
+                    {
+                        'year': s_birth.year,
+                        'description': "",
+                        'date': s_birth.date,
+                        'event_type': 'birth',
+                        'event_type_full': f"Birth of {'brother' if s.sex == 'M' else 'sister' if s.sex == 'F' else 'sibling'}",
+                        'place': s_birth.place,
+                        'person_id': s.id,
+                        'person_name': s.get_name(),
+                        'model_type': 'relative',
+                    }
+                )
+            if s_death and death_year and s_death.year and s_death.year < death_year and not (birth_year and s_death.year < birth_year):
+                timeline_events.append(
+                    {
+                        'year': s_death.year,
+                        'description': "",
+                        'date': s_death.date,
+                        'event_type': 'death',
+                        'event_type_full': f"Death of {'brother' if s.sex == 'M' else 'sister' if s.sex == 'F' else 'sibling'}",
+                        'place': s_death.place,
+                        'person_id': s.id,
+                        'person_name': s.get_name(),
+                        'model_type': 'relative',
+                    }
+                )
+
+        for e in sorted(self.own_events, key=lambda e: (by_year(e.year), e.id)):
+            if e.event_type not in ['birth', 'death']:
+                new_event = {
+                        'year': e.year,
+                        'description': e.description,
+                        'date': e.date,
+                        'event_type': e.event_type,
+                        'event_type_full': e.get_event_type_display(),
+                        'place': e.place,
+                        'id': e.id,
+                        'model_type': 'basic'
+                    }
+                if new_event['year']:
+                    timeline_events.append(new_event)
+                else:
+                    timeline_events_no_year.append(new_event)
+
+        timeline_events.sort(key=lambda x: x['year'])
+
+        if birth_event:
+            timeline_events.insert(0,
+                               {'year': birth_year,
+                                'date': birth_event.date,
+                                'description': birth_event.description,
+                                'event_type': 'birth',
+                                'event_type_full': 'Birth',
+                                'place': birth_event.place,
+                                'id': birth_event.id,
+                                'model_type': 'basic'
+                                }
+                            )
+
+        if death_event:
+            timeline_events.append(
+                {
+                    'year': death_year,
+                    'date': death_event.date,
+                    'description': death_event.description,
+                    'event_type': 'death',
+                    'event_type_full': 'Death',
+                    'place': death_event.place,
+                    'id': death_event.id,
+                    'model_type': 'basic'
+                }
+            )
+
+        timeline_events.extend(timeline_events_no_year)
+
+        data['events'] = timeline_events
+        data['quality_warnings'] = self.get_quality_warnings()
+
+        return data
+
+    def get_quality_warnings(self):
+        parent_family = self.parent_family
+        family_ids = {f.id for f in self.families}
+        return get_person_warnings(
+            self.person.id,
+            [(e.event_type, e.year) for e in self.own_events],
+            (parent_family.husband_id, parent_family.wife_id) if parent_family else None,
+            [person_id for _, family_id, person_id in self.children if family_id in family_ids],
+            lambda pk: [(e.event_type, e.year) for e in self.persons[pk].vital_events],
+            lambda pk: self.persons[pk].get_name(),
+        )
+
+def by_year(year):
+    # Sorts like ORDER BY year in the database, with unknown years first
+    return (year is not None, year or 0)
@@ -0,0 +1,48 @@
+from .models import Person
+
+DEFAULT_GENERATIONS = 3
+MAX_GENERATIONS = 10
+
+
+def get_generations(value):
+    """The number of generations asked for with ?generations=, between 1 and MAX_GENERATIONS."""
+    try:
+        generations = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_GENERATIONS
+    return max(1, min(generations, MAX_GENERATIONS))
+
+
+class Pedigree:
+    """
+    The ancestors of a person for a chart of the given number of generations,
+    the person being the first generation. The ancestors are found in the
+    tree's TreeGraph and loaded in one query, so the chart takes the same
+    number of queries however many generations and ancestors it has.
+    """
+    def __init__(self, graph, person, generations):
+        self.person = person
+        self.generations = generations
+        # person id -> (father id, mother id)
+        self.parents = {}
+
+        level = {person.id}
+        for _ in range(generations - 1):
+            level -= self.parents.keys()
+            if not level:
+                break
+
+            # Like Person.get_father, the graph takes the parents from the first family by id
+            for child_id in level:
+                self.parents[child_id] = (graph.get_father(child_id), graph.get_mother(child_id))
+            level = {parent_id for child_id in level for parent_id in self.parents[child_id] if parent_id}
+
+        ancestor_ids = {parent_id for parents in self.parents.values() for parent_id in parents if parent_id}
+        self.persons = Person.objects.select_related('profile_image').in_bulk(ancestor_ids)
+        self.persons[person.id] = person
+
+    def get_father(self, person):
+        return self.persons.get(self.parents.get(person.id, (None, None))[0])
+
+    def get_mother(self, person):
+        return self.persons.get(self.parents.get(person.id, (None, None))[1])
@@ -0,0 +1,275 @@
+from collections import defaultdict
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Child, DataQualityWarning, Event, Family, Person
+
+# Persons checked at a time when updating, which also keeps the IN lists below the database limits
+BATCH_SIZE = 500
+
+EVENT_TYPE_NAMES = dict(Event.EVENT_TYPES)
+
+
+def get_person_warnings(person_id, events, parent_family, children, get_events, get_name):
+    """
+    The data quality warnings for a person.
+
+    events are the person's events as (event_type, year) in the order they
+    were added, parent_family the (husband_id, wife_id) of the family the
+    person is a child in or None, and children the ids of the children in the
+    person's own families. get_events and get_name give the events and name of
+    the parents and children from their ids.
+    """
+    warnings = []
+
+    birth_years = [year for event_type, year in events if event_type == 'birth']
+    death_years = [year for event_type, year in events if event_type == 'death']
+
+    if len(birth_years) > 1:
+        warnings.append({
+            'code': 'multiple_birth_events',
+            'message': 'This person has multiple birth events. Only one should exist.',
+        })
+
+    if len(death_years) > 1:
+        warnings.append({
+            'code': 'multiple_death_events',
+            'message': 'This person has multiple death events. Only one should exist.',
+        })
+
+    birth_year = birth_years[0] if birth_years else None
+    death_year = death_years[0] if death_years else None
+
+    if birth_year and death_year and birth_year > death_year:
+        warnings.append({
+            'code': 'birth_after_death',
+            'message': f'Birth year ({birth_year}) is after death year ({death_year}).',
+        })
+
+    for event_type, year in events:
+        if event_type in ('birth', 'death') or not year:
+            continue
+        event_name = EVENT_TYPE_NAMES.get(event_type, event_type)
+        if birth_year and year < birth_year:
+            warnings.append({
+                'code': 'event_before_birth',
+                'message': f'{event_name} ({year}) is before birth year ({birth_year}).',
+            })
+        if death_year and year > death_year:
+            warnings.append({
+                'code': 'event_after_death',
+                'message': f'{event_name} ({year}) is after death year ({death_year}).',
+            })
+
+    if parent_family and person_id in parent_family:
+        warnings.append({
+            'code': 'self_as_parent',
+            'message': 'This person is linked as their own parent.',
+        })
+
+    if parent_family and birth_year:
+        for parent_label, parent_id in zip(('father', 'mother'), parent_family):
+            if parent_id is None:
+                continue
+
+            parent_events = get_events(parent_id)
+            parent_birth_year = get_single_year(parent_events, 'birth')
+            parent_death_year = get_single_year(parent_events, 'death')
+
+            if parent_birth_year and parent_birth_year > birth_year:
+                warnings.append({
+                    'code': f'{parent_label}_born_after_child',
+                    'message': f'The {parent_label} appears to be born after this person.',
+                })
+
+            if parent_death_year and parent_death_year < birth_year:
+                warnings.append({
+                    'code': f'{parent_label}_died_before_child_birth',
+                    'message': f'The {parent_label} appears to have died before this person was born.',
+                })
+
+    if birth_year or death_year:
+        for child_id in dict.fromkeys(children):
+            child_birth_year = get_single_year(get_events(child_id), 'birth')
+            if not child_birth_year:
+                continue
+
+            if birth_year and child_birth_year < birth_year:
+                warnings.append({
+                    'code': 'child_born_before_parent',
+                    'message': f'Child {get_name(child_id)} appears born before this person.',
+                })
+
+            if death_year and child_birth_year > death_year:
+                warnings.append({
+                    'code': 'child_born_after_parent_death',
+                    'message': f'Child {get_name(child_id)} appears born after this person\'s death.',
+                })
+
+    return warnings
+
+def get_single_year(events, event_type):
+    # Like Person.get_birth_event and get_death_event, nothing when there are several events
+    years = [year for e_type, year in events if e_type == event_type]
+    return years[0] if len(years) == 1 else None
+
+def get_tree_warnings(tree):
+    """
+    The data quality warnings for every person in the tree, as a dict of
+    person id -> warnings for the persons that have any. The events,
+    families and children of the tree are loaded once, so the number of
+    queries doesn't depend on the size of the tree.
+    """
+    persons = Person.objects.filter(tree=tree).values_list('id', 'first_name', 'last_name')
+    names = {person_id: get_name(first_name, last_name) for person_id, first_name, last_name in persons}
+
+    events = Event.objects.filter(person__tree=tree).order_by('id').values_list('person_id', 'event_type', 'year')
+    families = Family.objects.filter(tree=tree).values_list('id', 'husband_id', 'wife_id')
+    child_rows = Child.objects.filter(family__tree=tree).values_list('id', 'family_id', 'person_id')
+
+    return check_persons(
+        names,
+        names,
+        events.iterator(chunk_size=5000),
+        families,
+        child_rows.iterator(chunk_size=5000),
+    )
+
+def get_persons_warnings(person_ids):
+    """
+    Like get_tree_warnings, but only for the persons in person_ids. Only the
+    persons, their families and the events of their parents and children are
+    loaded, in five queries.
+    """
+    child_rows = list(Child.objects.filter(person_id__in=person_ids).values_list('id', 'family_id', 'person_id'))
+    families = list(Family.objects.filter(
+        Q(id__in={family_id for _, family_id, _ in child_rows}) | Q(husband_id__in=person_ids) | Q(wife_id__in=person_ids)
+    ).values_list('id', 'husband_id', 'wife_id'))
+    own_family_ids = [
+        family_id for family_id, husband_id, wife_id in families
+        if husband_id in person_ids or wife_id in person_ids
+    ]
+    child_rows += Child.objects.filter(family_id__in=own_family_ids).exclude(person_id__in=person_ids).values_list(
+        'id', 'family_id', 'person_id'
+    )
+
+    relative_ids = {person_id for _, _, person_id in child_rows}
+    relative_ids.update(chain.from_iterable((husband_id, wife_id) for _, husband_id, wife_id in families))
+    relative_ids.update(person_ids)
+    relative_ids.discard(None)
+
+    persons = Person.objects.filter(id__in=relative_ids).values_list('id', 'first_name', 'last_name')
+    names = {person_id: get_name(first_name, last_name) for person_id, first_name, last_name in persons}
+    events = Event.objects.filter(person_id__in=relative_ids).order_by('id').values_list('person_id', 'event_type', 'year')
+
+    return check_persons([person_id for person_id in person_ids if person_id in names], names, events, families, child_rows)
+
+def get_name(first_name, last_name):
+    return Person(first_name=first_name, last_name=last_name).get_name()
+
+def check_persons(person_ids, names, events, families, child_rows):
+    """
+    The warnings of the persons in person_ids, as a dict of person id ->
+    warnings for the persons that have any. names and events are rows for
+    the persons and their parents and children, families and child_rows for
+    at least the families the persons are parents or children in.
+    """
+    person_events = {}
+    for person_id, event_type, year in events:
+        person_events.setdefault(person_id, []).append((event_type, year))
+
+    parents = {}
+    own_families = {}
+    for family_id, husband_id, wife_id in families:
+        parents[family_id] = (husband_id, wife_id)
+        for parent_id in dict.fromkeys((husband_id, wife_id)):
+            if parent_id is not None:
+                own_families.setdefault(parent_id, set()).add(family_id)
+
+    parent_families = {}
+    children = {}
+    for child_row_id, family_id, person_id in child_rows:
+        # The parents are taken from the child's first family
+        if person_id not in parent_families or family_id < parent_families[person_id]:
+            parent_families[person_id] = family_id
+        children.setdefault(family_id, []).append((child_row_id, person_id))
+
+    warnings_by_person = {}
+    for person_id in person_ids:
+        parent_family_id = parent_families.get(person_id)
+        child_ids = [
+            child_id
+            for _, child_id in sorted(chain.from_iterable(children.get(f, []) for f in own_families.get(person_id, ())))
+        ]
+        warnings = get_person_warnings(
+            person_id,
+            person_events.get(person_id, []),
+            parents[parent_family_id] if parent_family_id else None,
+            child_ids,
+            lambda pk: person_events.get(pk, []),
+            lambda pk: names.get(pk, ''),
+        )
+        if warnings:
+            warnings_by_person[person_id] = warnings
+
+    return warnings_by_person
+
+def get_relatives(person_ids):
+    """The ids of the persons in person_ids and their parents, partners and children."""
+    relatives = set(person_ids)
+    parents = Child.objects.filter(person_id__in=person_ids).values_list('family__husband_id', 'family__wife_id')
+    families = Family.objects.filter(Q(husband_id__in=person_ids) | Q(wife_id__in=person_ids)).values_list(
+        'id', 'husband_id', 'wife_id'
+    )
+    family_ids = []
+    for family_id, husband_id, wife_id in families:
+        family_ids.append(family_id)
+        relatives.update((husband_id, wife_id))
+    relatives.update(chain.from_iterable(parents))
+    relatives.update(Child.objects.filter(family_id__in=family_ids).values_list('person_id', flat=True))
+    relatives.discard(None)
+    return relatives
+
+def warning_rows(warnings_by_person, tree_ids):
+    for person_id, warnings in warnings_by_person.items():
+        for position, warning in enumerate(warnings):
+            yield DataQualityWarning(
+                tree_id=tree_ids[person_id],
+                person_id=person_id,
+                code=warning['code'],
+                message=warning['message'],
+                position=position,
+            )
+
+def save_tree_warnings(tree):
+    """Replace the stored warnings of the tree with the warnings of a check of the whole tree."""
+    warnings_by_person = get_tree_warnings(tree)
+    with transaction.atomic():
+        DataQualityWarning.objects.filter(tree=tree).delete()
+        DataQualityWarning.objects.bulk_create(
+            warning_rows(warnings_by_person, defaultdict(lambda: tree.pk)),
+            batch_size=BATCH_SIZE,
+        )
+    return sum(len(warnings) for warnings in warnings_by_person.values())
+
+def update_warnings(person_ids):
+    """
+    Check the persons and their parents, partners and children again and
+    replace their stored warnings. Called with the persons that were changed
+    in a transaction when it commits.
+    """
+    person_ids = sorted(person_ids)
+    relative_ids = set()
+    for i in range(0, len(person_ids), BATCH_SIZE):
+        relative_ids |= get_relatives(person_ids[i:i + BATCH_SIZE])
+
+    relative_ids = sorted(relative_ids)
+    for i in range(0, len(relative_ids), BATCH_SIZE):
+        batch = relative_ids[i:i + BATCH_SIZE]
+        tree_ids = dict(Person.objects.filter(id__in=batch).values_list('id', 'tree_id'))
+        warnings_by_person = get_persons_warnings(set(tree_ids))
+        with transaction.atomic():
+            DataQualityWarning.objects.filter(person_id__in=batch).delete()
+            DataQualityWarning.objects.bulk_create(warning_rows(warnings_by_person, tree_ids))
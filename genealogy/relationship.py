@@ -0,0 +1,171 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .graph import NONE, get_tree_graph
+from .models import Person
+
+# How many generations up from each person a common ancestor is looked for
+MAX_DEPTH = 15
+
+ORDINALS = ['first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth']
+TIMES = ['once', 'twice', 'three times']
+
+WORDS = {
+    'parent': ('father', 'mother', 'parent'),
+    'child': ('son', 'daughter', 'child'),
+    'sibling': ('brother', 'sister', 'sibling'),
+    'uncle': ('uncle', 'aunt', 'uncle or aunt'),
+    'nephew': ('nephew', 'niece', 'nephew or niece'),
+    'partner': ('husband', 'wife', 'partner'),
+}
+
+
+def get_relationship(tree, person_id, other_id):
+    """
+    How the person is related to the other person, from find_relationship
+    with the names filled in. Results are cached until the tree changes.
+    """
+    key = f"relationship:{tree.pk}:{tree.version}:{person_id}:{other_id}"
+    relationship = cache.get(key)
+    if relationship is None:
+        relationship = find_relationship(get_tree_graph(tree, person_id, other_id), person_id, other_id)
+        names = {
+            person.id: person.get_name_years()
+            for person in Person.objects.filter(id__in=relationship['path'] + relationship['common_ancestors'])
+        }
+        for field in ('path', 'common_ancestors'):
+            relationship[field] = [{'id': pk, 'name': names.get(pk, '')} for pk in relationship[field]]
+        cache.set(key, relationship, settings.TREE_GRAPH_CACHE_TIMEOUT)
+    return relationship
+
+def find_relationship(graph, person_id, other_id, max_depth=MAX_DEPTH):
+    """
+    Find the closest common ancestors of two persons in the TreeGraph, by
+    walking up from both persons one generation at a time, always from the
+    side with the fewest persons to visit. Returns a dict with:
+
+    label: how the person is related to the other, like "second cousin once
+        removed", or None if no relationship was found
+    generations: the generations from each person up to the common ancestors
+    common_ancestors: ids of the closest common ancestors
+    path: ids from the person up to a common ancestor and down to the other
+    """
+    person = graph.position(person_id)
+    other = graph.position(other_id)
+
+    # position -> (generations up, the position it was reached from)
+    sides = ({person: (0, NONE)}, {other: (0, NONE)})
+    frontiers = ([person], [other])
+    levels = [0, 0]
+    best = 0 if person == other else None
+
+    while True:
+        # The persons found next are levels[side] + 1 generations up, which can
+        # only give a closer relationship while that is below the best so far
+        open_sides = [
+            side for side in (0, 1)
+            if frontiers[side] and levels[side] < max_depth and (best is None or levels[side] + 1 < best)
+        ]
+        if not open_sides:
+            break
+        side = min(open_sides, key=lambda s: len(frontiers[s]))
+        visited, other_visited = sides[side], sides[1 - side]
+        levels[side] += 1
+
+        frontier = []
+        for position in frontiers[side]:
+            for parent in graph.parents_at(position):
+                if parent in visited:
+                    continue
+                visited[parent] = (levels[side], position)
+                frontier.append(parent)
+                if parent in other_visited:
+                    total = levels[side] + other_visited[parent][0]
+                    if best is None or total < best:
+                        best = total
+        frontiers[side][:] = frontier
+
+    if best is None:
+        return describe_partner(graph, person, other)
+
+    candidates = [
+        (sides[0][position][0], sides[1][position][0], position)
+        for position in sides[0]
+        if position in sides[1] and sides[0][position][0] + sides[1][position][0] == best
+    ]
+    # With intermarriage the same distance can be made up in different ways,
+    # the most even one is used
+    up, down, _ = min(candidates, key=lambda c: (abs(c[0] - c[1]), c[0]))
+    ancestors = [position for a, b, position in candidates if (a, b) == (up, down)]
+
+    path = trace(sides[0], ancestors[0])[::-1] + trace(sides[1], ancestors[0])[1:]
+    # The persons just below the common ancestor on each side decide whether
+    # the relationship is half, if they aren't children of the same family
+    half = up > 0 and down > 0 and graph.parent_families[path[up - 1]] != graph.parent_families[path[up + 1]]
+
+    return {
+        'label': get_label(up, down, half, graph.sex[person]),
+        'generations': [up, down],
+        'common_ancestors': [graph.person_ids[position] for position in ancestors],
+        'path': [graph.person_ids[position] for position in path],
+    }
+
+def describe_partner(graph, person, other):
+    # Persons without a common ancestor can still be partners
+    partner = other in graph.partners_at(person)
+    return {
+        'label': word('partner', graph.sex[person]) if partner else None,
+        'generations': None,
+        'common_ancestors': [],
+        'path': [graph.person_ids[person], graph.person_ids[other]] if partner else [],
+    }
+
+def trace(visited, position):
+    """The positions from position back down to where the walk started."""
+    path = []
+    while position != NONE:
+        path.append(position)
+        position = visited[position][1]
+    return path
+
+def word(kind, sex):
+    male, female, unknown = WORDS[kind]
+    return {'M': male, 'F': female}.get(sex, unknown)
+
+def greats(count):
+    # great-, great-great-, 3x great-
+    return 'great-' * count if count <= 2 else f'{count}x great-'
+
+def ordinal(number):
+    return ORDINALS[number - 1] if number <= len(ORDINALS) else f'{number}th'
+
+def times(number):
+    return TIMES[number - 1] if number <= len(TIMES) else f'{number} times'
+
+def get_label(up, down, half, sex):
+    """
+    The relationship of a person that is up generations below a common
+    ancestor to someone down generations below it.
+    """
+    prefix = 'half-' if half else ''
+    if up == 0 and down == 0:
+        return 'same person'
+    if up == 0:
+        if down == 1:
+            return word('parent', sex)
+        return greats(down - 2) + 'grand' + word('parent', sex)
+    if down == 0:
+        if up == 1:
+            return word('child', sex)
+        return greats(up - 2) + 'grand' + word('child', sex)
+    if up == 1 and down == 1:
+        return prefix + word('sibling', sex)
+    if up == 1:
+        return prefix + greats(down - 2) + word('uncle', sex)
+    if down == 1:
+        return prefix + greats(up - 2) + word('nephew', sex)
+
+    label = f"{prefix}{ordinal(min(up, down) - 1)} cousin"
+    if up != down:
+        label += f" {times(abs(up - down))} removed"
+    return label
@@ -0,0 +1,173 @@
+from functools import reduce
+from operator import add, or_
+
+from django.db import connection, transaction
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import Person, PersonNameKey
+from .name_functions import get_name_key, get_name_words, get_phonetic_key
+
+# SQLite FTS5 table with the names and places of every person, created by
+# migration 0010 when the database supports it. The trigram tokenizer lets it
+# find any part of a word, like icontains does. The tree of each person is
+# indexed too, as "@<tree id>@" in the tree column, see tree_match.
+FTS_TABLE = 'genealogy_person_fts'
+FTS_COLUMNS = ['first_name', 'last_name', 'birth_place', 'death_place']
+# Trigrams can't match shorter text, which is looked up with icontains instead
+MIN_LENGTH = 3
+BATCH_SIZE = 500
+
+_has_index = {}
+
+
+def has_index():
+    """Whether the database has the full-text index, checked once per database."""
+    name = connection.settings_dict['NAME']
+    if name not in _has_index:
+        _has_index[name] = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _has_index[name]
+
+def quote(text):
+    # An FTS5 string, in which a double quote is written twice
+    return '"' + text.replace('"', '""') + '"'
+
+def can_match(alternatives):
+    return has_index() and all(len(text) >= MIN_LENGTH for _, text in alternatives)
+
+def match_expression(alternatives):
+    return ' OR '.join(f'{column} : {quote(text)}' for column, text in alternatives)
+
+def tree_match(tree_id):
+    # The @ signs keep tree 1 from matching tree 12
+    return f'tree : {quote(f"@{tree_id}@")}'
+
+def match_q(match, tree_id=None):
+    if tree_id is not None:
+        # The index only looks at the rows of the tree, so searching a tree
+        # takes as long as its size and not the size of the whole database
+        match = f'{tree_match(tree_id)} AND ({match})'
+    return Q(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,)))
+
+def icontains_q(alternatives):
+    return reduce(or_, (Q(**{f'{column}__icontains': text}) for column, text in alternatives))
+
+
+class PersonTextSearch:
+    """
+    Substring conditions on the names and places of persons. Each condition
+    matches if any of its (column, text) alternatives is found in the column,
+    or if the person has one of its (kind, key) name keys, or phonetic keys
+    if phonetic is given, and all conditions have to match. With the
+    full-text index the text is looked up with MATCH queries, otherwise with
+    icontains.
+    """
+    def __init__(self, tree=None):
+        self.tree = tree
+        # The tree id goes into MATCH queries, so it has to be a plain number
+        self.tree_id = None if tree is None else int(getattr(tree, 'pk', tree))
+        self.conditions = []
+
+    def add(self, alternatives, keys=(), phonetic=False):
+        self.conditions.append((list(alternatives), list(keys), 'phonetic' if phonetic else 'key'))
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    def key_q(self, keys, field):
+        name_keys = PersonNameKey.objects.filter(reduce(or_, (Q(kind=kind, **{field: key}) for kind, key in keys)))
+        if self.tree is not None:
+            name_keys = name_keys.filter(tree=self.tree)
+        return Q(id__in=name_keys.values('person_id'))
+
+    def get_q(self):
+        q = Q()
+        expressions = []
+        for alternatives, keys, field in self.conditions:
+            if keys:
+                text_q = Q()
+                if alternatives:
+                    text_q = match_q(match_expression(alternatives), self.tree_id) if can_match(alternatives) else icontains_q(alternatives)
+                q &= self.key_q(keys, field) | text_q
+            elif can_match(alternatives):
+                expressions.append(match_expression(alternatives))
+            else:
+                q &= icontains_q(alternatives)
+
+        if expressions:
+            q &= match_q(' AND '.join(f'({expression})' for expression in expressions), self.tree_id)
+        return q
+
+def get_name_rank(names):
+    """
+    An expression that ranks persons by how well their names match the
+    (kind, name) pairs of a search, lower is better. Each name adds 0 if the
+    person has it spelled the same way, 1 for another spelling of it and 2 if
+    it only matched part of a name or by sound.
+    """
+    ranks = []
+    for kind, name in names:
+        name_keys = PersonNameKey.objects.filter(person=OuterRef('pk'), kind=kind)
+        ranks.append(Case(
+            When(Exists(name_keys.filter(name=name.lower())), then=Value(0)),
+            When(Exists(name_keys.filter(key=get_name_key(name, kind))), then=Value(1)),
+            default=Value(2),
+        ))
+    return reduce(add, ranks, Value(0))
+
+def name_key_rows(rows):
+    """PersonNameKey objects for (id, tree_id, first_name, last_name) rows of persons."""
+    for person_id, tree_id, first_name, last_name in rows:
+        for kind, name in (('first', first_name), ('last', last_name)):
+            for word in get_name_words(name):
+                key = get_name_key(word, kind)
+                yield PersonNameKey(
+                    tree_id=tree_id, person_id=person_id, kind=kind, name=word, key=key, phonetic=get_phonetic_key(key)
+                )
+
+def update_index(person_ids):
+    """
+    Copy the names and places of the persons to the index and their name keys
+    to PersonNameKey, and remove the persons that were deleted.
+    """
+    person_ids = sorted(person_ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(person_ids), BATCH_SIZE):
+            batch = person_ids[i:i + BATCH_SIZE]
+            if has_index():
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", batch)
+                cursor.execute(insert_sql(f"id IN ({placeholders})"), batch)
+
+            PersonNameKey.objects.filter(person_id__in=batch).delete()
+            PersonNameKey.objects.bulk_create(name_key_rows(
+                Person.objects.filter(id__in=batch).values_list('id', 'tree_id', 'first_name', 'last_name')
+            ))
+
+def index_tree(tree):
+    """Add every person of the tree to the index and PersonNameKey, after a bulk import."""
+    with transaction.atomic():
+        if has_index():
+            with connection.cursor() as cursor:
+                cursor.execute(insert_sql("tree_id = %s", replace=True), [tree.pk])
+
+        PersonNameKey.objects.filter(tree=tree).delete()
+        PersonNameKey.objects.bulk_create(
+            name_key_rows(
+                Person.objects.filter(tree=tree).values_list('id', 'tree_id', 'first_name', 'last_name').iterator(chunk_size=5000)
+            ),
+            batch_size=1000,
+        )
+
+def remove_tree(tree):
+    """Remove the persons of the tree from the index, after they were deleted without signals."""
+    if has_index():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [tree_match(tree.pk)])
+
+def insert_sql(where, replace=False):
+    columns = ', '.join(FTS_COLUMNS)
+    return (
+        f"INSERT {'OR REPLACE ' if replace else ''}INTO {FTS_TABLE} (rowid, {columns}, tree) "
+        f"SELECT id, {columns}, '@' || tree_id || '@' FROM {Person._meta.db_table} WHERE {where}"
+    )
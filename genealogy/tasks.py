@@ -0,0 +1,74 @@
+from celery import shared_task
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import gedcom
+from .models import (
+    AncestorLink, Child, DataQualityWarning, Event, Family, FamilyEvent, ImagePerson, ImportJob, Person, PersonNameKey,
+    Tree,
+)
+from .search import remove_tree
+
+def start_import(tree):
+    """Create an ImportJob for the tree's GEDCOM file and queue it once the current transaction commits."""
+    job = ImportJob.objects.create(tree=tree)
+    transaction.on_commit(lambda: import_gedcom.delay(job.id))
+    return job
+
+def remove_imported(tree):
+    """
+    Remove the persons and families of the tree and everything that belongs to
+    them. The rows are deleted with one query per table instead of one delete
+    with signals per person, so a large failed import is removed quickly and
+    completely, and the tree version is raised once.
+    """
+    persons = f"SELECT id FROM {Person._meta.db_table} WHERE tree_id = %s"
+    families = f"SELECT id FROM {Family._meta.db_table} WHERE tree_id = %s"
+    with transaction.atomic():
+        # These have signals, which would make delete() go through the rows one by one
+        with connection.cursor() as cursor:
+            for model, where in (
+                (FamilyEvent, f"family_id IN ({families})"),
+                (Child, f"family_id IN ({families}) OR person_id IN ({persons})"),
+                (Family, "tree_id = %s"),
+                (Event, f"person_id IN ({persons})"),
+            ):
+                cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE {where}", [tree.pk] * where.count('%s'))
+
+        ImagePerson.objects.filter(person__tree=tree).delete()
+        DataQualityWarning.objects.filter(tree=tree).delete()
+        AncestorLink.objects.filter(tree=tree).delete()
+        PersonNameKey.objects.filter(tree=tree).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {Person._meta.db_table} WHERE tree_id = %s", [tree.pk])
+
+        remove_tree(tree)
+        Tree.bump_versions({tree.pk})
+
+@shared_task
+def import_gedcom(job_id):
+    try:
+        job = ImportJob.objects.select_related('tree').get(pk=job_id)
+    except ImportJob.DoesNotExist:
+        # The tree was deleted before the import started
+        return
+
+    job.status = 'running'
+    job.started = timezone.now()
+    job.save(update_fields=['status', 'started'])
+
+    try:
+        gedcom.handle_uploaded_file(job.tree, job)
+    except Exception as e:
+        # Remove whatever was added before the import failed
+        remove_imported(job.tree)
+
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished'])
+        return
+
+    job.status = 'finished'
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'finished'])
@@ -0,0 +1,408 @@
+import datetime
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from users.models import User
+
+from . import gedcom
+from .gedcom import EventList, export_tree, FamilyGC, Gedcom, GedcomEvent, GedcomLine, Ind, TreeImport, group_records, tokenize
+from .models import Child, Event, Family, FamilyEvent, Person, Tree
+
+# Family F2 comes before the persons in it, I5 is listed twice in F1 and I9
+# doesn't exist
+GEDCOM = """\
+0 HEAD
+1 SOUR Test
+2 _TREE Testträd
+1 CHAR UTF-8
+0 @F2@ FAM
+1 HUSB @I3@
+1 WIFE @I4@
+1 CHIL @I1@
+0 @I1@ INDI
+1 NAME Per /Andersson/
+2 GIVN Per
+2 SURN Andersson
+1 SEX M
+1 BIRT
+2 DATE 12 MAR 1830
+2 PLAC Södra Ny
+1 FAMC @F2@
+1 FAMS @F1@
+0 @I2@ INDI
+1 NAME Anna /Larsdotter/
+2 GIVN Anna
+2 SURN Larsdotter
+1 SEX F
+1 DEAT
+2 DATE 1901
+2 PLAC Glava
+1 _DCAUSE
+2 NOTE Ålderdom
+1 FAMS @F1@
+0 @I3@ INDI
+1 NAME Anders /Persson/
+2 GIVN Anders
+2 SURN Persson
+1 SEX M
+1 RESI
+2 DATE 1835
+2 PLAC Stavnäs
+2 NOTE Torpare
+1 FAMS @F2@
+0 @I4@ INDI
+1 NAME Maja /Olsdotter/
+2 GIVN Maja
+2 SURN Olsdotter
+1 SEX F
+1 BIRT
+1 FAMS @F2@
+0 @I5@ INDI
+1 NAME Olof /Persson/
+2 GIVN Olof
+2 SURN Persson
+1 SEX M
+1 BIRT
+2 DATE 1860
+1 BIRT
+2 DATE 1861
+1 FAMC @F1@
+0 @F1@ FAM
+1 HUSB @I1@
+1 WIFE @I2@
+1 CHIL @I5@
+1 CHIL @I5@
+1 CHIL @I9@
+1 MARR
+2 DATE 1858
+2 PLAC Södra Ny
+0 TRLR
+"""
+
+
+def parse(text):
+    gedcom_tree = Gedcom(file=None)
+    records = {record.id: record for record in gedcom_tree.parse_lines(io.StringIO(text))}
+    return gedcom_tree, records
+
+def record_values(record):
+    return [
+        [tuple(e) for e in getattr(record, slot)] if slot in ('events', 'family_events') else getattr(record, slot)
+        for slot in record.__slots__
+    ]
+
+def family_gedcom(count):
+    """A GEDCOM file with count families, each with a husband, a wife and a child."""
+    lines = ['0 HEAD\n']
+    for i in range(count):
+        for n, sex in ((1, 'M'), (2, 'F'), (3, 'M')):
+            lines += [f'0 @I{i}-{n}@ INDI\n', f'1 SEX {sex}\n', '1 BIRT\n', f'2 DATE {1800 + n}\n']
+    for i in range(count):
+        lines += [
+            f'0 @F{i}@ FAM\n', f'1 HUSB @I{i}-1@\n', f'1 WIFE @I{i}-2@\n', f'1 CHIL @I{i}-3@\n', '1 MARR\n', '2 DATE 1830\n',
+        ]
+    lines.append('0 TRLR\n')
+    return ''.join(lines)
+
+
+class GedcomParseTests(TestCase):
+    def test_tokenize(self):
+        lines = ['0 @I1@ INDI\r\n', '\n', 'not a gedcom line\n', '1 NAME Per /Andersson/  \n', '  2 GIVN Per\n', '1 BIRT\n']
+        self.assertEqual(list(tokenize(lines)), [
+            GedcomLine(0, '@I1@', 'INDI', ''),
+            GedcomLine(1, None, 'NAME', 'Per /Andersson/'),
+            GedcomLine(2, None, 'GIVN', 'Per'),
+            GedcomLine(1, None, 'BIRT', ''),
+        ])
+
+    def test_group_records(self):
+        tokens = tokenize(['1 NOTE Before the first record\n', '0 HEAD\n', '1 CHAR UTF-8\n', '0 @I1@ INDI\n', '0 TRLR\n'])
+        records = [[(line.level, line.tag) for line in record] for record in group_records(tokens)]
+        self.assertEqual(records, [[(0, 'HEAD'), (1, 'CHAR')], [(0, 'INDI')], [(0, 'TRLR')]])
+
+    def test_records(self):
+        with self.assertLogs('genealogy.gedcom', 'WARNING') as logs:
+            gedcom_tree, records = parse(GEDCOM)
+        self.assertEqual(logs.output, ['WARNING:genealogy.gedcom:Event BIRT already exists for Olof Persson'])
+        self.assertEqual(gedcom_tree.name, 'Testträd')
+        self.assertEqual(list(records), ['@F2@', '@I1@', '@I2@', '@I3@', '@I4@', '@I5@', '@F1@'])
+
+        per = records['@I1@']
+        self.assertIsInstance(per, Ind)
+        self.assertEqual((per.given_name, per.surname, per.sex, per.famc, per.fams), ('Per', 'Andersson', 'M', '@F2@', '@F1@'))
+        self.assertEqual([tuple(e) for e in per.events], [('birth', '12 MAR 1830', 'Södra Ny', '')])
+        self.assertEqual(records['@I2@'].death_cause, 'Ålderdom')
+        self.assertEqual([tuple(e) for e in records['@I3@'].events], [('residence', '1835', 'Stavnäs', 'Torpare')])
+        # An event without details isn't kept, and only the first birth is
+        self.assertEqual(len(records['@I4@'].events), 0)
+        self.assertEqual([e.date for e in records['@I5@'].events], ['1860'])
+
+        family = records['@F1@']
+        self.assertIsInstance(family, FamilyGC)
+        self.assertEqual((family.husband, family.wife), ('@I1@', '@I2@'))
+        self.assertEqual(family.children, ['@I5@', '@I5@', '@I9@'])
+        self.assertEqual([tuple(e) for e in family.family_events], [('marriage', '1858', 'Södra Ny', '')])
+
+    def test_parallel_records(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'test.ged')
+        with open(path, 'w', encoding='utf-8') as f:
+            # Without the second birth, which would be logged by the workers
+            f.write(GEDCOM.replace('1 BIRT\n2 DATE 1861\n', ''))
+
+        serial = Gedcom(file=None)
+        records = [record_values(r) for r in serial.iter_records(path)]
+        # Several chunks, which come back in file order
+        with mock.patch('genealogy.gedcom.CHUNK_RECORDS', 2):
+            parallel = Gedcom(file=None)
+            self.assertEqual([record_values(r) for r in parallel.iter_records(path, workers=2)], records)
+        self.assertEqual(len(records), 7)
+        self.assertEqual(parallel.name, 'Testträd')
+
+
+class EventListTests(TestCase):
+    def test_events(self):
+        events = EventList()
+        # Two different string objects, as when read from a file
+        events.append('birth', date='12 MAR 1830', place=' '.join(['Södra', 'Ny']))
+        events.append('marriage', date='1858', place=' '.join(['Södra', 'Ny']), description='Lysning')
+        events.append('residence')
+
+        self.assertEqual(len(events), 3)
+        self.assertTrue(events.has_type('marriage'))
+        self.assertFalse(events.has_type('death'))
+        self.assertEqual(list(events), [
+            GedcomEvent('birth', '12 MAR 1830', 'Södra Ny', ''),
+            GedcomEvent('marriage', '1858', 'Södra Ny', 'Lysning'),
+            GedcomEvent('residence', '', '', ''),
+        ])
+        # One byte per event type, and each place is only stored once
+        self.assertEqual(events.types.itemsize, 1)
+        self.assertIs(events.places[0], events.places[1])
+
+    def test_unknown_type(self):
+        with self.assertRaises(KeyError):
+            EventList().append('christening')
+
+
+class GedcomImportTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user(username='tester', password='password')
+        self.tree = Tree.objects.create(user=user, name='Test tree')
+        self.tree.gedcom_file.save('test.ged', ContentFile(GEDCOM.encode('utf-8')))
+
+    def test_import(self):
+        with self.assertLogs('genealogy.gedcom', 'WARNING'):
+            gedcom.handle_uploaded_file(self.tree)
+
+        persons = {p.indi_id: p for p in Person.objects.filter(tree=self.tree)}
+        self.assertEqual(sorted(persons), ['@I1@', '@I2@', '@I3@', '@I4@', '@I5@'])
+        per = persons['@I1@']
+        self.assertEqual((per.first_name, per.last_name, per.sex), ('Per', 'Andersson', 'M'))
+        self.assertEqual((per.birth_date, per.birth_year, per.birth_place), ('12 MAR 1830', 1830, 'Södra Ny'))
+        self.assertEqual((persons['@I2@'].death_year, persons['@I2@'].death_cause), (1901, 'Ålderdom'))
+        self.assertEqual(
+            list(Event.objects.filter(person__tree=self.tree).order_by('person__indi_id').values_list(
+                'person__indi_id', 'event_type', 'year', 'place', 'description'
+            )),
+            [
+                ('@I1@', 'birth', 1830, 'Södra Ny', ''),
+                ('@I2@', 'death', 1901, 'Glava', ''),
+                ('@I3@', 'residence', 1835, 'Stavnäs', 'Torpare'),
+                ('@I5@', 'birth', 1860, '', ''),
+            ]
+        )
+
+        families = {f.family_id: f for f in Family.objects.filter(tree=self.tree)}
+        self.assertEqual((families['@F1@'].husband, families['@F1@'].wife), (per, persons['@I2@']))
+        # Linked although the family comes before its persons in the file
+        self.assertEqual((families['@F2@'].husband, families['@F2@'].wife), (persons['@I3@'], persons['@I4@']))
+        self.assertEqual(
+            sorted(Child.objects.filter(family__tree=self.tree).values_list('family__family_id', 'person__indi_id')),
+            [('@F1@', '@I5@'), ('@F2@', '@I1@')]
+        )
+        self.assertEqual(
+            list(FamilyEvent.objects.filter(family__tree=self.tree).values_list('family__family_id', 'event_type', 'year')),
+            [('@F1@', 'marriage', 1858)]
+        )
+        self.assertEqual(Tree.objects.get(pk=self.tree.pk).version, self.tree.version + 1)
+
+
+class TreeImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='tester', password='password')
+
+    def import_records(self, tree, text):
+        tree_import = TreeImport(tree)
+        for record in parse(text)[1].values():
+            tree_import.add(record)
+        tree_import.finish()
+        return tree_import
+
+    def test_ids(self):
+        with self.assertLogs('genealogy.gedcom', 'WARNING') as logs:
+            tree = Tree.objects.create(user=self.user, name='Test tree')
+            tree_import = self.import_records(tree, GEDCOM)
+        self.assertIn('WARNING:genealogy.gedcom:Child @I9@ in family @F1@ does not exist', logs.output)
+
+        self.assertEqual(tree_import.person_ids, dict(Person.objects.filter(tree=tree).values_list('indi_id', 'id')))
+        self.assertEqual(tree_import.family_ids, dict(Family.objects.filter(tree=tree).values_list('family_id', 'id')))
+        self.assertEqual(len(tree_import.person_ids), 5)
+        self.assertEqual(len(tree_import.family_ids), 2)
+
+    def test_no_queries_per_row(self):
+        # One insert per table and batch, within a savepoint, however many
+        # families there are. SQLite splits an insert of more than 999
+        # values, so the files are kept small.
+        for count in (5, 20):
+            tree = Tree.objects.create(user=self.user, name=f'{count} families')
+            with self.assertNumQueries(15):
+                self.import_records(tree, family_gedcom(count))
+            self.assertEqual(Person.objects.filter(tree=tree).count(), count * 3)
+            self.assertEqual(Event.objects.filter(person__tree=tree).count(), count * 3)
+            self.assertEqual(Child.objects.filter(family__tree=tree, person__indi_id__endswith='-3@').count(), count)
+            self.assertEqual(FamilyEvent.objects.filter(family__tree=tree).count(), count)
+
+
+def run_on_commit(func, using=None, robust=False):
+    # Like on_commit outside a transaction, which is how the upload view runs
+    func()
+
+
+class TreeUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='tester', password='password'))
+
+    def upload(self, content):
+        with mock.patch.object(transaction, 'on_commit', run_on_commit):
+            return self.client.post(
+                reverse('api:tree-list'),
+                {'name': 'Test tree', 'gedcom_file': SimpleUploadedFile('test.ged', content)},
+                format='multipart',
+            )
+
+    def import_status(self, tree_id):
+        return self.client.get(reverse('api:tree-import-status', args=[tree_id]))
+
+    def test_import_finished(self):
+        with self.assertLogs('genealogy.gedcom', 'WARNING'):
+            response = self.upload(GEDCOM.encode('utf-8'))
+        self.assertEqual(response.status_code, 202)
+        # The import ran before the response, as Celery does without a broker
+        job = response.data['import_job']
+        self.assertEqual(job['status'], 'finished')
+        self.assertEqual(
+            [job[field] for field in ('persons', 'events', 'families', 'family_events', 'children')],
+            [5, 4, 2, 1, 2]
+        )
+
+        status = self.import_status(response.data['id'])
+        self.assertEqual(status.status_code, 200)
+        self.assertEqual(status.data, job)
+
+    def test_import_failed(self):
+        response = self.upload(GEDCOM.encode('utf-8') + b'0 @I6@ INDI\n1 NAME \xff\n')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['import_job']['status'], 'failed')
+        self.assertIn('utf-8', response.data['import_job']['error'])
+        self.assertFalse(Person.objects.filter(tree_id=response.data['id']).exists())
+        self.assertEqual(self.import_status(response.data['id']).data['status'], 'failed')
+
+    def test_no_import(self):
+        response = self.client.post(reverse('api:tree-list'), {'name': 'Test tree'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.import_status(response.data['id']).status_code, 404)
+
+
+class GedcomExportTests(TestCase):
+    def setUp(self):
+        self.tree = Tree.objects.create(user=User.objects.create_user(username='tester', password='password'), name='Testträd')
+        tree_import = TreeImport(self.tree)
+        with self.assertLogs('genealogy.gedcom', 'WARNING'):
+            for record in parse(GEDCOM)[1].values():
+                tree_import.add(record)
+            tree_import.finish()
+        self.person_ids = tree_import.person_ids
+        self.family_ids = tree_import.family_ids
+
+    def export(self):
+        with mock.patch('genealogy.gedcom.datetime') as mock_datetime:
+            mock_datetime.datetime.now.return_value = datetime.datetime(2026, 5, 1, 12, 30)
+            return ''.join(export_tree(self.tree))
+
+    def test_xrefs(self):
+        text = self.export()
+        per, anna, olof = (self.person_ids[xref] for xref in ('@I1@', '@I2@', '@I5@'))
+        parents, family = self.family_ids['@F2@'], self.family_ids['@F1@']
+
+        self.assertTrue(text.startswith('0 HEAD\n'))
+        self.assertIn('2 _TREE Testträd\n1 DATE 01 May 2026\n2 TIME 12:30:00\n', text)
+        self.assertIn(
+            f'0 @I{per}@ INDI\n1 NAME Per /Andersson/\n2 GIVN Per\n2 SURN Andersson\n1 SEX M\n'
+            f'1 FAMC @F{parents}@\n1 FAMS @F{family}@\n1 BIRT\n2 DATE 12 MAR 1830\n2 PLAC Södra Ny\n',
+            text
+        )
+        self.assertIn(
+            f'0 @F{family}@ FAM\n1 HUSB @I{per}@\n1 WIFE @I{anna}@\n1 CHIL @I{olof}@\n'
+            f'1 MARR\n2 DATE 1858\n2 PLAC Södra Ny\n',
+            text
+        )
+        self.assertTrue(text.endswith('0 TRLR\n'))
+
+    def test_round_trip(self):
+        # The same records come back, with the new ids
+        xrefs = {f'@I{pk}@': xref for xref, pk in self.person_ids.items()}
+        xrefs.update({f'@F{pk}@': xref for xref, pk in self.family_ids.items()})
+        gedcom_tree, records = parse(self.export())
+        with self.assertLogs('genealogy.gedcom', 'WARNING'):
+            _, original = parse(GEDCOM)
+
+        self.assertEqual(gedcom_tree.name, 'Testträd')
+        self.assertEqual(sorted(xrefs[xref] for xref in records), sorted(original))
+        for xref, record in records.items():
+            expected = original[xrefs[xref]]
+            if isinstance(record, Ind):
+                self.assertEqual(
+                    (record.given_name, record.surname, record.sex, xrefs.get(record.famc, ''), xrefs.get(record.fams, '')),
+                    (expected.given_name, expected.surname, expected.sex, expected.famc, expected.fams),
+                )
+                self.assertEqual(list(record.events), list(expected.events))
+            else:
+                self.assertEqual(
+                    (xrefs[record.husband], xrefs[record.wife], [xrefs[c] for c in record.children]),
+                    # Without the repeated and the missing child
+                    (expected.husband, expected.wife, list(dict.fromkeys(expected.children))[:1]),
+                )
+                self.assertEqual(list(record.family_events), list(expected.family_events))
+
+    def test_only_reads(self):
+        version = Tree.objects.get(pk=self.tree.pk).version
+        with CaptureQueriesContext(connection) as queries:
+            self.export()
+        self.assertTrue(queries.captured_queries)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries.captured_queries))
+        self.assertEqual(Tree.objects.get(pk=self.tree.pk).version, version)
@@ -1,3 +1,809 @@
-from django.test import TestCase
+import gzip
+import os
+import tempfile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from users.models import User
+
+from .models import (
+    AncestorLink, Child, DataQualityWarning, Event, Family, FamilyEvent, Person, PersonNameKey, Tree, collect_on_commit,
+)
+from .closure import rebuild_tree_links
+from .graph import TreeGraph, get_tree_graph
+from .name_functions import get_phonetic_key, get_phonetic_keys
+from .quality import get_persons_warnings, get_tree_warnings
+from .relationship import find_relationship, get_label
+from . import search
+from .search import PersonTextSearch
+from .tasks import remove_imported
+from .typeahead import get_typeahead_index
+
+
+class PersonDetailsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='tester', password='password')
+        tree = Tree.objects.create(user=user, name='Test tree')
+
+        def add_person(first_name, sex, birth_year=None, death_year=None):
+            person = Person.objects.create(tree=tree, first_name=first_name, last_name='Andersson', sex=sex)
+            if birth_year:
+                Event.objects.create(person=person, event_type='birth', date=str(birth_year), place='Glava')
+            if death_year:
+                Event.objects.create(person=person, event_type='death', date=str(death_year), place='Glava')
+            return person
+
+        father = add_person('Anders', 'M', 1800, 1870)
+        mother = add_person('Maria', 'F', 1805, 1850)
+        cls.person = add_person('Per', 'M', 1830, 1900)
+        Event.objects.create(person=cls.person, event_type='residence', date='1860', place='Arvika')
+
+        parents = Family.objects.create(tree=tree, husband=father, wife=mother)
+        Child.objects.create(family=parents, person=cls.person)
+        for i in range(12):
+            Child.objects.create(family=parents, person=add_person(f'Sibling {i}', 'F', 1825 + i, 1890 + i))
+
+        second_wife = add_person('Kerstin', 'F', 1815, 1880)
+        second_family = Family.objects.create(tree=tree, husband=father, wife=second_wife)
+        for i in range(3):
+            Child.objects.create(family=second_family, person=add_person(f'Half sibling {i}', 'M', 1852 + i))
+
+        wife = add_person('Brita', 'F', 1832, 1880)
+        family = Family.objects.create(tree=tree, husband=cls.person, wife=wife)
+        FamilyEvent.objects.create(family=family, event_type='marriage', date='1855', place='Glava')
+        for i in range(10):
+            Child.objects.create(family=family, person=add_person(f'Child {i}', 'M' if i % 2 else 'F', 1856 + i, 1850 + i * 10))
+
+    def test_details_query_count(self):
+        person = Person.objects.get(pk=self.person.pk)
+        with self.assertNumQueries(7):
+            data = person.get_details_data()
+
+        self.assertEqual(data['father']['full_name'], 'Anders Andersson (1800 - 1870)')
+        self.assertEqual(len(data['siblings']), 12)
+        self.assertEqual(len(data['half_siblings']), 3)
+        self.assertEqual(len(data['families'][0]['children']), 10)
+        self.assertEqual(data['events'][0]['event_type_full'], 'Birth')
+        self.assertEqual(data['events'][-1]['event_type_full'], 'Death')
+
+    def test_siblings_sorted_by_birth_year(self):
+        data = self.person.get_details_data()
+        names = [s['full_name'] for s in data['siblings']]
+        self.assertEqual(names[0], 'Sibling 0 Andersson (1825 - 1890)')
+        self.assertEqual(names[-1], 'Sibling 11 Andersson (1836 - 1901)')
+
+
+class PersonVitalsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='tester', password='password')
+        tree = Tree.objects.create(user=user, name='Test tree')
+        self.person = Person.objects.create(tree=tree, first_name='Per', last_name='Andersson', sex='M')
+
+    def test_vitals_follow_event_type(self):
+        event = Event.objects.create(person=self.person, event_type='birth', date='12 MAR 1830', place='Glava')
+        self.person.refresh_from_db()
+        self.assertEqual((self.person.birth_year, self.person.birth_place), (1830, 'Glava'))
+
+        event = Event.objects.get(pk=event.pk)
+        event.event_type = 'baptism'
+        event.save()
+        self.person.refresh_from_db()
+        self.assertEqual((self.person.birth_year, self.person.birth_place), (None, ''))
+
+    def test_other_events_leave_vitals_alone(self):
+        residence = Event(person=self.person, event_type='residence', date='1860', place='Arvika')
+        birth = Event(person=self.person, event_type='birth', date='1830', place='Glava')
+        with CaptureQueriesContext(connection) as residence_queries:
+            residence.save()
+        with CaptureQueriesContext(connection) as birth_queries:
+            birth.save()
+        # The birth also reads the events and updates the person
+        self.assertEqual(len(birth_queries), len(residence_queries) + 2)
+
+
+class CollectOnCommitTests(TestCase):
+    def test_one_call_per_transaction(self):
+        calls = []
+
+        def callback(values):
+            calls.append(values)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for value in (1, 2, 2, 3):
+                collect_on_commit(callback, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            collect_on_commit(callback, 4)
+        self.assertEqual(calls, [{1, 2, 3}, {4}])
+
+    def test_rolled_back_values_dropped(self):
+        calls = []
+
+        def callback(values):
+            calls.append(values)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError):
+                with transaction.atomic():
+                    collect_on_commit(callback, 1)
+                    raise DatabaseError
+            collect_on_commit(callback, 2)
+            collect_on_commit(callback, 3)
+        self.assertEqual(calls, [{2, 3}])
+
+
+class DataQualityWarningTests(TestCase):
+    def setUp(self):
+        # The warnings are updated when the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(username='tester', password='password')
+            tree = Tree.objects.create(user=user, name='Test tree')
+            self.father = Person.objects.create(tree=tree, first_name='Anders', last_name='Andersson', sex='M')
+            self.child = Person.objects.create(tree=tree, first_name='Per', last_name='Andersson', sex='M')
+            Event.objects.create(person=self.child, event_type='birth', date='1830')
+            family = Family.objects.create(tree=tree, husband=self.father)
+            Child.objects.create(family=family, person=self.child)
+
+    def get_codes(self, person):
+        return list(person.quality_warnings.values_list('code', flat=True))
+
+    def test_parent_and_child_updated_after_event_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            death = Event.objects.create(person=self.father, event_type='death', date='1820')
+        self.assertEqual(self.get_codes(self.child), ['father_died_before_child_birth'])
+        self.assertEqual(self.get_codes(self.father), ['child_born_after_parent_death'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            death.delete()
+        self.assertEqual(self.get_codes(self.child), [])
+        self.assertEqual(self.get_codes(self.father), [])
+
+
+class TreeWarningsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='tester', password='password')
+        cls.tree = tree = Tree.objects.create(user=user, name='Test tree')
+
+        def add_person(first_name, *events):
+            person = Person.objects.create(tree=tree, first_name=first_name, last_name='Andersson')
+            for event_type, year in events:
+                Event.objects.create(person=person, event_type=event_type, date=str(year))
+            return person
+
+        def add_family(husband, wife, *children):
+            family = Family.objects.create(tree=tree, husband=husband, wife=wife)
+            for child in children:
+                Child.objects.create(family=family, person=child)
+
+        add_person('Two births', ('birth', 1800), ('birth', 1801))
+        add_person('Two deaths', ('death', 1850), ('death', 1851))
+        add_person('Born after death', ('birth', 1900), ('death', 1850))
+        add_person('Events outside life', ('birth', 1800), ('death', 1850), ('residence', 1790), ('residence', 1860))
+        own_parent = add_person('Own parent', ('birth', 1800))
+        add_family(own_parent, add_person('Wife', ('birth', 1802)), own_parent)
+
+        # The parents are born after or died before the children, so the
+        # children are also born before or after them
+        child = add_person('Child', ('birth', 1855))
+        add_family(add_person('Young father', ('birth', 1860)), add_person('Dead mother', ('birth', 1820), ('death', 1850)), child)
+        other_child = add_person('Other child', ('birth', 1850))
+        add_family(add_person('Dead father', ('death', 1800)), add_person('Young mother', ('birth', 1900)), other_child)
+        # Only the first family of a child gives its parents
+        add_family(add_person('Second father', ('birth', 1700)), None, child)
+
+    def test_same_as_person_warnings(self):
+        tree_warnings = get_tree_warnings(self.tree)
+        person_ids = list(Person.objects.filter(tree=self.tree).values_list('id', flat=True))
+        self.assertEqual(get_persons_warnings(person_ids), tree_warnings)
+        for person in Person.objects.filter(tree=self.tree):
+            self.assertEqual(tree_warnings.get(person.id, []), person.get_data_quality_warnings(), person.first_name)
+
+        codes = {warning['code'] for warnings in tree_warnings.values() for warning in warnings}
+        self.assertEqual(codes, {
+            'multiple_birth_events', 'multiple_death_events', 'birth_after_death', 'event_before_birth',
+            'event_after_death', 'self_as_parent', 'father_born_after_child', 'mother_born_after_child',
+            'father_died_before_child_birth', 'mother_died_before_child_birth', 'child_born_before_parent',
+            'child_born_after_parent_death',
+        })
+
+    def test_query_count(self):
+        with self.assertNumQueries(4):
+            get_tree_warnings(self.tree)
+
+class RemoveImportedTests(TestCase):
+    def test_removes_tree_rows_only(self):
+        user = User.objects.create_user(username='tester', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            tree = Tree.objects.create(user=user, name='Failed import')
+            other = Tree.objects.create(user=user, name='Other tree')
+            for t in (tree, other):
+                father = Person.objects.create(tree=t, first_name='Anders', last_name='Andersson', sex='M')
+                child = Person.objects.create(tree=t, first_name='Per', last_name='Andersson', sex='M')
+                Event.objects.create(person=child, event_type='birth', date='1830')
+                Event.objects.create(person=father, event_type='death', date='1820')
+                family = Family.objects.create(tree=t, husband=father)
+                FamilyEvent.objects.create(family=family, event_type='marriage', date='1825')
+                Child.objects.create(family=family, person=child)
+        version = Tree.objects.get(pk=tree.pk).version
+
+        with self.assertNumQueries(13):
+            remove_imported(tree)
+
+        self.assertFalse(Person.objects.filter(tree=tree).exists())
+        self.assertFalse(Family.objects.filter(tree=tree).exists())
+        self.assertFalse(DataQualityWarning.objects.filter(tree=tree).exists())
+        self.assertFalse(PersonNameKey.objects.filter(tree=tree).exists())
+        if search.has_index():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT rowid FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH %s", [search.tree_match(tree.pk)])
+                self.assertEqual(cursor.fetchall(), [])
+        self.assertEqual(Tree.objects.get(pk=tree.pk).version, version + 1)
+        self.assertEqual(Person.objects.filter(tree=other).count(), 2)
+        self.assertEqual(Child.objects.filter(family__tree=other).count(), 1)
+        self.assertTrue(DataQualityWarning.objects.filter(tree=other).exists())
+
+
+class ExportCacheTests(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings_override = override_settings(GEDCOM_EXPORT_CACHE_DIR=self.cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tree = Tree.objects.create(user=self.user, name='Test tree')
+            self.person = Person.objects.create(tree=self.tree, first_name='Per', last_name='Andersson', sex='M')
+
+    def download(self, tree, query=None, **headers):
+        response = self.client.get(reverse('genealogy:download_tree', args=[tree.pk]), query, headers=headers)
+        if response.status_code == 200:
+            response.content_bytes = b''.join(response.streaming_content)
+        return response
+
+    def test_etag_and_new_version(self):
+        first = self.download(self.tree)
+        self.assertIn(b'Per /Andersson/', first.content_bytes)
+        self.assertEqual(os.listdir(self.cache_dir.name), [first['ETag'].strip('"')])
+
+        cached = self.download(self.tree)
+        self.assertEqual(cached.content_bytes, first.content_bytes)
+        self.assertEqual(cached['ETag'], first['ETag'])
+        self.assertEqual(self.download(self.tree, if_none_match=first['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.person.first_name = 'Pehr'
+            self.person.save()
+        changed = self.download(self.tree, if_none_match=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertIn(b'Pehr /Andersson/', changed.content_bytes)
+        # The file of the old version is removed
+        self.assertEqual(os.listdir(self.cache_dir.name), [changed['ETag'].strip('"')])
+
+    def test_gzip(self):
+        plain = self.download(self.tree)
+        compressed = self.download(self.tree, {'gzip': '1'})
+        self.assertEqual(compressed['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(compressed.content_bytes), plain.content_bytes)
+
+        # Served from the cache the second time
+        cached = self.download(self.tree, {'gzip': '1'})
+        self.assertEqual(cached.content_bytes, compressed.content_bytes)
+        self.assertEqual(sorted(os.listdir(self.cache_dir.name)), sorted([plain['ETag'].strip('"'), cached['ETag'].strip('"')]))
+
+    def test_new_version_evicts_files(self):
+        self.download(self.tree)
+        self.download(self.tree, {'gzip': '1'})
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 2)
+
+        Tree.bump_versions([self.tree.pk])
+        self.tree.refresh_from_db()
+        changed = self.download(self.tree)
+        self.assertEqual(os.listdir(self.cache_dir.name), [changed['ETag'].strip('"')])
+
+    def test_least_recently_used_evicted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Tree.objects.create(user=self.user, name='Other tree')
+            Person.objects.create(tree=other, first_name='Anna', last_name='Larsdotter', sex='F')
+        first = self.download(self.tree)
+        with override_settings(GEDCOM_EXPORT_CACHE_SIZE=len(first.content_bytes) + 10):
+            second = self.download(other)
+        self.assertEqual(os.listdir(self.cache_dir.name), [second['ETag'].strip('"')])
+
+
+class RelationshipTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='tester', password='password')
+        cls.tree = Tree.objects.create(user=user, name='Test tree')
+
+    def add_person(self, first_name, sex='M'):
+        return Person.objects.create(tree=self.tree, first_name=first_name, last_name='Andersson', sex=sex)
+
+    def add_family(self, husband, wife, *children):
+        family = Family.objects.create(tree=self.tree, husband=husband, wife=wife)
+        for child in children:
+            Child.objects.create(family=family, person=child)
+
+    def get_label(self, person, other):
+        return find_relationship(TreeGraph.build(self.tree), person.id, other.id)['label']
+
+    def test_labels(self):
+        grandfather, grandmother, second_wife = self.add_person('Anders'), self.add_person('Maria', 'F'), self.add_person('Kerstin', 'F')
+        per, brita, erik = self.add_person('Per'), self.add_person('Brita', 'F'), self.add_person('Erik')
+        self.add_family(grandfather, grandmother, per, brita)
+        self.add_family(grandfather, second_wife, erik)
+        per_wife, brita_husband = self.add_person('Anna', 'F'), self.add_person('Lars')
+        per_son, brita_daughter = self.add_person('Nils'), self.add_person('Karin', 'F')
+        self.add_family(per, per_wife, per_son)
+        self.add_family(brita_husband, brita, brita_daughter)
+        per_grandson, brita_grandson = self.add_person('Olof'), self.add_person('Johan')
+        self.add_family(per_son, None, per_grandson)
+        self.add_family(None, brita_daughter, brita_grandson)
+        brita_great_granddaughter = self.add_person('Stina', 'F')
+        self.add_family(brita_grandson, None, brita_great_granddaughter)
+
+        self.assertEqual(self.get_label(per, per), 'same person')
+        self.assertEqual(self.get_label(per, brita), 'brother')
+        self.assertEqual(self.get_label(per, erik), 'half-brother')
+        self.assertEqual(self.get_label(per_son, brita_daughter), 'first cousin')
+        self.assertEqual(self.get_label(per_son, erik), 'half-nephew')
+        self.assertEqual(self.get_label(per_grandson, brita_great_granddaughter), 'second cousin once removed')
+        self.assertEqual(self.get_label(brita_great_granddaughter, per_grandson), 'second cousin once removed')
+        self.assertEqual(self.get_label(per, brita_daughter), 'uncle')
+        self.assertEqual(self.get_label(brita_daughter, per), 'niece')
+        self.assertEqual(self.get_label(grandfather, per_grandson), 'great-grandfather')
+        self.assertEqual(self.get_label(brita_great_granddaughter, grandmother), 'great-great-granddaughter')
+        # Partners without a common ancestor
+        self.assertEqual(self.get_label(per, per_wife), 'husband')
+        self.assertEqual(self.get_label(per_wife, per), 'wife')
+        self.assertIsNone(self.get_label(per_wife, brita_husband))
+
+    def test_get_label(self):
+        self.assertEqual(get_label(0, 5, False, 'U'), '3x great-grandparent')
+        self.assertEqual(get_label(4, 1, True, 'F'), 'half-great-great-niece')
+        self.assertEqual(get_label(1, 3, False, 'M'), 'great-uncle')
+        self.assertEqual(get_label(3, 3, False, 'M'), 'second cousin')
+        self.assertEqual(get_label(2, 5, False, 'F'), 'first cousin three times removed')
+        self.assertEqual(get_label(13, 13, False, 'F'), '12th cousin')
+
+    def test_most_even_common_ancestor(self):
+        # The father is also the other person's great-grandfather, and the
+        # mother's father is the other person's grandfather. Both are four
+        # steps, and the cousin relationship is the more even one.
+        father, mother, person = self.add_person('Per'), self.add_person('Anna', 'F'), self.add_person('Nils')
+        self.add_family(father, mother, person)
+        grandfather, uncle = self.add_person('Anders'), self.add_person('Erik')
+        self.add_family(grandfather, None, mother, uncle)
+        half_brother, niece = self.add_person('Olof'), self.add_person('Kajsa', 'F')
+        self.add_family(father, None, half_brother)
+        self.add_family(half_brother, None, niece)
+        other = self.add_person('Lars')
+        self.add_family(uncle, niece, other)
+
+        relationship = find_relationship(TreeGraph.build(self.tree), person.id, other.id)
+        self.assertEqual(relationship['label'], 'first cousin')
+        self.assertEqual(relationship['generations'], [2, 2])
+        self.assertEqual(relationship['common_ancestors'], [grandfather.id])
+        self.assertEqual(relationship['path'], [person.id, mother.id, grandfather.id, uncle.id, other.id])
+
+
+@override_settings(ANCESTOR_CLOSURE=True)
+class AncestorLinkTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='tester', password='password')
+        self.tree = Tree.objects.create(user=user, name='Test tree')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.grandfather, self.father, self.mother, self.person, self.son = (
+                Person.objects.create(tree=self.tree, first_name=name, last_name='Andersson') for name in
+                ('Anders', 'Per', 'Anna', 'Nils', 'Olof')
+            )
+            Child.objects.create(family=Family.objects.create(tree=self.tree, husband=self.grandfather), person=self.father)
+            self.family = Family.objects.create(tree=self.tree, husband=self.father, wife=self.mother)
+            Child.objects.create(family=self.family, person=self.person)
+
+    def get_links(self):
+        return set(AncestorLink.objects.filter(tree=self.tree).values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def assertLinksRebuilt(self):
+        # The links kept up to date after each change are the same as the ones built from scratch
+        links = self.get_links()
+        rebuild_tree_links(self.tree)
+        self.assertEqual(links, self.get_links())
+
+    def test_links_follow_changes(self):
+        self.assertEqual(self.get_links(), {
+            (self.grandfather.id, self.father.id, 1),
+            (self.father.id, self.person.id, 1),
+            (self.mother.id, self.person.id, 1),
+            (self.grandfather.id, self.person.id, 2),
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            child = Child.objects.create(family=Family.objects.create(tree=self.tree, husband=self.person), person=self.son)
+        self.assertIn((self.grandfather.id, self.son.id, 3), self.get_links())
+        self.assertLinksRebuilt()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.family.husband = None
+            self.family.save()
+        self.assertNotIn((self.grandfather.id, self.son.id, 3), self.get_links())
+        self.assertIn((self.mother.id, self.son.id, 2), self.get_links())
+        self.assertLinksRebuilt()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            child.delete()
+        self.assertFalse(AncestorLink.objects.filter(descendant=self.son).exists())
+        self.assertLinksRebuilt()
+
+    def test_deleted_parent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.father.delete()
+        self.assertEqual(self.get_links(), {(self.mother.id, self.person.id, 1)})
+        self.assertLinksRebuilt()
+
+
+class PersonTextSearchTests(TestCase):
+    def test_search_in_one_tree(self):
+        user = User.objects.create_user(username='tester', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            trees = [Tree.objects.create(user=user, name=name) for name in ('First tree', 'Second tree')]
+            persons = [Person.objects.create(tree=tree, first_name='Pehr', last_name='Andersson', birth_place='Glava') for tree in trees]
+
+        for tree, person in zip(trees, persons):
+            # Text, and name keys for names with other spellings
+            search = PersonTextSearch(tree)
+            search.add([('last_name', 'anders'), ('birth_place', 'anders')])
+            search.add([('birth_place', 'lav')])
+            search.add([], [('first', 'per')])
+            self.assertEqual(list(Person.objects.filter(search.get_q())), [person])
+
+        search = PersonTextSearch(str(trees[1].pk))
+        search.add([('birth_place', 'Glava')])
+        self.assertEqual(list(Person.objects.filter(search.get_q())), [persons[1]])
+
+
+class PhoneticKeyTests(TestCase):
+    def test_spellings_that_sound_the_same(self):
+        for names in (
+            ('Carl', 'Karl'), ('Sophia', 'Sofia'), ('Kerstin', 'Kjerstin', 'Tjerstin'), ('Hjalmar', 'Jalmar'),
+            ('Brita', 'Britta'), ('Göran', 'Jöran'), ('Christina', 'Kristina'), ('Cecilia', 'Sesilia'),
+            ('Halvard', 'Halvar'), ('Åke', 'Oke'), ('Andersson', 'Anderson'),
+        ):
+            self.assertEqual(len({get_phonetic_key(name) for name in names}), 1, names)
+
+    def test_keys(self):
+        self.assertEqual(get_phonetic_key('Andersson'), 'andrsn')
+        self.assertNotEqual(get_phonetic_key('Per'), get_phonetic_key('Pål'))
+        self.assertEqual(get_phonetic_key('-'), '')
+        # Every name, through its name key
+        self.assertEqual(get_phonetic_keys('Per-Olof Pehr', 'first'), ['pr', 'olv'])
+        self.assertEqual(get_phonetic_keys('Ersson', 'last'), get_phonetic_keys('Eriksson', 'last'))
+
+    def test_rough_keys_ranked_last(self):
+        # Only the consonants are kept, so Svea sounds like Sophia. The search
+        # ranks the same spelling first, then the other spellings of the name.
+        self.assertEqual(get_phonetic_key('Svea'), get_phonetic_key('Sophia'))
+
+        user = User.objects.create_user(username='tester', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            tree = Tree.objects.create(user=user, name='Test tree')
+            for first_name in ('Svea', 'Sofia', 'Sophia', 'Anna'):
+                Person.objects.create(tree=tree, first_name=first_name, last_name='Andersson')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse('api:person-search'), {'tree': tree.pk, 'first_name': 'Sophia', 'phonetic': '1'})
+        self.assertEqual([person['first_name'] for person in response.data['results']], ['Sophia', 'Sofia', 'Svea'])
+
+
+class PublicPersonSearchTests(TestCase):
+    def test_only_persons_known_not_to_be_living(self):
+        user = User.objects.create_user(username='tester', password='password')
+        other = User.objects.create_user(username='other', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            tree = Tree.objects.create(user=user, name='Public tree')
+            private_tree = Tree.objects.create(user=user, name='Private tree', private=True)
+            old = Person.objects.create(tree=tree, first_name='Zorobabel', last_name='Qvist', birth_year=1800)
+            dead = Person.objects.create(tree=tree, first_name='Zorobabel', last_name='Qvist', birth_year=1990, death_year=2020)
+            buried = Person.objects.create(tree=tree, first_name='Zorobabel', last_name='Qvist', death_place='Södra Ny')
+            Person.objects.create(tree=tree, first_name='Zorobabel', last_name='Qvist', birth_year=1990)
+            Person.objects.create(tree=tree, first_name='Zorobabel', last_name='Qvist')
+            Person.objects.create(tree=tree, first_name='Zorobabel', last_name='Qvist', birth_year=1800, alive=True)
+            Person.objects.create(tree=private_tree, first_name='Zorobabel', last_name='Qvist', birth_year=1800)
+
+        client = APIClient()
+        client.force_authenticate(other)
+        response = client.get(reverse('api:public-person-search'), {'first_name': 'Zorobabel'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(person['id'] for person in response.data['results']), [old.pk, dead.pk, buried.pk])
+
+    def test_years_are_checked(self):
+        user = User.objects.create_user(username='tester', password='password')
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse('api:public-person-search')
+        for param in ('birth_year_from', 'birth_year_to', 'death_year_from', 'death_year_to'):
+            response = client.get(url, {'first_name': 'Zorobabel', param: 'abc'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(param, response.data)
+        response = client.get(url, {'first_name': 'Zorobabel', 'birth_year_from': '1800', 'death_year_to': '1900'})
+        self.assertEqual(response.status_code, 200)
+
+
+class PersonListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='password')
+        cls.tree = Tree.objects.create(user=cls.user, name='Test tree')
+        last_names = ['Olsson', 'Andersson', 'Persson']
+        first_names = ['Per', 'Anna', 'Maja', 'Per']
+        Person.objects.bulk_create(
+            Person(tree=cls.tree, first_name=first_names[i % 4], last_name=last_names[i % 3], birth_year=1800 + i % 50)
+            for i in range(1001)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url=None, **params):
+        return self.client.get(url or reverse('api:tree-persons-list', kwargs={'tree_pk': self.tree.pk}), params)
+
+    def test_cursor_order(self):
+        names = []
+        response = self.get(page_size=300)
+        while True:
+            names += [(p['last_name'], p['first_name'], p['id']) for p in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.get(response.data['next'])
+        self.assertEqual(len(names), 1001)
+        self.assertEqual(names, sorted(names))
+
+    def test_page_size(self):
+        self.assertEqual(len(self.get().data['results']), 100)
+        self.assertEqual(len(self.get(page_size=10).data['results']), 10)
+        self.assertEqual(len(self.get(page_size=5000).data['results']), 1000)
+
+    def test_fields(self):
+        person = self.get(page_size=1).data['results'][0]
+        self.assertNotIn('details', person)
+        self.assertEqual(person['birth_year'], Person.objects.get(pk=person['id']).birth_year)
+
+        person = self.get(page_size=1, fields='details').data['results'][0]
+        self.assertEqual(person['details']['events'], [])
+        self.assertIn('father', person['details'])
+
+
+class TreeGraphTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tester', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tree = Tree.objects.create(user=user, name='Test tree')
+            self.father = Person.objects.create(tree=self.tree, first_name='Anders', sex='M', birth_year=1800)
+            self.mother = Person.objects.create(tree=self.tree, first_name='Maria', sex='F')
+            self.second_wife = Person.objects.create(tree=self.tree, first_name='Kerstin', sex='F')
+            self.child = Person.objects.create(tree=self.tree, first_name='Per', sex='M', birth_year=1830, death_year=1900)
+            self.half_sibling = Person.objects.create(tree=self.tree, first_name='Olof', sex='M')
+            self.family = Family.objects.create(tree=self.tree, husband=self.father, wife=self.mother)
+            self.second_family = Family.objects.create(tree=self.tree, husband=self.father, wife=self.second_wife)
+            Child.objects.create(family=self.family, person=self.child)
+            Child.objects.create(family=self.second_family, person=self.half_sibling)
+            # Only the first family by id gives the parents
+            Child.objects.create(family=self.second_family, person=self.child)
+        self.tree.refresh_from_db()
+
+    def test_build(self):
+        with self.assertNumQueries(3):
+            graph = TreeGraph.build(self.tree)
+
+        self.assertEqual(len(graph), 5)
+        self.assertEqual((graph.get_father(self.child.id), graph.get_mother(self.child.id)), (self.father.id, self.mother.id))
+        self.assertEqual(graph.get_parents(self.half_sibling.id), [self.father.id, self.second_wife.id])
+        self.assertEqual(graph.get_partners(self.father.id), [self.mother.id, self.second_wife.id])
+        self.assertEqual(graph.get_children(self.father.id), [self.child.id, self.half_sibling.id])
+        self.assertEqual(graph.get_families(self.mother.id), [(self.family.id, self.father.id, [self.child.id])])
+        self.assertEqual(
+            (graph.get_sex(self.child.id), graph.get_birth_year(self.child.id), graph.get_death_year(self.child.id)),
+            ('M', 1830, 1900)
+        )
+        self.assertIsNone(graph.get_birth_year(self.mother.id))
+        self.assertIsNone(graph.get_father(self.father.id))
+        self.assertNotIn(0, graph)
+        with self.assertRaises(KeyError):
+            graph.get_father(0)
+
+    def test_cached_until_new_version(self):
+        graph = get_tree_graph(self.tree)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_tree_graph(self.tree)), len(graph))
+
+        # Added, but the version isn't raised before the transaction commits
+        person = Person.objects.create(tree=self.tree, first_name='Anna', sex='F')
+        with self.assertNumQueries(0):
+            self.assertNotIn(person.id, get_tree_graph(self.tree))
+        with self.assertNumQueries(3):
+            self.assertIn(person.id, get_tree_graph(self.tree, person.id))
+        self.assertIn(person.id, get_tree_graph(self.tree))
+
+        Tree.bump_versions([self.tree.pk])
+        self.tree.refresh_from_db()
+        with self.assertNumQueries(3):
+            get_tree_graph(self.tree)
+
+
+class PedigreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Twelve generations of fathers
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tree = Tree.objects.create(user=self.user, name='Test tree')
+            self.person = Person.objects.create(tree=self.tree, first_name='Generation 1', sex='M')
+            child = self.person
+            for generation in range(2, 13):
+                father = Person.objects.create(tree=self.tree, first_name=f'Generation {generation}', sex='M')
+                Child.objects.create(family=Family.objects.create(tree=self.tree, husband=father), person=child)
+                child = father
+
+    def get(self, person, **params):
+        return self.client.get(reverse('api:tree-tree-view', args=[self.tree.pk, person.pk]), params)
+
+    def count_generations(self, parents):
+        fathers = [parent for parent in parents if parent['id']]
+        return 1 + (self.count_generations(fathers[0]['parents']) if fathers else 0)
+
+    def test_generations(self):
+        for value, generations in ((None, 3), ('abc', 3), ('0', 1), ('5', 5), ('99', 10)):
+            params = {'generations': value} if value else {}
+            response = self.get(self.person, **params)
+            self.assertEqual(response.data['generations'], generations)
+            self.assertEqual(self.count_generations(response.data['tree_data']['parents']), generations)
+
+    def test_query_count(self):
+        self.get(self.person)
+        with CaptureQueriesContext(connection) as three:
+            self.get(self.person, generations=3)
+        with CaptureQueriesContext(connection) as ten:
+            self.get(self.person, generations=10)
+        self.assertEqual(len(three), len(ten))
+
+    def test_person_missing_from_cached_graph(self):
+        self.get(self.person)
+        # The version is raised when the transaction commits, which it doesn't here
+        person = Person.objects.create(tree=self.tree, first_name='Anna', sex='F')
+        Child.objects.create(family=Family.objects.get(husband=self.person.get_father()), person=person)
+
+        response = self.get(person)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tree_data']['parents'][0]['first_name'], 'Generation 2')
+
+
+class DescendantChartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        # Two descendants marry in every generation, so each couple's
+        # children can be reached through both parents
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tree = Tree.objects.create(user=user, name='Test tree')
+            self.person = Person.objects.create(tree=self.tree, first_name='Root', sex='M')
+            family = Family.objects.create(tree=self.tree, husband=self.person)
+            for generation in range(2, 11):
+                husband = Person.objects.create(tree=self.tree, first_name=f'Husband {generation}', sex='M')
+                wife = Person.objects.create(tree=self.tree, first_name=f'Wife {generation}', sex='F')
+                Child.objects.create(family=family, person=husband)
+                Child.objects.create(family=family, person=wife)
+                family = Family.objects.create(tree=self.tree, husband=husband, wife=wife)
+
+    def get_nodes(self, node):
+        """The person nodes of the chart, without the partners."""
+        nodes = [node]
+        for family in node['families']:
+            for child in family['children']:
+                nodes += self.get_nodes(child)
+        return nodes
+
+    def test_intermarriage(self):
+        response = self.client.get(
+            reverse('api:tree-descendants', kwargs={'pk': self.tree.pk, 'person_pk': self.person.pk}), {'generations': 10}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        nodes = self.get_nodes(response.data['tree_data'])
+        expanded = [node['id'] for node in nodes if not node.get('repeated')]
+        self.assertEqual(len(expanded), len(set(expanded)))
+        self.assertEqual(len(expanded), 19)
+        # Each couple's children are shown once more, from the second parent
+        self.assertEqual(len(nodes), 19 + 2 * 8)
+        for node in nodes:
+            if node.get('repeated'):
+                self.assertEqual(node['families'], [])
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='tester', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tree = Tree.objects.create(user=user, name='Test tree')
+            self.anna_maja = Person.objects.create(
+                tree=self.tree, first_name='Anna-Maja', last_name='Andersson', birth_year=1850, death_year=1920
+            )
+            self.anna = Person.objects.create(tree=self.tree, first_name='Anna', last_name='Persson', birth_year=1852)
+            self.annika = Person.objects.create(
+                tree=self.tree, first_name='Annika', last_name='Olsson', birth_year=1850, death_year=1900
+            )
+            self.per_olof = Person.objects.create(
+                tree=self.tree, first_name='Per Olof', last_name='Andersson', birth_year=1830, death_year=1900
+            )
+        self.tree.refresh_from_db()
+
+    def search(self, query, limit=10):
+        return get_typeahead_index(self.tree).search(query, limit)
+
+    def test_every_word_starts_a_name(self):
+        self.assertEqual(self.search('ann and'), [self.anna_maja.id])
+        self.assertEqual(self.search('AND maj'), [self.anna_maja.id])
+        self.assertEqual(self.search('olo'), [self.per_olof.id, self.annika.id])
+        # Olsson is found through its name key, as an other spelling of Olofsson
+        self.assertEqual(self.search('olofsson'), [self.annika.id])
+        self.assertEqual(self.search('nna'), [])
+        self.assertEqual(self.search('ann xyz'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_order(self):
+        # A name typed in full comes before longer names, then last and first name
+        self.assertEqual(self.search('per'), [self.per_olof.id, self.anna.id])
+        self.assertEqual(self.search('ann'), [self.anna_maja.id, self.anna.id, self.annika.id])
+
+    def test_years(self):
+        self.assertEqual(self.search('ann 1850'), [self.anna_maja.id, self.annika.id])
+        self.assertEqual(self.search('1900'), [self.per_olof.id, self.annika.id])
+        # With two years, the birth and death years
+        self.assertEqual(self.search('ann 1900 1850'), [self.annika.id])
+        self.assertEqual(self.search('1830 1920'), [])
+
+    def test_limit(self):
+        self.assertEqual(self.search('ann', 2), [self.anna_maja.id, self.anna.id])
+
+        url = reverse('api:tree-typeahead', args=[self.tree.pk])
+        for limit, count in (('1', 1), ('0', 1), ('abc', 3), ('1000', 3)):
+            response = self.client.get(url, {'q': 'ann', 'limit': limit})
+            self.assertEqual(len(response.data['results']), count)
+        self.assertEqual(response.data['results'][0], {
+            'id': self.anna_maja.id,
+            'full_name': self.anna_maja.get_name_years(),
+            'birth_year': 1850,
+            'death_year': 1920,
+        })
+
+    def test_cached_until_new_version(self):
+        url = reverse('api:tree-typeahead', args=[self.tree.pk])
+        self.client.get(url)
+        # The tree and the persons found are loaded, the index comes from the cache
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'q': 'ann'})
+        self.assertEqual(len(response.data['results']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            anneli = Person.objects.create(tree=self.tree, first_name='Anneli', last_name='Berg')
+        response = self.client.get(url, {'q': 'anne'})
+        self.assertEqual([person['id'] for person in response.data['results']], [anneli.id])
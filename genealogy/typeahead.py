@@ -0,0 +1,180 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .graph import csr
+from .models import Person
+from .name_functions import get_name_key, get_name_words
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Sorts after every name, so prefix + END is above all names starting with prefix
+END = '\U0010ffff'
+
+
+def get_typeahead_index(tree):
+    """
+    The TypeaheadIndex of the tree, from the cache if it was already built
+    for the tree's current version, like get_tree_graph.
+    """
+    key = f"typeahead:{tree.pk}:{tree.version}"
+    index = cache.get(key)
+    if index is None:
+        index = TypeaheadIndex.build(tree)
+        cache.set(key, index, settings.TREE_GRAPH_CACHE_TIMEOUT)
+    return index
+
+def parse_query(query):
+    """The lower case names and the years, at most two, that were typed in query."""
+    names = []
+    years = []
+    for item in query.split():
+        if item.isnumeric():
+            # If people write more than 2 years, ignore the third and more
+            if len(years) < 2:
+                years.append(int(item))
+        else:
+            names.extend(get_name_words(item))
+    return names, years
+
+
+class Tokens:
+    """The sorted names of a TypeaheadIndex, kept in one string so the index is quick to load from the cache."""
+    __slots__ = ('text', 'offsets')
+
+    def __init__(self, names):
+        self.text = ''.join(names)
+        self.offsets = array('l', [0])
+        for name in names:
+            self.offsets.append(self.offsets[-1] + len(name))
+
+    def __getstate__(self):
+        return self.text, self.offsets
+
+    def __setstate__(self, state):
+        self.text, self.offsets = state
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.text[self.offsets[i]:self.offsets[i + 1]]
+
+
+class TypeaheadIndex:
+    """
+    The first and last names of the persons of a tree for person pickers,
+    where every typed word is the start of a name. Persons are stored by
+    their position in name order. Every name in lower case, and the name key
+    of its other spellings, points to the persons that have it.
+    """
+    __slots__ = (
+        'tree_id', 'version', 'person_ids', 'birth_years', 'death_years', 'tokens',
+        'token_person_offsets', 'token_persons', 'person_token_offsets', 'person_tokens',
+    )
+
+    @classmethod
+    def build(cls, tree):
+        """Load the index of the tree in one query."""
+        index = cls()
+        index.tree_id = tree.pk
+        index.version = tree.version
+
+        rows = sorted(
+            Person.objects.filter(tree=tree).values_list(
+                'id', 'first_name', 'last_name', 'birth_year', 'death_year'
+            ).iterator(chunk_size=5000),
+            key=lambda row: (row[2].lower(), row[1].lower(), row[0]),
+        )
+        index.person_ids = array('q', (row[0] for row in rows))
+        # 0 stands for an unknown year
+        index.birth_years = array('H', (row[3] or 0 for row in rows))
+        index.death_years = array('H', (row[4] or 0 for row in rows))
+
+        person_names = []
+        for _, first_name, last_name, _, _ in rows:
+            names = {}
+            for kind, name in (('first', first_name), ('last', last_name)):
+                for word in get_name_words(name):
+                    names[word] = None
+                    names[get_name_key(word, kind)] = None
+            person_names.append(names)
+
+        tokens = sorted({name for names in person_names for name in names})
+        token_positions = {name: i for i, name in enumerate(tokens)}
+        token_persons = [[] for _ in tokens]
+        for person, names in enumerate(person_names):
+            for name in names:
+                token_persons[token_positions[name]].append(person)
+
+        index.tokens = Tokens(tokens)
+        index.token_person_offsets, index.token_persons = csr(token_persons)
+        index.person_token_offsets, index.person_tokens = csr(
+            [token_positions[name] for name in names] for names in person_names
+        )
+        return index
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return len(self.person_ids)
+
+    def prefix_range(self, prefix):
+        """The positions in tokens of the names starting with prefix, as a range."""
+        return range(bisect_left(self.tokens, prefix), bisect_left(self.tokens, prefix + END))
+
+    def person_count(self, token_range):
+        return self.token_person_offsets[token_range.stop] - self.token_person_offsets[token_range.start]
+
+    def has_years(self, person, years):
+        # With two years, the first is the birth year and the second the death year
+        if len(years) == 2:
+            return self.birth_years[person] == min(years) and self.death_years[person] == max(years)
+        if len(years) == 1:
+            return years[0] in (self.birth_years[person], self.death_years[person])
+        return True
+
+    def candidates(self, token_range):
+        """The persons with a name in token_range, the ones with the first of those names first."""
+        for token in token_range:
+            yield from self.token_persons[self.token_person_offsets[token]:self.token_person_offsets[token + 1]]
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        The ids of at most limit persons that have a name starting with every
+        name in query and the years in it. They are ordered by the name that
+        matched, so a name typed in full comes before longer ones, and then by
+        last and first name.
+        """
+        names, years = parse_query(query)
+        if not names and not years:
+            return []
+
+        ranges = sorted((self.prefix_range(name) for name in names), key=self.person_count)
+        if ranges and not ranges[0]:
+            return []
+        # The names with the fewest persons are walked, the other names are checked per person
+        candidates = self.candidates(ranges[0]) if ranges else range(len(self.person_ids))
+        others = ranges[1:]
+
+        seen = set()
+        found = []
+        for person in candidates:
+            if person in seen:
+                continue
+            seen.add(person)
+            if not self.has_years(person, years):
+                continue
+            person_tokens = self.person_tokens[self.person_token_offsets[person]:self.person_token_offsets[person + 1]]
+            if all(any(token in token_range for token in person_tokens) for token_range in others):
+                found.append(person)
+                if len(found) == limit:
+                    break
+        return [self.person_ids[person] for person in found]
@@ -38,17 +38,17 @@ from ..models import (
     ImageLike,
     ImagePerson,
     Person,
-    Tree
+    Tree,
+    vital_events_prefetch
 )
 
 from ..date_functions import extract_year
-
-from functools import reduce
+from ..typeahead import get_typeahead_index
 
 # person/<int:pk>
 @login_required
 def person(request, pk):
-    this_person = get_object_or_404(Person, pk=pk)
+    this_person = get_object_or_404(Person.objects.with_vital_events(), pk=pk)
     if this_person.tree.user != request.user:
         raise Http404("Person not found in any of your trees.")
 
@@ -65,7 +65,7 @@ def person(request, pk):
     families = None
     children_objects = Child.objects.filter(person=this_person)
     if children_objects:
-        siblings = Child.objects.filter(family=children_objects[0].family).exclude(id=children_objects[0].id).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year')
+        siblings = Child.objects.filter(family=children_objects[0].family).exclude(id=children_objects[0].id).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year').select_related('person').prefetch_related(vital_events_prefetch('person__events'))
 
         half_sibling_queries = Q()
         if father is not None:
@@ -74,12 +74,14 @@ def person(request, pk):
             half_sibling_queries |= Q(wife=mother) & ~Q(husband=father)
 
         half_sibling_families = Family.objects.filter(half_sibling_queries)
-        half_siblings = Child.objects.filter(family__in=half_sibling_families).exclude(person=this_person).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year')
+        half_siblings = Child.objects.filter(family__in=half_sibling_families).exclude(person=this_person).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year').select_related('person').prefetch_related(vital_events_prefetch('person__events'))
     
     timeline_events = []
     timeline_events_no_year = []
 
-    family_objects = Family.objects.filter(Q(husband=this_person) | Q(wife=this_person))
+    family_objects = Family.objects.filter(Q(husband=this_person) | Q(wife=this_person)).select_related('husband', 'wife').prefetch_related(
+        vital_events_prefetch('husband__events'), vital_events_prefetch('wife__events')
+    )
     if family_objects:
         families = []
         for f in family_objects:
@@ -90,7 +92,7 @@ def person(request, pk):
             }
 
             # Sort children based on birth year
-            family['children'] = Child.objects.filter(family=f).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year')
+            family['children'] = Child.objects.filter(family=f).annotate(birth_year=Subquery(birth_year_subquery, output_field=PositiveSmallIntegerField())).order_by('birth_year').select_related('person').prefetch_related(vital_events_prefetch('person__events'))
 
             # Add timeline events for children
             for child in family['children']:
@@ -815,33 +817,11 @@ def get_families(person):
 
 def get_dropdown_persons(query, pk):
     if query:
-        db_query_items = []
-        query_items = query.split(" ")
-        years = []
-        for q in query_items:
-            if q.isnumeric():
-                # If people write more than 2 years, ignore the third and more
-                if len(years) < 2:
-                    years.append(q)
-            else:
-                item = (Q(first_name__icontains=q) | Q(last_name__icontains=q))
-                db_query_items.append(item)
-        # With two years, the queries need to separated
-        if len(years) == 2:
-            birth_query = (Q(event__event_type='birth') & Q(event__year=min(years)))
-            death_query = (Q(event__event_type='death') & Q(event__year=max(years)))
-        elif len(years) == 1:
-            birth_query = ((Q(event__event_type='birth') & Q(event__year=q)) | (Q(event__event_type='death') & Q(event__year=q)))
-        if years:
-            db_query_items.append(birth_query)
         tree = Tree.objects.get(pk=pk)
-        persons = Person.objects.filter(reduce(lambda x, y: x & y, db_query_items) & Q(tree=tree))
-        # If two years included, also search for specific death year
-        if len(years) == 2:
-            persons = persons.filter(death_query)
-        
-        # Get first 10 results
-        persons = persons[:10]
+        # Names are matched from their start, see genealogy.typeahead
+        person_ids = get_typeahead_index(tree).search(query)
+        persons_by_id = Person.objects.in_bulk(person_ids)
+        persons = [persons_by_id[person_id] for person_id in person_ids if person_id in persons_by_id]
 
     else:
         persons = Person.objects.none()
@@ -10,37 +10,19 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 
 from .common import *
+from ..export_cache import export_response
 from ..forms import EditTreeForm, NewTreeForm, SearchForm
-from .. import gedcom
+from ..graph import get_tree_graph
 from ..models import Child, Event, Family, FamilyEvent, Person, Tree
+from ..name_functions import get_name_key, has_variants
+from ..pedigree import Pedigree, get_generations
+from ..search import PersonTextSearch
+from ..tasks import start_import
 
 from functools import reduce
 
-from genealogy.constants import NAMES_REPLACE, SURNAMES_REPLACE
-
-import datetime
 import json
 
-EVENT_MAPPING = {
-    'residence': 'RESI',
-    'emigration': 'EMIG',
-    'baptism': 'BAPM',
-    'funeral': 'BURI',
-    'immigration': 'IMMI',
-    'graduation': 'GRAD',
-    'cremation': 'CREM',
-    'confirmation': 'CONF',
-    'birth': 'BIRT',
-    'death': 'DEAT',
-}
-
-FAMILY_EVENT_MAPPING = {
-    'marriage': 'MARR',
-    'divorce': 'DIV',
-    'banns': 'MARB',
-    'engagement': 'ENGA',
-}
-
 # tree/
 @login_required
 @transaction.atomic
@@ -62,9 +44,10 @@ def family_tree(request):
 
                 # If a GEDCOM file was uploaded, add all Person, Family, and Child to DB
                 if new_tree.gedcom_file:
-                    gedcom.handle_uploaded_file(new_tree)
-
-                messages.success(request, 'New tree added successfully!')
+                    start_import(new_tree)
+                    messages.success(request, 'New tree added successfully! The GEDCOM file is being imported.')
+                else:
+                    messages.success(request, 'New tree added successfully!')
 
                 # We don't want to save the properties in the form if new tree is added
                 form = NewTreeForm()
@@ -111,11 +94,12 @@ def view_tree(request, tree_pk, person_pk):
     if first_person.tree != this_tree:
         raise Http404("Person not found in this tree.")
 
-    generations = 3
+    generations = get_generations(request.GET.get('generations'))
+    pedigree = Pedigree(get_tree_graph(this_tree, first_person.id), first_person, generations)
 
     people_data = get_person_tree_data(first_person)
 
-    people_data['parents'] = tree_get_parents(first_person, 1, generations, tree_pk)
+    people_data['parents'] = tree_get_parents(first_person, 1, generations, tree_pk, pedigree)
 
     family = Family.objects.filter(Q(husband=first_person) | Q(wife=first_person))
     if family:
@@ -203,95 +187,7 @@ def download_tree(request, pk):
     if this_tree.user != request.user:
         raise Http404("Tree not found for this user.")
 
-    content = f'''0 HEAD
-1 SUBM @SUBM1@
-1 SOUR Project Heirloom
-2 _TREE {this_tree.name}
-1 DATE {datetime.datetime.now().strftime("%d %b %Y")}
-2 TIME {datetime.datetime.now().strftime("%X")}
-1 GEDC
-2 VERS 5.5.1
-2 FORM LINEAGE-LINKED
-1 CHAR UTF-8
-0 @SUBM1@ SUBM
-1 NAME Project Heirloom Member Trees Submitter
-'''
-
-    indi_id_counter = 1
-    family_id_counter = 1
-
-    family_instances = list(Family.objects.filter(tree=this_tree))
-    for fam in family_instances:
-        fam.family_id = f"@F{str(family_id_counter)}@"
-        family_id_counter += 1
-    Family.objects.bulk_update(family_instances, ["family_id"])
-
-    individual_instances = list(Person.objects.filter(tree=this_tree))
-    for person in individual_instances:
-        person.indi_id = f"@I{str(indi_id_counter)}@"
-        indi_id_counter += 1
-
-        content += f"0 {person.indi_id} INDI\n"
-        name = ""
-        if person.first_name:
-            name += f"{person.first_name} "
-        if person.last_name:
-            name += f"/{person.last_name}/"
-        if name:
-            content += f"1 NAME {name}\n"
-            if person.first_name:
-                content += f"2 GIVN {person.first_name}\n"
-            if person.last_name:
-                content += f"2 SURN {person.last_name}\n"
-        
-        content += f"1 SEX {person.sex}\n"
-        try:
-            child = Child.objects.get(person=person)
-            content += f"1 FAMC {child.family.family_id}\n"
-        except:
-            pass
-
-        indi_families = Family.objects.filter(Q(husband=person) or Q(wife=person))
-        for fam in indi_families:
-            content += f"1 FAMS {fam.family_id}\n"
-
-        indi_events = Event.objects.filter(person=person)
-        for event in indi_events:
-            content += f"1 {EVENT_MAPPING[event.event_type]}\n"
-            if event.date:
-                content += f"2 DATE {event.date}\n"
-            if event.place:
-                content += f"2 PLAC {event.place}\n"
-            if event.description:
-                content += f"2 NOTE {event.description}\n"
-
-    Person.objects.bulk_update(individual_instances, ["indi_id"])
-
-    for fam in family_instances:
-        content += f"0 {fam.family_id} FAM\n"
-        if fam.husband:
-            content += f"1 HUSB {fam.husband.indi_id}\n"
-        if fam.wife:
-            content += f"1 WIFE {fam.wife.indi_id}\n"
-
-        children = Child.objects.filter(family=fam)
-        for child in children:
-            content += f"1 CHIL {child.person.indi_id}\n"
-
-        family_events = FamilyEvent.objects.filter(family=fam)
-        for event in family_events:
-            content += f"1 {FAMILY_EVENT_MAPPING[event.event_type]}\n"
-            if event.date:
-                content += f"2 DATE {event.date}\n"
-            if event.place:
-                content += f"2 PLAC {event.place}\n"
-            if event.description:
-                content += f"2 NOTE {event.description}\n"
-
-    response = HttpResponse(content, content_type="text/plain")
-    response["Content-Disposition"] = f'attachment; filename="{this_tree.name}.ged"'
-
-    return response
+    return export_response(request, this_tree)
 
 # tree/get-list
 @login_required
@@ -302,13 +198,13 @@ def get_tree_list(request):
     return render(request, 'genealogy/tree_list.html', {'trees': trees})
 
 
-def tree_get_parents(current_person, generation, max_generation, tree_pk):
+def tree_get_parents(current_person, generation, max_generation, tree_pk, pedigree):
     if generation == max_generation:
         return []
 
     parents = []
-    father = current_person.get_father()
-    mother = current_person.get_mother()
+    father = pedigree.get_father(current_person)
+    mother = pedigree.get_mother(current_person)
     if father:
         parents.append({
             'first_name': father.first_name,
@@ -320,7 +216,7 @@ def tree_get_parents(current_person, generation, max_generation, tree_pk):
             'tree_url': reverse('genealogy:view_tree', kwargs={'tree_pk': tree_pk, 'person_pk': father.id}),
             'edit_url': reverse('genealogy:edit_person', kwargs={'pk': father.id}),
             'parent_type': 'father',
-            'parents': tree_get_parents(father, generation + 1, max_generation, tree_pk)
+            'parents': tree_get_parents(father, generation + 1, max_generation, tree_pk, pedigree)
         })
     else:
         parents.append({
@@ -341,7 +237,7 @@ def tree_get_parents(current_person, generation, max_generation, tree_pk):
             'tree_url': reverse('genealogy:view_tree', kwargs={'tree_pk': tree_pk, 'person_pk': mother.id}),
             'edit_url': reverse('genealogy:edit_person', kwargs={'pk': mother.id}),
             'parent_type': 'mother',
-            'parents': tree_get_parents(mother, generation + 1, max_generation, tree_pk)
+            'parents': tree_get_parents(mother, generation + 1, max_generation, tree_pk, pedigree)
         })
     else:
         parents.append({
@@ -368,7 +264,7 @@ def search(request):
             
             and_conditions = []
             or_conditions = []
-            name_conditions = []
+            text_search = PersonTextSearch(cd['tree'])
             birth_conditions = []
             death_conditions = []
 
@@ -378,64 +274,39 @@ def search(request):
                 query += f"&name={cd['name']}"
                 name_strings = cd['name'].split()
                 for name in name_strings:
-                    name_or_conditions = []
-                    found_first = False
-                    found_last = False
-                    for n in NAMES_REPLACE:
-                        if name in n:
-                            for variation in n:
-                                name_or_conditions.append(Q(first_name__icontains=variation))
-                                # Only search first name for variations of the same name
-                                if variation == name:
-                                    name_or_conditions.append(Q(last_name__icontains=variation))
-                                found_first = True
-                            if found_first:
-                                break
-                    if found_first == False:
-                        for n in SURNAMES_REPLACE:
-                            if name in n:
-                                for variation in n:
-                                    name_or_conditions.append(Q(last_name__icontains=variation))
-                                    # Only search first name for variations of the same name
-                                    if variation == name:
-                                        name_or_conditions.append(Q(first_name__icontains=variation))
-                                    found_last = True
-                                if found_last:
-                                    break
-                        if found_last == False:
-                            name_or_conditions.append(Q(first_name__icontains=name))
-                            name_or_conditions.append(Q(last_name__icontains=name))
-
-                    name_or_conditions = reduce(lambda x, y: x | y, name_or_conditions)
-                    if name_conditions:
-                        name_conditions = name_conditions & name_or_conditions
+                    # All spellings of a first name are found among first names through
+                    # the name keys, but only this one among last names, and the other way around
+                    if has_variants(name, 'first'):
+                        text_search.add([('last_name', name)], [('first', get_name_key(name, 'first'))])
+                    elif has_variants(name, 'last'):
+                        text_search.add([('first_name', name)], [('last', get_name_key(name, 'last'))])
                     else:
-                        name_conditions = name_or_conditions
+                        text_search.add([('first_name', name), ('last_name', name)])
 
             if cd['birth_place']:
                 query += f"&birth_place={cd['birth_place']}"
-                birth_conditions.append(Q(event__place__icontains=cd['birth_place']))
+                text_search.add([('birth_place', cd['birth_place'])])
             if cd['birth_date']:
                 query += f"&birth_date={cd['birth_date']}"
-                birth_conditions.append(Q(event__date__icontains=cd['birth_date']))
+                birth_conditions.append(Q(birth_date__icontains=cd['birth_date']))
             if cd['birth_year_start']:
                 query += f"&birth_year_start={cd['birth_year_start']}"
-                birth_conditions.append(Q(event__year__gte=cd['birth_year_start']))
+                birth_conditions.append(Q(birth_year__gte=cd['birth_year_start']))
             if cd['birth_year_end']:
                 query += f"&birth_year_end={cd['birth_year_end']}"
-                birth_conditions.append(Q(event__year__lte=cd['birth_year_end']))
+                birth_conditions.append(Q(birth_year__lte=cd['birth_year_end']))
             if cd['death_place']:
                 query += f"&death_place={cd['death_place']}"
-                death_conditions.append(Q(event__place__icontains=cd['death_place']))
+                text_search.add([('death_place', cd['death_place'])])
             if cd['death_date']:
                 query += f"&death_date={cd['death_date']}"
-                death_conditions.append(Q(event__date__icontains=cd['death_date']))
+                death_conditions.append(Q(death_date__icontains=cd['death_date']))
             if cd['death_year_start']:
                 query += f"&death_year_start={cd['death_year_start']}"
-                death_conditions.append(Q(event__year__gte=cd['death_year_start']))
+                death_conditions.append(Q(death_year__gte=cd['death_year_start']))
             if cd['death_year_end']:
                 query += f"&death_year_end={cd['death_year_end']}"
-                death_conditions.append(Q(event__year__lte=cd['death_year_end']))
+                death_conditions.append(Q(death_year__lte=cd['death_year_end']))
 
             final_query = Q(tree=cd['tree'])
             if and_conditions:
@@ -444,17 +315,13 @@ def search(request):
             if or_conditions:
                 combined_or_conditions = reduce(lambda x, y: x | y, or_conditions)
                 final_query = final_query & combined_or_conditions
-            if name_conditions:
-                final_query = final_query & name_conditions
+            if text_search:
+                final_query = final_query & text_search.get_q()
+            for condition in birth_conditions + death_conditions:
+                final_query = final_query & condition
 
             results_per_page = cd['results_per_page']
             people = Person.objects.filter(final_query)
-            if birth_conditions:
-                birth_query = Q(event__event_type='birth') & reduce(lambda x, y: x & y, birth_conditions)
-                people = people.filter(birth_query)
-            if death_conditions:
-                death_query = Q(event__event_type='death') & reduce(lambda x, y: x & y, death_conditions)
-                people = people.filter(death_query)
             paginator = Paginator(people, results_per_page)
             page_number = request.GET.get('page', 1)
             try:
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 
+import os
+import tempfile
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -187,4 +190,42 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 CORS_ALLOWED_ORIGINS = ['http://localhost:5173']
 CORS_ALLOW_CREDENTIALS = True
 
-AUTH_USER_MODEL = 'users.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'users.User'
+
+# Number of processes used to parse uploaded GEDCOM files. 0 or 1 parses in the
+# importing process, which is the default. More than one only helps on a server
+# with spare cores, measure with the benchmark_gedcom_parse command before
+# turning it on. The workers need a Celery pool that allows child processes,
+# for example --pool=threads or --pool=solo.
+GEDCOM_PARSE_WORKERS = int(os.environ.get('GEDCOM_PARSE_WORKERS', 0))
+
+# Downloaded GEDCOM files are kept here and reused until the tree changes. The
+# least recently downloaded files are removed when the total size goes above
+# GEDCOM_EXPORT_CACHE_SIZE bytes. The files hold the private data of users'
+# trees, so the directory is outside the project and MEDIA_ROOT, which is served.
+GEDCOM_EXPORT_CACHE_DIR = Path(os.environ.get(
+    'GEDCOM_EXPORT_CACHE_DIR', Path(tempfile.gettempdir()) / 'heirloom-export-cache'
+))
+GEDCOM_EXPORT_CACHE_SIZE = 500 * 1024 * 1024
+
+# The family graph of a tree (genealogy.graph) is kept in the default cache for
+# this many seconds. It is rebuilt as soon as the tree changes, so this only
+# limits how long graphs of trees nobody looks at stay in memory. Without a
+# CACHES setting every process has its own local memory cache.
+TREE_GRAPH_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Keep a table with every ancestor of every person (genealogy.AncestorLink), so
+# ancestry filters are single queries. It can get large for big trees, so it
+# is off unless ANCESTOR_CLOSURE=1. Run manage.py rebuild_ancestor_links after
+# turning it on.
+ANCESTOR_CLOSURE = os.environ.get('ANCESTOR_CLOSURE', '0') == '1'
+
+# Celery
+# GEDCOM imports run as Celery tasks. Without a configured broker the tasks
+# run eagerly in the web process, which is enough for development and tests,
+# but then an upload only answers once the whole import has finished. Set
+# CELERY_BROKER_URL in production.
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'memory://')
+CELERY_TASK_ALWAYS_EAGER = 'CELERY_BROKER_URL' not in os.environ
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
\ No newline at end of file
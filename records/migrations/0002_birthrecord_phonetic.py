@@ -0,0 +1,62 @@
+# Generated by Django 4.2.17 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+from genealogy.migrations._name_keys import get_phonetic_keys
+
+BATCH_SIZE = 500
+
+
+def fill_phonetic(apps, schema_editor):
+    BirthRecord = apps.get_model('records', 'BirthRecord')
+    fields = ['first_name_phonetic', 'father_last_name_phonetic', 'mother_last_name_phonetic']
+    batch = []
+    for birth_record in BirthRecord.objects.order_by('id').only(
+        'first_name', 'father_last_name', 'mother_last_name'
+    ).iterator(chunk_size=BATCH_SIZE):
+        birth_record.first_name_phonetic = ' '.join(get_phonetic_keys(birth_record.first_name, 'first'))
+        birth_record.father_last_name_phonetic = ' '.join(get_phonetic_keys(birth_record.father_last_name, 'last'))
+        birth_record.mother_last_name_phonetic = ' '.join(get_phonetic_keys(birth_record.mother_last_name, 'last'))
+        batch.append(birth_record)
+        if len(batch) >= BATCH_SIZE:
+            BirthRecord.objects.bulk_update(batch, fields)
+            batch = []
+    BirthRecord.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='birthrecord',
+            name='father_last_name_phonetic',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='birthrecord',
+            name='first_name_phonetic',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='birthrecord',
+            name='mother_last_name_phonetic',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='birthrecord',
+            index=models.Index(fields=['first_name_phonetic'], name='records_bir_first_n_f75328_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='birthrecord',
+            index=models.Index(fields=['father_last_name_phonetic'], name='records_bir_father__b72c1f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='birthrecord',
+            index=models.Index(fields=['mother_last_name_phonetic'], name='records_bir_mother__4d5b8c_idx'),
+        ),
+        migrations.RunPython(fill_phonetic, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 
+from genealogy.name_functions import get_phonetic_keys
+
 
 class Record(models.Model):
     """Represents a historical record source (e.g., a parish birth book)"""
@@ -50,6 +52,11 @@ class BirthRecord(models.Model):
     archive_info = models.TextField(blank=True)
     link = models.URLField(max_length=500, blank=True)
     notes = models.TextField(blank=True)
+
+    # Phonetic keys of the names, see genealogy.name_functions.get_phonetic_key
+    first_name_phonetic = models.CharField(max_length=100, blank=True)
+    father_last_name_phonetic = models.CharField(max_length=100, blank=True)
+    mother_last_name_phonetic = models.CharField(max_length=100, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -60,8 +67,22 @@ class BirthRecord(models.Model):
             models.Index(fields=['first_name']),
             models.Index(fields=['father_last_name']),
             models.Index(fields=['mother_last_name']),
+            models.Index(fields=['first_name_phonetic']),
+            models.Index(fields=['father_last_name_phonetic']),
+            models.Index(fields=['mother_last_name_phonetic']),
         ]
 
+    @staticmethod
+    def phonetic(name, kind):
+        """The phonetic keys of all names in name, separated by spaces."""
+        return ' '.join(get_phonetic_keys(name, kind))
+
+    def save(self, *args, **kwargs):
+        self.first_name_phonetic = BirthRecord.phonetic(self.first_name, 'first')
+        self.father_last_name_phonetic = BirthRecord.phonetic(self.father_last_name, 'last')
+        self.mother_last_name_phonetic = BirthRecord.phonetic(self.mother_last_name, 'last')
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.first_name} ({self.birth_year})"
 
@@ -1,3 +1,31 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .models import BirthRecord, Record
+
+
+class BirthRecordSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        record = Record.objects.create(title='Södra Ny födelsebok 1783-1823')
+        for first_name, father_last_name in (
+            ('Carl Johan', 'Olofsson'), ('Karl', 'Olsson'), ('Kerstin', 'Andersson'), ('Carolina', 'Anderson'),
+        ):
+            BirthRecord.objects.create(record=record, first_name=first_name, father_last_name=father_last_name, birth_year=1800)
+
+    def search(self, **params):
+        response = self.client.get(reverse('records:birth-record-search'), params)
+        results = response.data['results'] if isinstance(response.data, dict) else response.data
+        return sorted(result['first_name'] for result in results)
+
+    def test_phonetic_keys_saved(self):
+        birth_record = BirthRecord.objects.get(first_name='Carl Johan')
+        self.assertEqual(birth_record.first_name_phonetic, 'krl jn')
+        self.assertEqual(birth_record.father_last_name_phonetic, BirthRecord.objects.get(first_name='Karl').father_last_name_phonetic)
+
+    def test_phonetic_search(self):
+        # Names that sound the same, at the start of the names in the record
+        self.assertEqual(self.search(first_name='Karl', phonetic='1'), ['Carl Johan', 'Karl'])
+        self.assertEqual(self.search(father_last_name='Andersson', phonetic='1'), ['Carolina', 'Kerstin'])
+        # Without phonetic, a part of the name
+        self.assertEqual(self.search(first_name='arl'), ['Carl Johan', 'Karl'])
@@ -11,6 +11,21 @@ def home(request):
     return HttpResponse("Home page")
 
 
+def filter_name(queryset, field, name, kind, phonetic):
+    """
+    Birth records where field contains name, or with phonetic, where the names
+    in field start with names that sound like the ones in name, so "Ana" also
+    finds "Anna Maria".
+    """
+    keys = BirthRecord.phonetic(name, kind) if phonetic else ''
+    if not keys:
+        return queryset.filter(**{f'{field}__icontains': name})
+    # The phonetic keys are separated by spaces, so longer names sort between
+    # keys + ' ' and keys + '!'. Unlike startswith, that range can use the index.
+    field = f'{field}_phonetic'
+    return queryset.filter(Q(**{field: keys}) | Q(**{f'{field}__gte': keys + ' ', f'{field}__lt': keys + '!'}))
+
+
 class RecordListView(generics.ListAPIView):
     """List all historical record sources"""
     queryset = Record.objects.all()
@@ -43,10 +58,12 @@ class BirthRecordSearchView(generics.ListAPIView):
         father_last_name = self.request.query_params.get('father_last_name', None)
         mother_last_name = self.request.query_params.get('mother_last_name', None)
         record_id = self.request.query_params.get('record', None)
+        # Find names that sound like the given ones, instead of names that contain them
+        phonetic = self.request.query_params.get('phonetic') == '1'
         
         # Apply filters
         if first_name:
-            queryset = queryset.filter(first_name__icontains=first_name)
+            queryset = filter_name(queryset, 'first_name', first_name, 'first', phonetic)
         
         if sex:
             queryset = queryset.filter(sex=sex)
@@ -64,10 +81,10 @@ class BirthRecordSearchView(generics.ListAPIView):
             queryset = queryset.filter(location__icontains=location)
         
         if father_last_name:
-            queryset = queryset.filter(father_last_name__icontains=father_last_name)
+            queryset = filter_name(queryset, 'father_last_name', father_last_name, 'last', phonetic)
         
         if mother_last_name:
-            queryset = queryset.filter(mother_last_name__icontains=mother_last_name)
+            queryset = filter_name(queryset, 'mother_last_name', mother_last_name, 'last', phonetic)
         
         if record_id:
             queryset = queryset.filter(record_id=record_id)